@@ -1,9 +1,10 @@
-import numpy as np
-import numpy.random as rnd
 from math import exp
 
 import alns.utils as utils
+from alns.batch import make_candidate
 from alns.operators import DestroyOperator, RepairOperator
+from alns.profiling import NULL_PROFILER
+from alns.selection import DEFAULT_SELECTION, SELECTIONS
 from alns.solution_instance import SolutionInstance
 
 
@@ -11,18 +12,34 @@ class ALNS:
 
     def __init__(self, initial_solution: SolutionInstance,
                  statistics,
-                 rnd_state=rnd.RandomState()):
-        self.destroy_operator = DestroyOperator()
-        self.repair_operator = RepairOperator()
+                 rnd_state=None,
+                 batch_size=1,
+                 candidate_pool=None,
+                 profiler=NULL_PROFILER,
+                 repair_class=RepairOperator,
+                 repair_settings=None,
+                 selection=DEFAULT_SELECTION,
+                 paired=False):
+        # the operators draw from the same generator as the acceptance
+        self.rnd_state = utils.random_state() if rnd_state is None else rnd_state
+        self.destroy_operator = DestroyOperator(self.rnd_state, selection)
+        self.repair_operator = repair_class(self.rnd_state, selection, repair_settings)
+        # paired, one policy chooses among the destroy x repair pairs, the
+        # operators still keep their own for the statistics
+        self.pairs = None
+        if paired:
+            self.pairs = SELECTIONS[selection](self.destroy_operator.num_operators *
+                                               self.repair_operator.num_operators)
         self.curr_state = self.best = self.initial_solution = self.original_solution = initial_solution
-        self.rnd_state = rnd_state
         self.statistics = statistics
+        self.batch_size = batch_size
+        self.candidate_pool = candidate_pool
+        self.profiler = profiler
 
-    @staticmethod
-    def choose_next_state_metropolis(metropolis: float,
+    def choose_next_state_metropolis(self, metropolis: float,
                                      curr_state,
                                      candidate_state):
-        if np.random.uniform() <= metropolis:
+        if self.rnd_state.uniform() <= metropolis:
             return candidate_state, utils.ACCEPTED
         return curr_state, utils.REJECTED
 
@@ -30,6 +47,9 @@ class ALNS:
     def metropolis(curr_state_eval: float, candidate_eval: float,
                    curr_temp: float) -> float:
         diff = candidate_eval - curr_state_eval
+        if diff / curr_temp >= 0:
+            # exp would only be capped at 1 (or overflow)
+            return 1
         met = min(exp(diff / curr_temp), 1)
         return met
 
@@ -52,14 +72,107 @@ class ALNS:
 
         return score, count_no_improvement
 
+    def receive_migrant(self, migrant: SolutionInstance, replace_current: bool):
+        """Takes in an elite solution found elsewhere"""
+        if migrant < self.best:
+            self.best = migrant
+        if replace_current or migrant < self.curr_state:
+            self.curr_state = migrant
+
+    def add_iteration_info(self, temp, score_idx) -> None:
+        self.statistics.add_iteration(temp, self.curr_state.value, self.best.value,
+                                      self.destroy_operator.index, self.repair_operator.index, score_idx)
+
+    def record_outcome(self, score_idx, delta, destroy_idx=None, repair_idx=None) -> None:
+        self.destroy_operator.record_outcome(score_idx, delta, destroy_idx)
+        self.repair_operator.record_outcome(score_idx, delta, repair_idx)
+
+    def select_operators(self) -> tuple:
+        """Indexes of the destroy and repair operators of the next candidate"""
+        if self.pairs is None:
+            return self.destroy_operator.select(), self.repair_operator.select()
+        destroy_idx, repair_idx = divmod(int(self.pairs.select(self.rnd_state)), self.repair_operator.num_operators)
+        self.destroy_operator.index, self.repair_operator.index = destroy_idx, repair_idx
+        return destroy_idx, repair_idx
+
+    def update_score(self, score, destroy_idx, repair_idx, seconds) -> None:
+        """Credits the operators of a candidate (and their pair) with its score and their CPU seconds"""
+        self.destroy_operator.update_score(score, destroy_idx, seconds[0])
+        self.repair_operator.update_score(score, repair_idx, seconds[1])
+        if self.pairs is not None:
+            self.pairs.update(destroy_idx * self.repair_operator.num_operators + repair_idx, score, sum(seconds))
+
+    def update_weights(self, decay) -> None:
+        """Ends the segment of the selection policies"""
+        self.destroy_operator.update_weights(decay)
+        self.repair_operator.update_weights(decay)
+        if self.pairs is not None:
+            self.pairs.end_segment(decay)
+
+    def candidate_score(self, candidate) -> int:
+        """Score of a candidate of the batch that was not the one chosen"""
+        if candidate < self.best:
+            return utils.BEST
+        if candidate < self.curr_state:
+            return utils.BETTER
+        return utils.REJECTED
+
+    def generate_candidates(self) -> list:
+        """
+        Candidates of a batched iteration with their (destroy, repair, seed)
+        draws, recording the calls of their operators, and the CPU seconds
+        of the operators
+        """
+        draws = [(*self.select_operators(), self.rnd_state.randint(2**31))
+                 for _ in range(self.batch_size)]
+
+        if self.candidate_pool is not None:
+            candidates = self.candidate_pool.generate(self.curr_state, draws)
+        else:
+            candidates = [make_candidate(self.curr_state, *draw, self.repair_operator) for draw in draws]
+        for (_, seconds, wall), (destroy_idx, repair_idx, _) in zip(candidates, draws):
+            self.destroy_operator.record_call(destroy_idx, wall[0], seconds[0])
+            self.repair_operator.record_call(repair_idx, wall[1], seconds[1])
+        return [(candidate, draw, seconds) for (candidate, seconds, _), draw in zip(candidates, draws)]
+
+    def run_batch(self, scores, temp, count_no_improvement):
+        candidates = self.generate_candidates()
+        chosen, (destroy_idx, repair_idx, _), seconds = min(candidates, key=lambda c: c[0].value)
+
+        # every evaluated candidate credits its operators
+        current_value = self.curr_state.value
+        for candidate, (d_idx, r_idx, _), candidate_seconds in candidates:
+            if candidate is not chosen:
+                score_idx = self.candidate_score(candidate)
+                self.update_score(scores[score_idx], d_idx, r_idx, candidate_seconds)
+                self.record_outcome(score_idx, candidate.value - current_value, d_idx, r_idx)
+
+        self.destroy_operator.index = destroy_idx
+        self.repair_operator.index = repair_idx
+        score_idx, count_no_improvement = self.decision_candidate(chosen, temp, count_no_improvement)
+        self.add_iteration_info(temp, score_idx)
+        self.record_outcome(score_idx, chosen.value - current_value)
+        self.update_score(scores[score_idx], destroy_idx, repair_idx, seconds)
+
+        return count_no_improvement
+
     def run(self, scores, temp, count_no_improvement):
+        if self.batch_size > 1:
+            return self.run_batch(scores, temp, count_no_improvement)
 
-        destroyed = self.destroy_operator(self.curr_state, self.rnd_state)
-        repaired = self.repair_operator(destroyed, self.curr_state)
+        current_value = self.curr_state.value
+        destroy_idx, repair_idx = self.select_operators()
+        with self.profiler.phase('destroy'):
+            destroyed = self.destroy_operator.apply(destroy_idx, self.curr_state, self.rnd_state)
+        with self.profiler.phase('repair'):
+            repaired = self.repair_operator.apply(repair_idx, destroyed, self.curr_state, self.rnd_state)
 
-        score_idx, count_no_improvement = self.decision_candidate(repaired, temp, count_no_improvement)
+        with self.profiler.phase('evaluation'):
+            score_idx, count_no_improvement = self.decision_candidate(repaired, temp, count_no_improvement)
+            self.add_iteration_info(temp, score_idx)
+            self.record_outcome(score_idx, repaired.value - current_value)
 
-        self.destroy_operator.update_score(scores[score_idx])
-        self.repair_operator.update_score(scores[score_idx])
+        self.update_score(scores[score_idx], destroy_idx, repair_idx,
+                          (self.destroy_operator.seconds, self.repair_operator.seconds))
 
         return count_no_improvement
@@ -0,0 +1,66 @@
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter, process_time
+
+from alns import utils
+from alns.compact_instance import CompactInstance
+from alns.operators import DestroyOperator, RepairOperator
+from alns.solution_instance import SolutionInstance
+
+_instance = None
+_repair = RepairOperator
+
+
+def _init_worker(instance: CompactInstance, repair_class, repair_settings) -> None:
+    global _instance, _repair
+    _instance = instance
+    # the worker draws from the generator of each candidate, not from the operator's
+    _repair = repair_class(None, settings=repair_settings)
+
+
+def make_candidate(current: SolutionInstance, destroy_idx: int, repair_idx: int, seed: int,
+                   repair=RepairOperator) -> tuple:
+    """
+    Destroys and repairs the current state with the given operators, drawing
+    from a generator of seed; repair is the RepairOperator (class or
+    instance, with its settings) of the repair index. Returns the candidate
+    and the CPU and the wall seconds, each of the destroy and of the repair
+    """
+    random_state = utils.random_state(seed)
+    wall, cpu = perf_counter(), process_time()
+    destroyed = DestroyOperator.operators[destroy_idx](current, random_state)
+    destroy_wall, destroy_cpu = perf_counter() - wall, process_time() - cpu
+    candidate = repair.operators[repair_idx](destroyed, current, random_state)
+    return candidate, (destroy_cpu, process_time() - cpu - destroy_cpu), \
+        (destroy_wall, perf_counter() - wall - destroy_wall)
+
+
+def _candidate(state, destroy_idx: int, repair_idx: int, seed: int):
+    current = SolutionInstance.from_state(_instance, state)
+    candidate, seconds, wall = make_candidate(current, destroy_idx, repair_idx, seed, _repair)
+    return candidate.to_state(), seconds, wall
+
+
+class CandidatePool:
+    """
+    Worker processes generating the candidates of a batched ALNS
+    iteration. Each worker receives the instance once and then only
+    exchanges solution states (see SolutionInstance.to_state), nodes
+    included, so that a solution without edges keeps its node.
+    """
+
+    def __init__(self, instance: CompactInstance, n_workers: int, repair_class=RepairOperator,
+                 repair_settings: dict = None) -> None:
+        self.instance = instance
+        self.executor = ProcessPoolExecutor(max_workers=n_workers,
+                                            initializer=_init_worker,
+                                            initargs=(instance, repair_class, repair_settings))
+
+    def generate(self, current: SolutionInstance, draws: list) -> list:
+        """One (candidate, CPU seconds, wall seconds) per (destroy index, repair index, seed) draw"""
+        state = current.to_state()
+        futures = [self.executor.submit(_candidate, state, *draw) for draw in draws]
+        return [(SolutionInstance.from_state(self.instance, candidate), seconds, wall)
+                for candidate, seconds, wall in (future.result() for future in futures)]
+
+    def close(self) -> None:
+        self.executor.shutdown()
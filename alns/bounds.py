@@ -0,0 +1,82 @@
+import numpy as np
+
+from alns.compact_instance import CompactInstance
+from alns.constructive import _voronoi
+
+''' Lower bounds of the value of the instance, computed once after the
+preprocessing: the cheap combinatorial voronoi_bound, and lp_bound, the
+linear relaxation of the model in alns.solver (which needs Pyomo and an
+LP solver). A bound of a reduced instance bounds the original one once
+taken back by Reduction.lower_bound. '''
+
+
+def voronoi_bound(instance: CompactInstance) -> float:
+    """
+    A solution holding at most one terminal loses every other prize. A tree
+    holding two terminals or more reaches, from each terminal t it holds, out
+    of the ball of radius d(t)/2 around t, where d(t) is the distance to the
+    closest other terminal; these balls are disjoint, so the tree costs at
+    least the sum of d(t)/2 over its terminals. Each terminal thus costs at
+    least min(prize, d(t)/2), and d(t) comes from one multi-source Dijkstra
+    """
+    prizes = instance.prizes
+    terminals = np.flatnonzero(prizes > 0)
+    total = float(prizes[terminals].sum())
+    if len(terminals) < 2:
+        return 0.0
+    one_terminal = total - float(prizes[terminals].max())
+
+    dist, _, base = _voronoi(instance, terminals.tolist())
+    dist, base = np.asarray(dist), np.asarray(base)
+    u, v = instance.u, instance.v
+    boundary = (base[u] != -1) & (base[v] != -1) & (base[u] != base[v])
+    # d(t) is the lightest path through an edge between the region of t and another one
+    length = dist[u[boundary]] + instance.cost[boundary] + dist[v[boundary]]
+    nearest = np.full(instance.n_nodes, np.inf)
+    np.minimum.at(nearest, base[u[boundary]], length)
+    np.minimum.at(nearest, base[v[boundary]], length)
+
+    spread = float(np.minimum(prizes[terminals], nearest[terminals] / 2).sum())
+    return min(one_terminal, spread)
+
+
+def lp_bound(instance: CompactInstance, solver: str = 'glpk') -> float:
+    """Optimum of the linear relaxation of the flow model, None when the solver does not reach it"""
+    if not instance.terminals.any():
+        return 0.0
+    # Pyomo is only needed by this bound
+    import pyomo.environ as pyo
+    from pyomo.opt import SolverFactory, TerminationCondition
+    from alns.solver import build_model
+
+    model = build_model(instance)
+    pyo.TransformationFactory('core.relax_integer_vars').apply_to(model)
+    results = SolverFactory(solver).solve(model)
+    if results.solver.termination_condition != TerminationCondition.optimal:
+        return None
+    return float(pyo.value(model.objective))
+
+
+BOUNDS = {
+    'voronoi': voronoi_bound,
+    'lp': lp_bound,
+}
+
+
+def lower_bound(instance: CompactInstance, method: str = 'voronoi', **kwargs) -> float:
+    """Best of the voronoi bound and the bound of method (one of BOUNDS), which takes kwargs"""
+    if method not in BOUNDS:
+        raise ValueError(f"Unknown lower bound {method}, expected one of {list(BOUNDS)}")
+    bound = voronoi_bound(instance)
+    if method != 'voronoi':
+        other = BOUNDS[method](instance, **kwargs)
+        if other is not None:
+            bound = max(bound, other)
+    return bound
+
+
+def optimality_gap(value: float, lower_bound: float) -> float:
+    """Relative distance from a value to a lower bound of it"""
+    if value == 0:
+        return 0.0 if lower_bound >= 0 else np.inf
+    return max(value - lower_bound, 0.0) / abs(value)
@@ -0,0 +1,339 @@
+import os
+import json
+import heapq
+import networkx as nx
+import numpy as np
+
+from math import inf
+
+from alns.shortest_paths import ShortestPathOracle
+
+
+class CompactInstance:
+    """Immutable CSR representation of a Steiner prize collecting instance.
+
+    Nodes are addressed by their position in ``labels`` and edges by their
+    position in ``u``/``v``/``cost``. The adjacency of node ``i`` lives in
+    ``neighbors[offsets[i]:offsets[i + 1]]``, with the matching edge ids in
+    ``neighbor_edges``.
+
+    On disk (see save) an instance is a directory holding one .npy file per
+    array of ARRAYS plus a meta.json. Instances loaded with a mmap_mode keep
+    their arrays on disk and are pickled as the path of their directory.
+    """
+    ARRAYS = ('labels', 'prizes', 'terminals', 'u', 'v', 'cost',
+              'offsets', 'neighbors', 'neighbor_edges')
+    FORMAT = 'alns-csr'
+    FORMAT_VERSION = 1
+
+    def __init__(self, labels, prizes, terminals, u, v, cost) -> None:
+        self.labels = np.asarray(labels, dtype=np.int64)
+        self.prizes = np.asarray(prizes, dtype=np.float64)
+        self.terminals = np.asarray(terminals, dtype=bool)
+        self.u = np.asarray(u, dtype=np.int64)
+        self.v = np.asarray(v, dtype=np.int64)
+        self.cost = np.asarray(cost, dtype=np.float64)
+
+        n = len(self.labels)
+        m = len(self.u)
+        ends = np.concatenate((self.u, self.v))
+        order = np.argsort(ends, kind='stable')
+        self.neighbors = np.concatenate((self.v, self.u))[order]
+        self.neighbor_edges = np.tile(np.arange(m, dtype=np.int64), 2)[order]
+        self.offsets = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(ends, minlength=n), out=self.offsets[1:])
+
+        self._source = None
+        self.meta = {}
+        self._setup()
+
+    def _setup(self) -> None:
+        self.degree = np.diff(self.offsets)
+        self.total_prize = float(self.prizes.sum())
+
+        for name in self.ARRAYS + ('degree',):
+            getattr(self, name).flags.writeable = False
+
+        self._index = None
+        self._adjacency = None
+        self._endpoints = None
+        self._shortest_paths = None
+
+    def __getstate__(self):
+        # The python adjacency caches and the path oracle are rebuilt on demand
+        state = self.__dict__.copy()
+        state['_index'] = state['_adjacency'] = state['_endpoints'] = state['_shortest_paths'] = None
+        return state
+
+    def __reduce_ex__(self, protocol):
+        if self._source is not None:
+            return CompactInstance.load, (self._source,)
+        return super().__reduce_ex__(protocol)
+
+    def save(self, directory: str, **meta) -> None:
+        """
+        Writes the instance as a directory (by convention named *.csr) with:
+
+        - labels.npy          int64[n]    original node labels
+        - prizes.npy          float64[n]  node prizes
+        - terminals.npy       bool[n]     terminal flags
+        - u.npy, v.npy        int64[m]    edge endpoints (node indexes)
+        - cost.npy            float64[m]  edge costs
+        - offsets.npy         int64[n+1]  CSR row offsets
+        - neighbors.npy       int64[2m]   CSR neighbor node indexes
+        - neighbor_edges.npy  int64[2m]   CSR edge id of each neighbor entry
+        - meta.json           format, version, sizes and the extra meta
+                              (e.g. preprocessed=True)
+
+        Every .npy file can be opened with np.load(..., mmap_mode='r').
+        """
+        os.makedirs(directory, exist_ok=True)
+        for name in self.ARRAYS:
+            np.save(os.path.join(directory, f'{name}.npy'), getattr(self, name))
+
+        meta = dict(self.meta, **meta,
+                    format=self.FORMAT, version=self.FORMAT_VERSION,
+                    n_nodes=self.n_nodes, n_edges=self.n_edges)
+        with open(os.path.join(directory, 'meta.json'), 'w') as meta_file:
+            json.dump(meta, meta_file, indent=2)
+
+    def save_npz(self, file_name: str) -> None:
+        """Writes every array into a single .npz file"""
+        np.savez(file_name, **{name: getattr(self, name) for name in self.ARRAYS})
+
+    @classmethod
+    def load_npz(cls, file_name: str):
+        with np.load(file_name) as data:
+            return cls._from_arrays({name: data[name] for name in cls.ARRAYS})
+
+    def detach(self) -> None:
+        """Reads memory-mapped arrays into memory so the instance outlives its files"""
+        if self._source is None:
+            return
+        for name in self.ARRAYS:
+            setattr(self, name, np.array(getattr(self, name)))
+        self._source = None
+        self._setup()
+
+    @classmethod
+    def load(cls, directory: str, mmap_mode='r'):
+        """Opens an instance written by save, memory-mapping its arrays by default"""
+        with open(os.path.join(directory, 'meta.json')) as meta_file:
+            meta = json.load(meta_file)
+        if meta.get('format') != cls.FORMAT or meta.get('version') != cls.FORMAT_VERSION:
+            raise ValueError(f"{directory} is not a {cls.FORMAT} v{cls.FORMAT_VERSION} instance")
+
+        return cls._from_arrays({name: np.load(os.path.join(directory, f'{name}.npy'), mmap_mode=mmap_mode)
+                                 for name in cls.ARRAYS},
+                                os.path.abspath(directory) if mmap_mode else None,
+                                meta)
+
+    @classmethod
+    def _from_arrays(cls, arrays: dict, source: str = None, meta: dict = None):
+        instance = cls.__new__(cls)
+        for name in cls.ARRAYS:
+            setattr(instance, name, arrays[name])
+        instance._source = source
+        instance.meta = meta or {}
+        instance._setup()
+        return instance
+
+    @classmethod
+    def from_graph(cls, G: nx.Graph):
+        """Builds the compact instance from a parsed nx graph"""
+        labels = list(G.nodes)
+        index = {label: i for i, label in enumerate(labels)}
+        prizes = [data.get('prize', 0) for _, data in G.nodes(data=True)]
+        terminals = [data.get('terminal', False) for _, data in G.nodes(data=True)]
+
+        u, v, cost = [], [], []
+        for n1, n2, data in G.edges(data=True):
+            u.append(index[n1])
+            v.append(index[n2])
+            cost.append(data['cost'])
+
+        return cls(labels, prizes, terminals, u, v, cost)
+
+    def to_graph(self, edges=None, nodes=None) -> nx.Graph:
+        """
+        Converts the instance (or the part of it selected by the
+        edge and node masks) back to a nx graph, for plotting and export
+        """
+        G = nx.Graph()
+        node_ids = range(self.n_nodes) if nodes is None else np.flatnonzero(nodes)
+        for i in node_ids:
+            G.add_node(int(self.labels[i]),
+                       prize=float(self.prizes[i]),
+                       terminal=bool(self.terminals[i]))
+
+        edge_ids = range(self.n_edges) if edges is None else np.flatnonzero(edges)
+        for e in edge_ids:
+            G.add_edge(int(self.labels[self.u[e]]), int(self.labels[self.v[e]]),
+                       cost=float(self.cost[e]))
+        return G
+
+    @property
+    def n_nodes(self) -> int:
+        return len(self.labels)
+
+    @property
+    def n_edges(self) -> int:
+        return len(self.u)
+
+    @property
+    def index(self) -> dict:
+        """Node label to node index"""
+        if self._index is None:
+            self._index = {label: i for i, label in enumerate(self.labels.tolist())}
+        return self._index
+
+    @property
+    def adjacency(self) -> list:
+        """Per node list of (neighbor, edge, cost) tuples, for heap driven loops"""
+        if self._adjacency is None:
+            neighbors = self.neighbors.tolist()
+            edges = self.neighbor_edges.tolist()
+            costs = self.cost[self.neighbor_edges].tolist()
+            offsets = self.offsets.tolist()
+            self._adjacency = [
+                list(zip(neighbors[offsets[i]:offsets[i + 1]],
+                         edges[offsets[i]:offsets[i + 1]],
+                         costs[offsets[i]:offsets[i + 1]]))
+                for i in range(self.n_nodes)
+            ]
+        return self._adjacency
+
+    @property
+    def endpoints(self) -> list:
+        """Per edge (u, v) tuples"""
+        if self._endpoints is None:
+            self._endpoints = list(zip(self.u.tolist(), self.v.tolist()))
+        return self._endpoints
+
+    @property
+    def shortest_paths(self) -> ShortestPathOracle:
+        """Shortest-path oracle shared by everything solving this instance"""
+        if self._shortest_paths is None:
+            self._shortest_paths = ShortestPathOracle(self)
+        return self._shortest_paths
+
+    def edge_between(self, n1: int, n2: int) -> int:
+        """Returns the edge id linking two node indexes or -1"""
+        if self.degree[n1] > self.degree[n2]:
+            n1, n2 = n2, n1
+        for neighbor, edge, _ in self.adjacency[n1]:
+            if neighbor == n2:
+                return edge
+        return -1
+
+    def edge_nodes(self, edges) -> np.ndarray:
+        """Mask of the nodes touched by the selected edges"""
+        nodes = np.zeros(self.n_nodes, dtype=bool)
+        nodes[self.u[edges]] = True
+        nodes[self.v[edges]] = True
+        return nodes
+
+    def dijkstra(self, source: int, target: int = None):
+        """
+        Distances and predecessor edges from source, stopping as
+        soon as target (if given) is settled
+        """
+        dist, pred, _ = self.multi_source_dijkstra([source], () if target is None else (target,))
+        return dist, pred
+
+    def multi_source_dijkstra(self, sources, targets=()):
+        """
+        Dijkstra seeded with every node of sources at distance 0, stopping
+        as soon as any node of targets is settled. Returns the distances,
+        the predecessor edges and the settled target (None if not reached)
+        """
+        dist = {}
+        pred = {}
+        for source in sources:
+            dist[source] = 0.0
+            pred[source] = -1
+        settled = set()
+        heap = [(0.0, source) for source in dist]
+        adjacency = self.adjacency
+
+        while heap:
+            d, node = heapq.heappop(heap)
+            if node in settled:
+                continue
+            settled.add(node)
+            if node in targets:
+                return dist, pred, node
+
+            for neighbor, edge, cost in adjacency[node]:
+                new_d = d + cost
+                if new_d < dist.get(neighbor, inf):
+                    dist[neighbor] = new_d
+                    pred[neighbor] = edge
+                    heapq.heappush(heap, (new_d, neighbor))
+
+        return dist, pred, None
+
+    def path_edges(self, pred: dict, target: int) -> list:
+        """Rebuilds the edges of the path ending in target from the predecessors"""
+        endpoints = self.endpoints
+        path = []
+        node = target
+        while pred[node] != -1:
+            edge = int(pred[node])
+            path.append(edge)
+            n1, n2 = endpoints[edge]
+            node = n1 if n2 == node else n2
+        path.reverse()
+        return path
+
+    def shortest_path(self, source: int, target: int) -> list:
+        """Edges of the cheapest path between two node indexes"""
+        return self.nearest_path([source], (target,))
+
+    def nearest_path(self, sources, targets) -> list:
+        """
+        Edges of the cheapest path linking any node of sources to the
+        closest node of targets (empty if they already meet or can't)
+        """
+        _, pred, reached = self.multi_source_dijkstra(sources, targets)
+        if reached is None:
+            return []
+        return self.path_edges(pred, reached)
+
+    def nearest_groups(self, sources, groups: dict, k: int) -> dict:
+        """
+        Cheapest paths from the nodes of sources to the k closest groups of
+        nodes (groups maps a node to its group, sources are one group). The
+        paths only go through nodes out of every other group. Returns the
+        edges of the path to each group reached, closest first
+        """
+        source_group = groups.get(sources[0])
+        dist = {}
+        pred = {}
+        for source in sources:
+            dist[source] = 0.0
+            pred[source] = -1
+        settled = set()
+        heap = [(0.0, source) for source in dist]
+        adjacency = self.adjacency
+        paths = {}
+
+        while heap and len(paths) < k:
+            d, node = heapq.heappop(heap)
+            if node in settled:
+                continue
+            settled.add(node)
+            group = groups.get(node)
+            if group is not None and group != source_group:
+                if group not in paths:
+                    paths[group] = self.path_edges(pred, node)
+                continue
+
+            for neighbor, edge, cost in adjacency[node]:
+                new_d = d + cost
+                if new_d < dist.get(neighbor, inf):
+                    dist[neighbor] = new_d
+                    pred[neighbor] = edge
+                    heapq.heappush(heap, (new_d, neighbor))
+
+        return paths
@@ -0,0 +1,368 @@
+import heapq
+import numpy as np
+
+from math import inf
+
+from alns.compact_instance import CompactInstance
+from alns.improvement import greedy_initial_solution
+from alns.solution_instance import SolutionInstance
+from alns.union_find import UnionFind
+
+''' Constructive heuristics for the initial solution. Every heuristic
+builds a tree (or forest) over the instance and ends with the strong
+pruning of it, which keeps the subtree of best value. '''
+
+
+def _strong_prune(instance: CompactInstance, edges: np.ndarray) -> SolutionInstance:
+    """
+    Best subtree of a forest of edges: with the trees hung from any of
+    their nodes, the value of a node is its prize plus the values of the
+    children that pay for their edge. The subtree of the best node is kept
+    """
+    adjacency = {}
+    endpoints = instance.endpoints
+    for edge in np.flatnonzero(edges).tolist():
+        n1, n2 = endpoints[edge]
+        adjacency.setdefault(n1, []).append((n2, edge))
+        adjacency.setdefault(n2, []).append((n1, edge))
+
+    prizes = instance.prizes.tolist()
+    cost = instance.cost.tolist()
+    value = {}
+    children = {}
+    # a lone node is a solution as well
+    best_node = int(np.argmax(instance.prizes))
+    best_value = prizes[best_node]
+    for start in adjacency:
+        if start in children:
+            continue
+        # preorder of the tree hung from start
+        order = [start]
+        parent = {start: None}
+        for node in order:
+            children[node] = []
+            for neighbor, edge in adjacency.get(node, ()):
+                if neighbor != parent[node]:
+                    parent[neighbor] = node
+                    children[node].append((neighbor, edge))
+                    order.append(neighbor)
+
+        for node in reversed(order):
+            value[node] = prizes[node] + sum(max(0.0, value[child] - cost[edge])
+                                             for child, edge in children[node])
+            if value[node] > best_value:
+                best_node, best_value = node, value[node]
+
+    kept = np.zeros(instance.n_edges, dtype=bool)
+    nodes = np.zeros(instance.n_nodes, dtype=bool)
+    nodes[best_node] = True
+    stack = [best_node]
+    while stack:
+        node = stack.pop()
+        for child, edge in children.get(node, ()):
+            if value[child] > cost[edge]:
+                kept[edge] = True
+                nodes[child] = True
+                stack.append(child)
+
+    return SolutionInstance(instance, kept, nodes)
+
+
+def _profitable(instance: CompactInstance) -> np.ndarray:
+    return np.flatnonzero(instance.prizes > 0)
+
+
+def _voronoi(instance: CompactInstance, sources):
+    """
+    Multi-source Dijkstra from sources: distances, predecessor edges
+    and the source each node is closest to
+    """
+    n = instance.n_nodes
+    dist = [inf] * n
+    pred = [-1] * n
+    base = [-1] * n
+    heap = []
+    for source in sources:
+        dist[source] = 0.0
+        base[source] = source
+        heap.append((0.0, source))
+    heapq.heapify(heap)
+
+    adjacency = instance.adjacency
+    while heap:
+        d, node = heapq.heappop(heap)
+        if d > dist[node]:
+            continue
+        for neighbor, edge, cost in adjacency[node]:
+            new_d = d + cost
+            if new_d < dist[neighbor]:
+                dist[neighbor] = new_d
+                pred[neighbor] = edge
+                base[neighbor] = base[node]
+                heapq.heappush(heap, (new_d, neighbor))
+
+    return dist, pred, base
+
+
+def _find(parent: dict, node: int) -> int:
+    while parent.setdefault(node, node) != node:
+        parent[node] = parent[parent[node]]
+        node = parent[node]
+    return node
+
+
+def _kruskal(weighted_edges):
+    """Minimum spanning forest of (weight, n1, n2, item) tuples, as the items taken"""
+    parent = {}
+    taken = []
+    for _, n1, n2, item in sorted(weighted_edges, key=lambda x: x[0]):
+        r1, r2 = _find(parent, n1), _find(parent, n2)
+        if r1 != r2:
+            parent[r1] = r2
+            taken.append(item)
+    return taken
+
+
+def shortest_path_heuristic(instance: CompactInstance) -> SolutionInstance:
+    """
+    Grows a tree from the terminal with the biggest prize, each time adding
+    the shortest path to the terminal whose prize exceeds its distance to
+    the tree the most. Distances to the tree are only lowered from the
+    nodes of the new path, never recomputed
+    """
+    terminals = _profitable(instance)
+    if not len(terminals):
+        return SolutionInstance(instance)
+    root = int(terminals[np.argmax(instance.prizes[terminals])])
+
+    n = instance.n_nodes
+    adjacency = instance.adjacency
+    endpoints = instance.endpoints
+    prizes = instance.prizes[terminals]
+    dist = [inf] * n
+    pred = [-1] * n
+    in_tree = np.zeros(n, dtype=bool)
+    edges = np.zeros(instance.n_edges, dtype=bool)
+
+    def grow(sources):
+        heap = []
+        for source in sources:
+            in_tree[source] = True
+            dist[source] = 0.0
+            pred[source] = -1
+            heap.append((0.0, source))
+        heapq.heapify(heap)
+        while heap:
+            d, node = heapq.heappop(heap)
+            if d > dist[node]:
+                continue
+            for neighbor, edge, cost in adjacency[node]:
+                new_d = d + cost
+                if new_d < dist[neighbor]:
+                    dist[neighbor] = new_d
+                    pred[neighbor] = edge
+                    heapq.heappush(heap, (new_d, neighbor))
+
+    grow([root])
+    while True:
+        gain = prizes - np.asarray(dist)[terminals]
+        gain[in_tree[terminals]] = -inf
+        best = int(np.argmax(gain))
+        if gain[best] <= 0:
+            break
+
+        node = int(terminals[best])
+        path_nodes = []
+        while not in_tree[node]:
+            path_nodes.append(node)
+            edge = pred[node]
+            edges[edge] = True
+            n1, n2 = endpoints[edge]
+            node = n1 if n2 == node else n2
+        grow(path_nodes)
+
+    return _strong_prune(instance, edges)
+
+
+def mst_heuristic(instance: CompactInstance) -> SolutionInstance:
+    """
+    Minimum spanning tree over the metric closure of the profitable
+    terminals (those whose prize exceeds the distance to the closest other
+    terminal), approximated with the Voronoi regions of the terminals
+    (Mehlhorn) so that a single Dijkstra is needed per terminal set
+    """
+    terminals = _profitable(instance)
+    if len(terminals) < 2:
+        return shortest_path_heuristic(instance)
+
+    cost = instance.cost.tolist()
+
+    def closure_edges(sources):
+        dist, pred, base = _voronoi(instance, sources)
+        closest = {}
+        for edge, (n1, n2) in enumerate(instance.endpoints):
+            b1, b2 = base[n1], base[n2]
+            if b1 == -1 or b2 == -1 or b1 == b2:
+                continue
+            key = (b1, b2) if b1 < b2 else (b2, b1)
+            weight = dist[n1] + cost[edge] + dist[n2]
+            if weight < closest.get(key, (inf,))[0]:
+                closest[key] = (weight, edge)
+        return pred, closest
+
+    _, closest = closure_edges(terminals.tolist())
+    nearest = {}
+    for (b1, b2), (weight, _) in closest.items():
+        nearest[b1] = min(nearest.get(b1, inf), weight)
+        nearest[b2] = min(nearest.get(b2, inf), weight)
+    profitable = [t for t in terminals.tolist() if instance.prizes[t] > nearest.get(t, inf)]
+    if len(profitable) < 2:
+        return shortest_path_heuristic(instance)
+
+    pred, closest = closure_edges(profitable)
+    tree = _kruskal((weight, b1, b2, edge) for (b1, b2), (weight, edge) in closest.items())
+
+    # expand the closure edges into their paths, which may overlap
+    endpoints = instance.endpoints
+    union = np.zeros(instance.n_edges, dtype=bool)
+    for edge in tree:
+        union[edge] = True
+        for node in endpoints[edge]:
+            while pred[node] != -1:
+                union[pred[node]] = True
+                n1, n2 = endpoints[pred[node]]
+                node = n1 if n2 == node else n2
+
+    candidates = np.flatnonzero(union).tolist()
+    spanning = _kruskal((cost[e], *endpoints[e], e) for e in candidates)
+    edges = np.zeros(instance.n_edges, dtype=bool)
+    edges[spanning] = True
+    return _strong_prune(instance, edges)
+
+
+def goemans_williamson(instance: CompactInstance) -> SolutionInstance:
+    """
+    Prize-aware primal-dual growth: every node is a component whose moat
+    grows while the prize it holds is not spent; an edge joins the forest
+    (merging two components) when the moats around its endpoints cover its
+    cost. Growth stops when at most one component is active, and the tree
+    of best value is kept after the strong pruning.
+    Event driven: the components are a UnionFind whose roots grow their
+    moat (and spend their prize) lazily from the time of their last event,
+    and the edges going tight and the components running out of prize come
+    from two heaps, checked when they reach the top
+    """
+    n = instance.n_nodes
+    endpoints = instance.endpoints
+    adjacency = instance.adjacency
+    cost = instance.cost.tolist()
+
+    forest = UnionFind()
+    budget = instance.prizes.tolist()  # per root, prize still to spend at since
+    active = [prize > 0 for prize in budget]
+    grown = [0.0] * n                  # per root, moat grown until since
+    since = [0.0] * n
+    shift = [0.0] * n                  # per node, its load is shift + moat of its root
+    version = [0] * n                  # per root, invalidates its older spend events
+    n_active = sum(active)
+    now = 0.0
+
+    def moat(root):
+        return grown[root] + (now - since[root] if active[root] else 0.0)
+
+    def left(root):
+        return budget[root] - (now - since[root] if active[root] else 0.0)
+
+    def tight_time(edge):
+        """Time the edge goes tight at the current rates, None when it does not grow"""
+        a, b = endpoints[edge]
+        ra, rb = forest.find(a), forest.find(b)
+        rate = active[ra] + active[rb]
+        if ra == rb or not rate:
+            return None
+        slack = cost[edge] - shift[a] - moat(ra) - shift[b] - moat(rb)
+        return now + max(slack, 0.0) / rate
+
+    edge_events = []
+    for edge in range(instance.n_edges):
+        time = tight_time(edge)
+        if time is not None:
+            edge_events.append((time, edge))
+    heapq.heapify(edge_events)
+    spend_events = [(budget[node], 0, node) for node in range(n) if active[node]]
+    heapq.heapify(spend_events)
+    edges = np.zeros(instance.n_edges, dtype=bool)
+
+    while n_active > 1:
+        # the rates change at every event: the edge on top is checked again
+        while edge_events:
+            key, edge = edge_events[0]
+            time = tight_time(edge)
+            if time is None:
+                heapq.heappop(edge_events)
+            elif time != key:
+                heapq.heapreplace(edge_events, (time, edge))
+            else:
+                break
+        while spend_events[0][1] != version[spend_events[0][2]]:
+            heapq.heappop(spend_events)
+
+        edge_time = edge_events[0][0] if edge_events else inf
+        spent_time = spend_events[0][0]
+        now = max(now, min(edge_time, spent_time))
+
+        if edge_time <= spent_time:
+            _, edge = heapq.heappop(edge_events)
+            edges[edge] = True
+            ra, rb = (forest.find(node) for node in endpoints[edge])
+            moats = {ra: moat(ra), rb: moat(rb)}
+            total = left(ra) + left(rb)
+            was_active = active[ra] + active[rb]
+            # the edges of a side starting to grow only reach the heap now
+            revived = [node for root in (ra, rb) if total > 0 and not active[root]
+                       for node in forest.component(root)]
+            members = {ra: forest.component(ra).nodes(), rb: forest.component(rb).nodes()}
+
+            root = forest.union(ra, rb)
+            merged = rb if root == ra else ra
+            for node in members[merged]:
+                shift[node] += moats[merged] - moats[root]
+            grown[root], since[root], budget[root] = moats[root], now, total
+            active[root] = total > 0
+            version[root] += 1
+            version[merged] += 1
+            n_active += active[root] - was_active
+            if active[root]:
+                heapq.heappush(spend_events, (now + total, version[root], root))
+            for node in revived:
+                for _, incident, _ in adjacency[node]:
+                    time = tight_time(incident)
+                    if time is not None:
+                        heapq.heappush(edge_events, (time, incident))
+        else:
+            _, _, root = heapq.heappop(spend_events)
+            grown[root], since[root], budget[root] = moat(root), now, 0.0
+            active[root] = False
+            version[root] += 1
+            n_active -= 1
+
+    return _strong_prune(instance, edges)
+
+HEURISTICS = {
+    'greedy': greedy_initial_solution,
+    'sph': shortest_path_heuristic,
+    'mst': mst_heuristic,
+    'gw': goemans_williamson,
+}
+DEFAULT_HEURISTIC = 'sph'
+RANDOMIZED = {'greedy'}  # the heuristics that draw from a random_state
+
+
+def initial_solution(instance: CompactInstance, heuristic: str = DEFAULT_HEURISTIC,
+                     random_state: np.random.RandomState = None) -> SolutionInstance:
+    """Initial solution built with one of HEURISTICS"""
+    if heuristic not in HEURISTICS:
+        raise ValueError(f"Unknown initial heuristic {heuristic}, expected one of {list(HEURISTICS)}")
+    if heuristic in RANDOMIZED:
+        return HEURISTICS[heuristic](instance, random_state=random_state)
+    return HEURISTICS[heuristic](instance)
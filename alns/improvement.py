@@ -1,10 +1,12 @@
 # %%
-import copy
-import random
 import networkx as nx
+import numpy as np
 
+from collections import deque
 from typing import Any, Dict, List, Tuple
 
+from alns import utils
+from alns.compact_instance import CompactInstance
 from alns.solution_instance import SolutionInstance
 
 Node = Tuple[int, Dict[str, Any]]
@@ -18,22 +20,18 @@ evaluate = SolutionInstance.evaluate
 
 def remove_leaves(G: nx.Graph) -> nx.Graph:
     """
-    Remove graph leaves and returns the resulting graph
-    as well as the nodes taken out
+    Remove graph leaves (without prize) and returns the resulting graph.
+    Only the neighbors of removed leaves are checked again.
     """
-    nG = copy.deepcopy(G)
-    
-    def _preprocess(nG: nx.Graph) -> None:
-        nodes = [node
-            for node in nG.nodes(data=True)
-            if nG.degree(node[0])==1 and not node[1]["prize"]]
-        if not nodes:
-            return
-    
-        nG.remove_nodes_from([n[0] for n in nodes])
-        _preprocess(nG)
-
-    _preprocess(nG)
+    nG = G.copy()
+    queue = deque(nG.nodes)
+    while queue:
+        node = queue.popleft()
+        if node not in nG or nG.degree(node) != 1 or nG.nodes[node]["prize"]:
+            continue
+        neighbor = next(iter(nG[node]))
+        nG.remove_node(node)
+        queue.append(neighbor)
     return nG
 
 
@@ -43,21 +41,19 @@ def terminal_leaves(G: nx.Graph) -> Tuple[
     Merges terminal leaves into nodes. Assumes that
     the only leaves are terminals
     """
-    nG = copy.deepcopy(G)
-    
-    def _preprocess(nG: nx.Graph)-> Tuple[
-            List[Node], List[Edge], nx.Graph]:
-        nodes = [node
-            for node in nG.nodes(data=True)
-            if nG.degree(node[0])==1]
-        if not nodes:
-            return ([], [])
-
-        keep_nodes = []
+    nG = G.copy()
+    keep_nodes, edges = [], []
+
+    leaves = [n for n in nG.nodes if nG.degree(n) == 1]
+    while leaves:
+        nodes = [(n, nG.nodes[n]) for n in leaves]
+        linked = {}
+        round_keep = []
         for node in nodes:
             # it only has one edge
-            edge = list(nG.edges([node[0]], data=True))[0]
+            edge = next(iter(nG.edges([node[0]], data=True)))
             linked_node = nG.nodes[edge[1]]
+            linked[edge[1]] = None
 
             # calculate reward for getting terminal
             add_prize = node[1]["prize"] - edge[-1]["cost"]
@@ -65,61 +61,79 @@ def terminal_leaves(G: nx.Graph) -> Tuple[
             if add_prize > 0:
                 linked_node["prize"] += add_prize
                 linked_node["terminal"] = True
-                keep_nodes.append(node)
-
-        edges = G.edges([n[0] for n in keep_nodes],
-            data=True)
-        nG.remove_nodes_from([n[0] for n in nodes])
+                round_keep.append(node)
 
         # return the nodes and edges to reconstruct graph
-        nnodes, nedges = _preprocess(nG)
-        return ((keep_nodes + nnodes), list(edges) + nedges)
+        keep_nodes += round_keep
+        edges += list(G.edges([n[0] for n in round_keep], data=True))
+        nG.remove_nodes_from(leaves)
+
+        # only the nodes the leaves hung from can be the next leaves
+        leaves = [n for n in linked if n in nG and nG.degree(n) == 1]
 
-    return _preprocess(nG) + (nG,)
+    return keep_nodes, edges, nG
 
 
 ### Greedy Solution ###
 
-def __is_already_visited(nc_sorted: dict,
-                         initial_solution: nx.Graph) -> int:
-    for nc, _ in nc_sorted.items():
-        if nc not in initial_solution.nodes():
+def __is_already_visited(nc_sorted: list,
+                         visited: set) -> int:
+    for nc in nc_sorted:
+        if nc not in visited:
             return nc
     return -1
 
 
-def greedy_initial_solution(path: nx.Graph,
-                            max_tries: int = 500) -> nx.Graph:
+def greedy_initial_solution(instance: CompactInstance,
+                            max_tries: int = 500,
+                            random_state: np.random.RandomState = None) -> SolutionInstance:
     """
        Returns a greedy initial solution for prize collecting.
        It visits the most expensive nodes in relation to its path cost
        and stops when the only possible next node was already visited.
+       The walks start from terminals drawn from random_state.
     """
+    random_state = utils.random_state() if random_state is None else random_state
+    labels = instance.labels.tolist()
+    terminal = instance.terminals.tolist()
+    prizes = instance.prizes.tolist()
+    adjacency = instance.adjacency
+    # the ranking of the neighbors does not depend on the walk, sort it once
+    ranked = [None] * instance.n_nodes
+
     best_evaluation = 0
-    terminals_n = [n for n, data in path.nodes(data=True) if data['terminal']]
+    terminals_n = np.flatnonzero(instance.terminals).tolist()
     for _ in range(max_tries):
-        for t in range(path.number_of_nodes()):
-            candidate_solution = nx.Graph()
-            curr_node = random.choice(terminals_n)
-            candidate_solution.add_node(curr_node)
+        for t in range(instance.n_nodes):
+            curr_node = terminals_n[random_state.randint(len(terminals_n))]
+            visited = {curr_node}
+            cost_edges = 0
 
             while True:
-                next_cost = {n: (n - e['cost'], path.nodes[n]['terminal']) for n, e in path[curr_node].items()}
-                nc_sorted = dict(sorted(next_cost.items(), key=lambda x: x[1], reverse=True))
-                better_node = __is_already_visited(nc_sorted, candidate_solution)
+                if ranked[curr_node] is None:
+                    next_cost = sorted(adjacency[curr_node],
+                                       key=lambda x: (labels[x[0]] - x[2], terminal[x[0]]),
+                                       reverse=True)
+                    ranked[curr_node] = ([n for n, _, _ in next_cost],
+                                         {n: c for n, _, c in next_cost})
+                nc_sorted, costs = ranked[curr_node]
+                better_node = __is_already_visited(nc_sorted, visited)
                 if better_node == -1:
                     break
-                candidate_solution.add_edge(curr_node,
-                                            better_node,
-                                            cost=path[curr_node][better_node]['cost'])
+                visited.add(better_node)
+                cost_edges += costs[better_node]
                 curr_node = better_node
 
-            if all(n in list(candidate_solution.nodes) for n in terminals_n):
+            if all(n in visited for n in terminals_n):
                 break
 
-        candidate_eval = evaluate(path, candidate_solution)
+        candidate_eval = cost_edges + instance.total_prize - sum(prizes[n] for n in visited)
         if not best_evaluation or candidate_eval < best_evaluation:
             best_evaluation = candidate_eval
-            best_initial_solution = candidate_solution
+            best_initial_solution = visited
 
-    return path.subgraph(best_initial_solution).copy()
+    # the solution is the subgraph of the instance induced by the visited nodes
+    nodes = np.zeros(instance.n_nodes, dtype=bool)
+    nodes[list(best_initial_solution)] = True
+    edges = nodes[instance.u] & nodes[instance.v]
+    return SolutionInstance(instance, edges, nodes)
@@ -8,6 +8,7 @@ import matplotlib.pyplot as plt
 import instance_generator as ig
 
 from alns.utils import plot_graph
+from alns.compact_instance import CompactInstance
 import alns.improvement as ro
 
 from typing import List, Tuple
@@ -26,7 +27,8 @@ def generate_multiple_instances(parameters:
         pickle.dump(graph, open(f"data/toys/toy_generated-{i}.pickle", "wb"))
         ig.export_to_dat(graph, f"data/toys/toy_generated-{i}.dat")
     
-        solution = ro.greedy_initial_solution(graph)
+        solution = ro.greedy_initial_solution(
+            CompactInstance.from_graph(graph)).solution
 
         plot_graph(graph, 
             output=f"data/toys/toy_generated-{i}.png", 
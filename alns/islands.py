@@ -0,0 +1,143 @@
+import numpy as np
+
+from multiprocessing import Pipe, Process
+
+from alns import utils
+from alns.compact_instance import CompactInstance
+from alns.constructive import DEFAULT_HEURISTIC, initial_solution
+from alns.simmulated_annealing import SimulatedAnnealing
+from alns.solution_instance import SolutionInstance
+
+# Who receives the elite solutions
+BROADCAST = 'broadcast'  # every island gets the best solution of all islands
+RING = 'ring'            # island i gets the best solution of island i - 1
+
+# What the received solution replaces
+REPLACE_IF_BETTER = 'if_better'  # the current state, when the migrant is better
+REPLACE_ALWAYS = 'always'        # the current state, unconditionally
+
+# How the operator weights are shared
+SHARE_NONE = 'none'
+SHARE_AVERAGE = 'average'  # every island takes the mean weights
+SHARE_BEST = 'best'        # every island takes the weights of the best island
+
+
+def _island(conn, instance, seed, migration_interval, heuristic, params):
+    """Runs one annealing, reporting its best solution every migration_interval temperature iterations"""
+    rnd_state = utils.random_state(seed)
+    sa = SimulatedAnnealing(initial_solution=initial_solution(instance, heuristic, rnd_state),
+                            rnd_state=rnd_state, **params)
+    destroy, repair = sa.alns.destroy_operator, sa.alns.repair_operator
+
+    # the coordinator decides when every island stops, so islands with
+    # time or target terminations still exchange in lockstep
+    sa.start_clock()
+    while True:
+        for _ in range(migration_interval):
+            if sa.finished():
+                break
+            sa.temperature_iteration()
+
+        # the state keeps the nodes, a lone node best is not an empty solution
+        conn.send((sa.alns.best.to_state(), sa.alns.best.value, destroy.weights, repair.weights,
+                   sa.finished()))
+        migrant, replace_current, weights, stop = conn.recv()
+
+        if migrant is not None:
+            sa.alns.receive_migrant(SolutionInstance.from_state(instance, migrant), replace_current)
+        if weights is not None:
+            destroy.weights[:], repair.weights[:] = weights
+        if stop:
+            break
+
+    sa.stop_clock()
+    sa.statistics.add_time_duration(sa.elapsed)
+    sa.statistics.add_operator_metrics(destroy, repair)
+    sa.statistics.flush()
+    sa.close()
+    conn.send(sa.results())
+    conn.close()
+
+
+class IslandModel:
+    """
+    Runs n_islands annealings of the same instance in parallel processes, each
+    with its own operator weights and temperature, exchanging their best
+    solutions every migration_interval temperature iterations.
+    """
+
+    def __init__(self,
+                 instance: CompactInstance,
+                 n_islands: int,
+                 migration_interval: int = 10,
+                 topology: str = BROADCAST,
+                 replacement: str = REPLACE_IF_BETTER,
+                 weight_sharing: str = SHARE_NONE,
+                 temperatures: list = None,
+                 seed: int = 0,
+                 heuristic: str = DEFAULT_HEURISTIC,
+                 **params):
+        self.instance = instance
+        self.n_islands = n_islands
+        self.migration_interval = migration_interval
+        self.topology = topology
+        self.replacement = replacement
+        self.weight_sharing = weight_sharing
+        temperature = params.pop('temperature')
+        self.temperatures = temperatures or [temperature] * n_islands
+        self.heuristic = heuristic
+        self.seeds = [int(s.generate_state(1)[0]) for s in np.random.SeedSequence(seed).spawn(n_islands)]
+        self.params = params
+
+    def migrants(self, reports: list) -> list:
+        """Solution state each island receives (None when it keeps its own)"""
+        values = [report[1] for report in reports]
+        if self.topology == BROADCAST:
+            best = int(np.argmin(values))
+            return [None if i == best else reports[best][0] for i in range(self.n_islands)]
+        if self.topology == RING:
+            return [reports[i - 1][0] for i in range(self.n_islands)]
+        raise ValueError(f"Unknown topology {self.topology}")
+
+    def shared_weights(self, reports: list):
+        """Destroy and repair weights every island takes (None to keep their own)"""
+        if self.weight_sharing == SHARE_NONE:
+            return None
+        if self.weight_sharing == SHARE_AVERAGE:
+            return (np.mean([report[2] for report in reports], axis=0),
+                    np.mean([report[3] for report in reports], axis=0))
+        if self.weight_sharing == SHARE_BEST:
+            best = min(reports, key=lambda report: report[1])
+            return best[2], best[3]
+        raise ValueError(f"Unknown weight sharing policy {self.weight_sharing}")
+
+    def run(self) -> dict:
+        replace_current = self.replacement == REPLACE_ALWAYS
+
+        pipes, processes = [], []
+        for seed, temperature in zip(self.seeds, self.temperatures):
+            conn, child_conn = Pipe()
+            processes.append(Process(target=_island,
+                                     args=(child_conn, self.instance, seed, self.migration_interval, self.heuristic,
+                                           dict(self.params, temperature=temperature))))
+            processes[-1].start()
+            pipes.append(conn)
+
+        # islands report every migration_interval temperature iterations, the
+        # run stops for all of them once any has finished
+        while True:
+            reports = [conn.recv() for conn in pipes]
+            stop = any(report[4] for report in reports)
+
+            weights = self.shared_weights(reports)
+            for conn, migrant in zip(pipes, self.migrants(reports)):
+                conn.send((migrant, replace_current, weights, stop))
+            if stop:
+                break
+
+        reports = [conn.recv() for conn in pipes]
+        for process in processes:
+            process.join()
+
+        best = min(reports, key=lambda result: result["best"].value)
+        return dict(best, islands=reports)
@@ -1,25 +1,40 @@
 import csv
-import random
-from time import time
-import networkx as nx
-from itertools import product
+import heapq
+from math import inf
+from time import perf_counter, process_time, time
 import numpy as np
-import math
-
-from networkx import NetworkXError
 
+from alns.compact_instance import CompactInstance
+from alns.selection import DEFAULT_SELECTION, SELECTIONS
 from alns.solution_instance import SolutionInstance
+from alns.statistics import OperatorMetrics
 
 
 class Operator:
-    """Handles the random choice of the operator method to execute"""
-    def __init__(self) -> None:
-        self.weights = np.ones(self.num_operators, dtype=np.float16) / self.num_operators
-        self.range = np.arange(0, self.num_operators)
-        self.count_operators = np.zeros(self.num_operators, dtype=np.int)
-        self.score_operators = np.zeros(self.num_operators, dtype=np.int)
+    """
+    Handles the choice of the operator method to execute, delegated to a
+    selection policy (see alns.selection) over the methods.
+
+    With INSTRUMENT set, every call records the wall and CPU time of the
+    operator in metrics (by operator name), and ALNS adds the outcome of
+    the candidate it produced (see record_outcome). Without it the call
+    is only the operator itself, timed only if the policy needs it.
+
+    settings override the SETTINGS of the class for this instance only;
+    the operators are bound to the instance, so they can read them.
+    """
+    INSTRUMENT = True
+    SETTINGS = {}
+
+    def __init__(self, rnd_state: np.random.RandomState, selection: str = DEFAULT_SELECTION,
+                 settings: dict = None) -> None:
+        self.rnd_state = rnd_state
+        self.settings = dict(self.SETTINGS, **(settings or {}))
+        self.operators = [getattr(self, operator.__name__) for operator in self.operators]
+        self.selection = SELECTIONS[selection](self.num_operators)
         self.index = None
-        self.time_dict = dict()        
+        self.seconds = 0.0  # CPU time of the last call
+        self.metrics = dict()
 
     def __init_subclass__(cls, **kwargs):
         # Take the public methods
@@ -29,46 +44,94 @@ class Operator:
         ]
         cls.num_operators = len(cls.operators)
 
-    def update_weights(self, r=.8):
-        for idx in range(self.num_operators):
-            if self.count_operators[idx]:
-                self.weights[idx] = (1 - r) * self.weights[idx] + r * (
-                        self.score_operators[idx] / self.count_operators[idx])
+    @property
+    def weights(self) -> np.ndarray:
+        return self.selection.weights
 
-        self.score_operators = np.zeros(self.num_operators, dtype=int)
-        self.count_operators = np.zeros(self.num_operators, dtype=int)
+    @property
+    def count_operators(self) -> np.ndarray:
+        return self.selection.count_operators
+
+    def update_weights(self, r=.8):
+        self.selection.end_segment(r)
         self.index = None
 
-    def update_score(self, score):
-        self.score_operators[self.index] += score
-        self.count_operators[self.index] += 1
+    def update_score(self, score, index=None, seconds=None):
+        """Credits the operator (the last one called by default) with the score of its candidate"""
+        index = self.index if index is None else index
+        self.selection.update(index, score, self.seconds if seconds is None else seconds)
+
+    def get_state(self) -> dict:
+        return {'selection': self.selection.get_state(),
+                'metrics': self.metrics}
+
+    def set_state(self, state: dict) -> None:
+        self.selection.set_state(state['selection'])
+        self.metrics = state['metrics']
+
+    def select(self) -> int:
+        """Draws the index of the next operator according to the policy"""
+        self.index = self.selection.select(self.rnd_state)
+        return self.index
 
     def __call__(self, *args):
-        self.index = np.random.choice(self.range, p=self.weights / np.sum(self.weights))
-        operator = self.operators[self.index]
-        t1 = time()
-        res = operator(*args)
-        t2 = time()
-        elapsed_time = t2 - t1
-        if self.name in self.time_dict:
-            self.time_dict[self.name].append(elapsed_time)
-        else:
-            self.time_dict[self.name] = [t2-t1]
-        return operator(*args)
+        return self.apply(self.select(), *args)
+
+    def apply(self, index: int, *args):
+        """Runs the operator of the given index"""
+        self.index = index
+        operator = self.operators[index]
+        if not self.INSTRUMENT:
+            if not self.selection.TIMED:
+                return operator(*args)
+            cpu = process_time()
+            result = operator(*args)
+            self.seconds = process_time() - cpu
+            return result
+
+        wall, cpu = perf_counter(), process_time()
+        result = operator(*args)
+        wall, self.seconds = perf_counter() - wall, process_time() - cpu
+        self.record_call(index, wall, self.seconds)
+        return result
+
+    def record_call(self, index: int, wall: float, cpu: float) -> None:
+        """Wall and CPU seconds of a call of the operator, made here or elsewhere (see ALNS.run_batch)"""
+        if self.INSTRUMENT:
+            metrics = self.operator_metrics(index)
+            metrics.wall.add(wall)
+            metrics.cpu.add(cpu)
+
+    def operator_metrics(self, index: int) -> OperatorMetrics:
+        name = self.operators[index].__name__
+        if name not in self.metrics:
+            self.metrics[name] = OperatorMetrics()
+        return self.metrics[name]
+
+    def record_outcome(self, outcome: int, delta: float, index=None) -> None:
+        """
+        Acceptance outcome (utils.BEST...) and value delta of the candidate
+        of the operator, whose call was recorded before
+        """
+        index = self.index if index is None else index
+        metrics = self.metrics.get(self.operators[index].__name__) if self.INSTRUMENT else None
+        if metrics is not None:
+            metrics.add_outcome(outcome, delta)
 
     @property
     def name(self):
         return self.operators[self.index].__name__
 
     def generate_table(self):
-        header = ['Method', 'Total time', 'Number of runs', 'Average time']
+        header = ['Method', 'Total time', 'Number of runs', 'Average time', 'Std time',
+                  'p50 time', 'p95 time', 'p99 time', 'Max time', 'Total CPU time', 'Average CPU time',
+                  'Avg delta', 'Best', 'Better', 'Accepted', 'Rejected']
         rows = []
-        for method in self.time_dict.keys():
-            time_list = self.time_dict[method]
-            total_time = sum(time_list)
-            number_of_runs = len(time_list)
-            avg_time = total_time / number_of_runs
-            rows.append([method, total_time, number_of_runs, avg_time])
+        for method, metrics in self.metrics.items():
+            wall = metrics.wall
+            rows.append([method, wall.total, wall.count, wall.mean, wall.std,
+                         wall.percentile(50), wall.percentile(95), wall.percentile(99), wall.max,
+                         metrics.cpu.total, metrics.cpu.mean, metrics.delta.mean, *metrics.outcomes.tolist()])
         return header, rows
 
     def save_csv(self, csv_file=None):
@@ -85,255 +148,325 @@ class Operator:
 
 
 class RepairOperator(Operator):
-
-    @staticmethod
-    def __merge_path(current: SolutionInstance, path: list):
-        state = current.solution
-
-        for i, node in enumerate(path[1:], 1):
-            prev_node = path[i - 1]
-
-            if not state.has_node(node):
-                aux = {n: data for n, data in current.instance.nodes(data=True)}
-                state.add_node(node, **aux[node])
-
-            if state.has_edge(prev_node, node):
-                continue
-
-            state.add_edge(prev_node, node, **current.instance[prev_node][node])
+    # bounds of greedy_repair: candidate links per component, evaluations and
+    # seconds per call; a time limit makes the repair depend on the machine
+    # load, so it is off by default to keep the seeded runs replayable
+    GREEDY_NEIGHBORS = 3
+    GREEDY_MAX_EVALUATIONS = 1000
+    GREEDY_TIME_LIMIT = None
 
     @staticmethod
     def __connect_pair(current: SolutionInstance, source: int, target: int) -> None:
-        """This function modifies the state graph"""
+        """This function modifies the current solution"""
 
-        path = nx.dijkstra_path(current.instance, source, target, 'cost')
-        RepairOperator.__merge_path(current, path)
+        path = current.instance.shortest_paths.path(source, target)
+        current.merge_path(path)
 
     @classmethod
-    def random_repair(cls, current: SolutionInstance, *args) -> nx.Graph:
+    def random_repair(cls, current: SolutionInstance, previous: SolutionInstance, random_state) -> SolutionInstance:
         """This function modifies the current solution"""
 
-        state = current.solution
-        components = [
-            state.subgraph(comp).copy() for comp in sorted(nx.connected_components(state), key=len, reverse=True) if
-            len(comp) >= 2
-        ]
+        components = current.components()
 
         if len(components) <= 1:
             return current
 
-        source_graph = components[0]
-        for comp in components[1:]:
-            source = random.choice(list(source_graph.nodes))
-            target = random.choice(list(comp.nodes))
+        for comp in components:
+            source_comp = current.largest_component()
+            if comp[0] in source_comp:
+                # the largest one itself, or an earlier path went through it
+                continue
+            source_nodes = source_comp.nodes()
+            source = source_nodes[random_state.randint(len(source_nodes))]
+            target = comp[random_state.randint(len(comp))]
 
             cls.__connect_pair(current, source, target)
 
-            source_graph = state.subgraph(
-                max(nx.connected_components(state), key=len)
-            )
-
         return current
 
-    @classmethod
-    def _greedy_repair(cls, current: SolutionInstance, previous: SolutionInstance):
-
-        state = current.solution
+    @staticmethod
+    def __incremental_cost(current: SolutionInstance, path: list) -> float:
+        """What merging the path changes in the value: its new edges less the prizes of its new nodes"""
+        instance = current.instance
+        path = np.asarray(path, dtype=np.int64)
+        nodes = np.union1d(instance.u[path], instance.v[path])
+        return float(instance.cost[path[~current.edges[path]]].sum() -
+                     instance.prizes[nodes[~current.nodes[nodes]]].sum())
 
-        components = [
-            state.subgraph(comp).copy() for comp in sorted(nx.connected_components(state), key=len, reverse=True) if
-            len(comp) >= 2
-        ]
+    @classmethod
+    def greedy_repair(cls, current: SolutionInstance, previous: SolutionInstance, _=None) -> SolutionInstance:
+        """
+        Joins the components Kruskal-like. Each one gets candidate links to
+        its GREEDY_NEIGHBORS closest components; the links are merged by
+        incremental cost, cheapest first, and re-evaluated lazily as the
+        solution grows. Past GREEDY_MAX_EVALUATIONS evaluations they are
+        merged at their last cost; past GREEDY_TIME_LIMIT seconds (if set),
+        the components left are linked like in greedy_repair_single_source
+        """
+        components = current.components()
 
         if len(components) <= 1:
             return current
 
-        nodes_in_components = [[n for n in comp] for comp in components]
-        for comp in nodes_in_components:
-            random.shuffle(comp)
-        path_list = product(*nodes_in_components)
+        deadline = inf if cls.GREEDY_TIME_LIMIT is None else perf_counter() + cls.GREEDY_TIME_LIMIT
+        groups = {node: k for k, comp in enumerate(components) for node in comp}
+
+        links = []
+        for k, comp in enumerate(components):
+            for target, path in current.instance.nearest_groups(comp, groups, cls.GREEDY_NEIGHBORS).items():
+                links.append((cls.__incremental_cost(current, path), k, target, path))
+            if len(links) >= cls.GREEDY_MAX_EVALUATIONS or perf_counter() > deadline:
+                break
+        heapq.heapify(links)
+
+        evaluations = len(links)
+        while links and perf_counter() <= deadline:
+            cost, k, target, path = heapq.heappop(links)
+            if current.connected(components[k][0], components[target][0]):
+                continue
+            if evaluations < cls.GREEDY_MAX_EVALUATIONS:
+                # the links merged since may have taken some of its edges and nodes
+                new_cost = cls.__incremental_cost(current, path)
+                evaluations += 1
+                if new_cost > cost and links and new_cost > links[0][0]:
+                    heapq.heappush(links, (new_cost, k, target, path))
+                    continue
+            current.merge_path(path)
 
-        for path in path_list:
-            temp = current.copy()
-            for i in range(1, len(path)):
-                cls.__connect_pair(temp, path[i - 1], path[i])
-            if temp < previous:
-                return temp
-        return temp  # if no improvement in all possible pairs, act like random_repair
+        return cls.greedy_repair_single_source(current, previous)
 
     @classmethod
-    def greedy_repair_single_source(cls, current: SolutionInstance, previous: SolutionInstance):
+    def greedy_repair_single_source(cls, current: SolutionInstance, previous: SolutionInstance, _=None):
+        """Links each component to the biggest one through their closest pair of nodes"""
 
-        state = current.solution
-
-        components = [
-            state.subgraph(comp).copy() for comp in sorted(nx.connected_components(state), key=len, reverse=True) if
-            len(comp) >= 2
-        ]
+        components = current.components()
 
         if len(components) <= 1:
             return current
 
-        bigger_graph = components[0]
-        for comp in components[1:]:
-            source = random.choice(list(comp.nodes))
-
-            cost, path = nx.single_source_dijkstra(current.instance, source, weight='cost')
-
-            min_value = None
-            min_node = None
-            for key, value in cost.items():
-                if key not in bigger_graph:
-                    continue
-                if min_value is None or value < min_value:
-                    min_value = value
-                    min_node = key
-
-            cls.__merge_path(current, path[min_node])
-
-            bigger_graph = state.subgraph(
-                max(nx.connected_components(state), key=len)
-            )
+        for comp in components:
+            bigger_comp = current.largest_component()
+            if comp[0] in bigger_comp:
+                continue
+            # the search is seeded from the whole component and stops at the first node reached
+            path = current.instance.nearest_path(comp, bigger_comp)
+            current.merge_path(path)
 
         return current
 
     @classmethod
-    def terminals_repair(cls, current: SolutionInstance, previous: SolutionInstance, max_trials=5):
+    def terminals_repair(cls, current: SolutionInstance, previous: SolutionInstance, _=None):
         # First connect the graph
         current = cls.greedy_repair_single_source(current, previous)
 
-        terminals_n = [n for n, data in current.instance.nodes(data=True) if data['terminal']]
+        terminals_n = np.flatnonzero(current.instance.terminals).tolist()
+        endpoints = current.instance.endpoints
 
+        solution_nodes = set(np.flatnonzero(current.nodes).tolist())
         for terminal in terminals_n:
-            if terminal not in current.solution:
-                temp = current.copy()
-                list_temp = []
-                for _ in range(max_trials):
-                    cls.__connect_pair(temp, terminal, random.choice(list(temp.solution.nodes)))
-                    list_temp.append(temp)
-                    if temp < current:
-                        break
-                current = min(list_temp, key=lambda x: x.value)
+            if terminal not in current:
+                path = current.instance.nearest_path([terminal], solution_nodes)
+                current.merge_path(path)
+                for edge in path:
+                    solution_nodes.update(endpoints[edge])
 
         return current
 
     @classmethod
-    def best_component(cls, current: SolutionInstance, previous: SolutionInstance):
+    def best_component(cls, current: SolutionInstance, previous: SolutionInstance, _=None):
         """Take the best connected component"""
 
-        state = current.solution
+        components = current.components()
 
-        components = [
-            SolutionInstance.new_solution_from_instance(current, state.subgraph(comp).copy())
-            for comp in sorted(nx.connected_components(state), key=len, reverse=True) 
-            if len(comp) >= 2
-        ]
+        if not components:
+            # a lone node (or empty) solution
+            return current
 
-        return min(components, key=lambda x: x.value)
+        # value of each component on its own, only the best one is built
+        instance = current.instance
+        label = np.full(instance.n_nodes, -1, dtype=np.int64)
+        for k, comp in enumerate(components):
+            label[comp] = k
+        edges = np.flatnonzero(current.edges)
+        nodes = np.flatnonzero(label != -1)
+        values = np.bincount(label[instance.u[edges]], weights=instance.cost[edges], minlength=len(components)) - \
+            np.bincount(label[nodes], weights=instance.prizes[nodes], minlength=len(components))
+
+        return current.subsolution(components[int(np.argmin(values))])
+
+
+class MipRepairOperator(RepairOperator):
+    """
+    RepairOperator with mip_repair, a matheuristic repair that solves exactly
+    the region the destroy operator just cleared. Needs Pyomo and a MIP
+    solver (see alns.solver). SETTINGS holds the default solver, its time
+    limit per call (seconds) and the maximum number of nodes of the
+    subproblem, overridden by the settings of the instance.
+    """
+    SETTINGS = {'solver': 'glpk', 'time_limit': 1.0, 'max_nodes': 60}
+
+    @staticmethod
+    def _region(current: SolutionInstance, previous: SolutionInstance, size: int) -> list:
+        """
+        Up to size nodes out of the solution, breadth first from the ends of
+        the edges the destroy operator removed
+        """
+        instance = current.instance
+        removed = previous.edges & ~current.edges
+        seeds = np.flatnonzero(instance.edge_nodes(removed)).tolist()
+        in_solution = current.nodes
+
+        region = []
+        visited = set(seeds)
+        queue = list(seeds)
+        for node in queue:
+            if in_solution[node]:
+                # only the removed edges lead through the nodes kept
+                if node not in seeds:
+                    continue
+            else:
+                region.append(node)
+                if len(region) >= size:
+                    break
+            for neighbor, _, _ in instance.adjacency[node]:
+                if neighbor not in visited:
+                    visited.add(neighbor)
+                    queue.append(neighbor)
+        return region
+
+    def mip_repair(self, current: SolutionInstance, previous: SolutionInstance, _=None) -> SolutionInstance:
+        """
+        Each component of the destroyed solution becomes a node worth its
+        prizes less its cost; with the region around the removed edges they
+        make a small prize collecting Steiner instance, solved exactly. Its
+        tree, components expanded, is the repaired solution
+        """
+        # Pyomo is only needed by this operator
+        from alns.solver import solve
+
+        instance = current.instance
+        max_nodes = self.settings['max_nodes']
+        components = current.components(min_size=1)
+        region = self._region(current, previous, max_nodes - len(components))
+        if not region or len(components) + len(region) > max_nodes:
+            return self.greedy_repair_single_source(current, previous)
+
+        # subproblem nodes: the components, then the region
+        n_components = len(components)
+        position = np.full(instance.n_nodes, -1, dtype=np.int64)
+        for k, comp in enumerate(components):
+            position[comp] = k
+        position[region] = n_components + np.arange(len(region))
+
+        u, v, cost = instance.u, instance.v, instance.cost
+        pu, pv = position[u], position[v]
+        candidates = np.flatnonzero((pu != -1) & (pv != -1) & (pu != pv))
+        # the cheapest edge between each pair of subproblem nodes
+        low, high = np.minimum(pu[candidates], pv[candidates]), np.maximum(pu[candidates], pv[candidates])
+        order = np.lexsort((cost[candidates], high, low))
+        pairs = low[order] * len(position) + high[order]
+        keep = np.ones(len(order), dtype=bool)
+        keep[1:] = pairs[1:] != pairs[:-1]
+        edges = candidates[order[keep]]
+
+        solution_nodes, solution_edges = np.flatnonzero(current.nodes), np.flatnonzero(current.edges)
+        worth = np.bincount(position[solution_nodes], weights=instance.prizes[solution_nodes],
+                            minlength=n_components) - \
+            np.bincount(position[u[solution_edges]], weights=cost[solution_edges], minlength=n_components)
+        prizes = np.concatenate((np.maximum(worth, 0), instance.prizes[region]))
+
+        if not (prizes > 0).any():
+            return self.greedy_repair_single_source(current, previous)
+        n_sub = n_components + len(region)
+        sub = CompactInstance(np.arange(n_sub), prizes, prizes > 0, position[u[edges]], position[v[edges]], cost[edges])
+        result = solve(sub, time_limit=self.settings['time_limit'], solver=self.settings['solver'])
+        if result['solution'] is None:
+            return self.greedy_repair_single_source(current, previous)
+
+        taken = result['solution'].nodes
+        taken_components = np.zeros(instance.n_nodes, dtype=bool)
+        for k in np.flatnonzero(taken[:n_components]).tolist():
+            taken_components[components[k]] = True
+
+        repaired_edges = current.edges & taken_components[u]
+        repaired_edges[edges[result['solution'].edges]] = True
+        nodes = taken_components | instance.edge_nodes(repaired_edges)
+        nodes[np.asarray(region)[taken[n_components:]]] = True
+        return SolutionInstance(instance, repaired_edges, nodes)
 
 
 class DestroyOperator(Operator):
     DEGREE_OF_DESTRUCTION = 0.15
 
     @classmethod
-    def __edges_to_remove(cls, state: nx.Graph) -> int:
-        return int(len(state.edges) * cls.DEGREE_OF_DESTRUCTION)
+    def __edges_to_remove(cls, current: SolutionInstance) -> int:
+        return int(current.n_edges * cls.DEGREE_OF_DESTRUCTION)
+
+    @staticmethod
+    def __terminal_leaf_edges(current: SolutionInstance, edges: np.ndarray) -> np.ndarray:
+        """Mask of the given edges that link a terminal leaf of the instance"""
+        instance = current.instance
+        terminal_leaf = instance.terminals & (instance.degree == 1)
+        return terminal_leaf[instance.u[edges]] | terminal_leaf[instance.v[edges]]
 
     @classmethod
     def random_removal(cls, current: SolutionInstance, random_state) -> SolutionInstance:
-        destroyed = current.solution.copy()
-        to_be_destroyed = list(destroyed.edges)
+        destroyed = current.copy()
+        to_be_destroyed = np.flatnonzero(destroyed.edges)
         n_edges_to_remove = random_state.choice(len(to_be_destroyed),
-                                                cls.__edges_to_remove(current.solution),
+                                                cls.__edges_to_remove(current),
                                                 replace=False)
 
-        not_terminal_leafs = list()
-        for e in n_edges_to_remove:
-            connects_terminal_leaf = [current.instance.nodes(data=True)[to_be_destroyed[e][i]]['terminal']
-                                      and current.instance.degree(to_be_destroyed[e][i]) == 1 for i in range(2)]
-            if not any(connects_terminal_leaf):
-                not_terminal_leafs.append(to_be_destroyed[e])
+        candidates = to_be_destroyed[n_edges_to_remove]
+        not_terminal_leafs = candidates[~cls.__terminal_leaf_edges(current, candidates)]
 
-        destroyed.remove_edges_from(not_terminal_leafs)
+        # Isolated nodes (with 0 degree) are removed along with the edges
+        destroyed.remove_edges(not_terminal_leafs)
 
-        # Remove isolated nodes (with 0 degree)
-        destroyed.remove_nodes_from(
-            [node for node, degree in destroyed.degree
-             if degree == 0]
-        )
-
-        return SolutionInstance.new_solution_from_instance(current, destroyed)
+        return destroyed
 
     @classmethod
     def worst_removal(cls, current: SolutionInstance, _) -> SolutionInstance:
         """ Removes the most expensive edges """
-        destroyed = current.solution.copy()
-        d_e = list(destroyed.edges(data=True))
-        edges_profit = list()
-        for n1, n2, cost in d_e:
-            prize_n1 = current.instance.nodes(data=True)[n1]['prize']
-            prize_n2 = current.instance.nodes(data=True)[n2]['prize']
-            profit = max(prize_n1, prize_n2) - cost['cost']
-            edges_profit.append((n1, n2, profit))
-
-        destroy_candidates = sorted(edges_profit,
-                                    key=lambda tup: tup[2],
-                                    reverse=False)
-
-        to_be_destroyed_edges = list()
-        for e in range(cls.__edges_to_remove(current.solution)):
-            to_be_destroyed_edges.append(destroy_candidates[e])
-
-        destroyed.remove_edges_from(to_be_destroyed_edges)
-
-        # Remove isolated nodes (with 0 degree)
-        destroyed.remove_nodes_from(
-            [node for node, degree in
-             destroyed.degree if degree == 0]
-        )
-
-        return SolutionInstance.new_solution_from_instance(
-            current, destroyed)
+        destroyed = current.copy()
+        instance = current.instance
+        d_e = np.flatnonzero(destroyed.edges)
+        edges_profit = np.maximum(instance.prizes[instance.u[d_e]],
+                                  instance.prizes[instance.v[d_e]]) - instance.cost[d_e]
+
+        destroy_candidates = d_e[np.argsort(edges_profit, kind='stable')]
+
+        to_be_destroyed_edges = destroy_candidates[:cls.__edges_to_remove(current)]
+
+        # Isolated nodes (with 0 degree) are removed along with the edges
+        destroyed.remove_edges(to_be_destroyed_edges)
+
+        return destroyed
 
     @classmethod
-    def shaw_removal(cls, current: SolutionInstance, _) -> nx.Graph:
-        destroyed = current.solution.copy()
-        d_e = list(destroyed.edges(data=True))
-        edges_profit = list()
-        for n1, n2, cost in d_e:
-            prize_n1 = current.instance.nodes(data=True)[n1]['prize']
-            prize_n2 = current.instance.nodes(data=True)[n2]['prize']
-            profit = prize_n1 + prize_n2 - cost['cost']
-            edges_profit.append((n1, n2, profit))
-
-        destroy_candidates = sorted(edges_profit,
-                                    key=lambda tup: tup[2],
-                                    reverse=False)
-        similar_nodes = list()
-        for idx in range(len(destroy_candidates) - 1):
-            if math.isclose(destroy_candidates[idx][2],
-                            destroy_candidates[idx + 1][2],
-                            rel_tol=0.07):
-                similar_nodes.append(destroy_candidates[idx][:2])
-                similar_nodes.append(destroy_candidates[idx + 1][:2])
-
-        if not similar_nodes:
-            return SolutionInstance.new_solution_from_instance(
-                current, destroyed)
-
-        to_be_destroyed_edges = list()
-        for idx in range(cls.__edges_to_remove(current.solution)):
-            if not any([current.instance.nodes(data=True)[similar_nodes[idx][i]]['terminal']
-                        and current.instance.degree(similar_nodes[idx][i]) == 1 for i in range(2)]):
-                to_be_destroyed_edges.append(similar_nodes[idx])
-
-        destroyed.remove_edges_from(to_be_destroyed_edges)
-
-        # Remove isolated nodes (with 0 degree)
-        destroyed.remove_nodes_from(
-            [node for node, degree in
-             destroyed.degree if degree == 0]
-        )
-
-        return SolutionInstance.new_solution_from_instance(
-            current, destroyed)
+    def shaw_removal(cls, current: SolutionInstance, _) -> SolutionInstance:
+        destroyed = current.copy()
+        instance = current.instance
+        d_e = np.flatnonzero(destroyed.edges)
+        edges_profit = instance.prizes[instance.u[d_e]] + instance.prizes[instance.v[d_e]] - instance.cost[d_e]
+
+        order = np.argsort(edges_profit, kind='stable')
+        destroy_candidates = d_e[order]
+        profits = edges_profit[order]
+
+        # same test as math.isclose(a, b, rel_tol=0.07) on consecutive profits
+        similar = np.abs(profits[:-1] - profits[1:]) <= \
+            0.07 * np.maximum(np.abs(profits[:-1]), np.abs(profits[1:]))
+        idx = np.flatnonzero(similar)
+        similar_edges = np.column_stack((destroy_candidates[idx], destroy_candidates[idx + 1])).ravel()
+
+        if not len(similar_edges):
+            return destroyed
+
+        to_be_destroyed_edges = similar_edges[:cls.__edges_to_remove(current)]
+        to_be_destroyed_edges = to_be_destroyed_edges[~cls.__terminal_leaf_edges(current, to_be_destroyed_edges)]
+
+        # Isolated nodes (with 0 degree) are removed along with the edges
+        destroyed.remove_edges(to_be_destroyed_edges)
+
+        return destroyed
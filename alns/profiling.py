@@ -0,0 +1,150 @@
+import os
+import sys
+import pstats
+import cProfile
+import threading
+
+from collections import Counter, defaultdict
+from contextlib import contextmanager, nullcontext
+
+''' Opt-in profiling of the phases of a run. Phases are entered with
+profiler.phase(name, index) around the code they cover; everything run
+inside the outermost selected phase is profiled into that phase (or
+phase-index, e.g. temperature-0007) and dumped by profiler.dump():
+
+- cprofile: <phase>.prof (pstats) and <phase>.txt (top functions by
+  cumulative time),
+- sample: a thread samples the profiled thread every interval seconds,
+  writing <phase>.collapsed (collapsed stacks rooted at the nested phase
+  names, for flamegraph.pl or speedscope) and <phase>.txt (samples by
+  function, self and total). '''
+
+PHASES = ('parse', 'preprocess', 'initial', 'temperature', 'destroy', 'repair', 'evaluation')
+MODES = ('cprofile', 'sample')
+
+
+class NullProfiler:
+    """The disabled profiler: phases cost a method call"""
+    _context = nullcontext()
+
+    def phase(self, name: str, index=None):
+        return self._context
+
+    def dump(self) -> None:
+        pass
+
+
+NULL_PROFILER = NullProfiler()
+
+
+class Profiler:
+    def __init__(self, output_dir: str, mode: str = 'sample', phases=None, interval: float = 0.001) -> None:
+        if mode not in MODES:
+            raise ValueError(f"Unknown profiling mode {mode}, expected one of {MODES}")
+        self.output_dir = output_dir
+        self.mode = mode
+        self.phases = set(PHASES if phases is None else phases)
+        self.interval = interval
+
+        self._stack = []    # names of the phases entered, innermost last
+        self._active = None  # key of the outermost selected phase being profiled
+        self._profiles = {}
+        self._samples = defaultdict(Counter)
+        self._sampler = None
+
+    @staticmethod
+    def _key(name: str, index) -> str:
+        if index is None:
+            return name
+        return f"{name}-{index:04d}" if isinstance(index, int) else f"{name}-{index}"
+
+    @contextmanager
+    def phase(self, name: str, index=None):
+        self._stack.append(name)
+        start = self._active is None and name in self.phases
+        if start:
+            self._active = self._key(name, index)
+            self._start()
+        try:
+            yield
+        finally:
+            if start:
+                self._stop()
+                self._active = None
+            self._stack.pop()
+
+    def _start(self) -> None:
+        if self.mode == 'cprofile':
+            profile = self._profiles.get(self._active)
+            if profile is None:
+                profile = self._profiles[self._active] = cProfile.Profile()
+            profile.enable()
+        elif self._sampler is None:
+            self._sampler = _Sampler(self, threading.get_ident())
+            self._sampler.start()
+
+    def _stop(self) -> None:
+        if self.mode == 'cprofile':
+            self._profiles[self._active].disable()
+
+    def _record(self, frame) -> None:
+        """Adds a sample of the profiled thread (called from the sampler thread)"""
+        active, stack = self._active, list(self._stack)
+        if active is None:
+            return
+        frames = []
+        while frame is not None:
+            code = frame.f_code
+            frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        frames.reverse()
+        self._samples[active][';'.join(stack + frames)] += 1
+
+    def dump(self) -> None:
+        if self._sampler is not None:
+            self._sampler.stop()
+            self._sampler = None
+        os.makedirs(self.output_dir, exist_ok=True)
+
+        for key, profile in self._profiles.items():
+            path = os.path.join(self.output_dir, key)
+            profile.dump_stats(f"{path}.prof")
+            with open(f"{path}.txt", 'w') as summary:
+                pstats.Stats(profile, stream=summary).sort_stats('cumulative').print_stats(30)
+
+        for key, stacks in self._samples.items():
+            path = os.path.join(self.output_dir, key)
+            with open(f"{path}.collapsed", 'w') as collapsed:
+                for stack, count in stacks.items():
+                    collapsed.write(f"{stack} {count}\n")
+
+            own, total = Counter(), Counter()
+            for stack, count in stacks.items():
+                functions = stack.split(';')
+                own[functions[-1]] += count
+                for function in set(functions):
+                    total[function] += count
+            n_samples = sum(stacks.values())
+            with open(f"{path}.txt", 'w') as summary:
+                summary.write(f"{n_samples} samples every {self.interval}s\n")
+                summary.write(f"{'self':>8}{'total':>8}  function\n")
+                for function, count in total.most_common(40):
+                    summary.write(f"{own[function]:>8}{count:>8}  {function}\n")
+
+
+class _Sampler(threading.Thread):
+    def __init__(self, profiler: Profiler, thread_id: int) -> None:
+        super().__init__(daemon=True)
+        self.profiler = profiler
+        self.thread_id = thread_id
+        self._stopped = threading.Event()
+
+    def run(self) -> None:
+        while not self._stopped.wait(self.profiler.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.profiler._record(frame)
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self.join()
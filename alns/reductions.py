@@ -0,0 +1,284 @@
+import os
+import heapq
+import numpy as np
+
+from collections import deque
+from math import inf
+
+from alns.compact_instance import CompactInstance
+from alns.solution_instance import SolutionInstance
+
+
+class Reduction:
+    """
+    Reduced instance and the log needed to expand its solutions back to
+    the original instance. A solution of the reduced instance has, once
+    expanded, the value solution.value + offset in the original one.
+
+    The solutions made only of removed nodes have no counterpart in the
+    reduced instance: the best of them (the removed node leftover and what
+    was merged into it) is worth leftover_value in the original instance,
+    so the optimum there is min(reduced optimum + offset, leftover_value).
+    """
+
+    def __init__(self, original: CompactInstance, instance: CompactInstance,
+                 node_map: np.ndarray, edge_paths: list, merges: list, offset: float,
+                 leftover: int = None, leftover_value: float = inf) -> None:
+        self.original = original
+        self.instance = instance
+        self.node_map = node_map      # reduced node index -> original node index
+        self.edge_paths = edge_paths  # reduced edge index -> original edge ids
+        self.merges = merges          # (leaf, original edge ids, anchor), in merge order
+        self.offset = offset
+        self.leftover = leftover      # original node index, None when unknown
+        self.leftover_value = leftover_value
+
+    def save(self, directory: str, **meta) -> None:
+        """
+        Writes the reduced instance as directory (see CompactInstance.save,
+        with preprocessed, offset and leftover_value in its meta), the
+        original instance as directory/original and the log to expand the
+        solutions in directory/reduction.npz: the node map, the original
+        edge ids of every reduced edge and of every merge, concatenated
+        with their offsets, the merged leaves and anchors and the leftover
+        (-1 when there is none)
+        """
+        self.instance.save(directory, **meta, preprocessed=True, offset=self.offset,
+                           leftover_value=None if self.leftover is None else self.leftover_value)
+        self.original.save(os.path.join(directory, 'original'), **meta)
+        paths = self.edge_paths + [path for _, path, _ in self.merges]
+        np.savez(os.path.join(directory, 'reduction.npz'),
+                 node_map=self.node_map,
+                 path_ids=np.concatenate(paths) if paths else np.zeros(0, dtype=np.int64),
+                 path_offsets=np.cumsum([0] + [len(path) for path in paths]),
+                 merge_leaves=np.array([leaf for leaf, _, _ in self.merges], dtype=np.int64),
+                 merge_anchors=np.array([anchor for _, _, anchor in self.merges], dtype=np.int64),
+                 leftover=-1 if self.leftover is None else self.leftover)
+
+    @classmethod
+    def load(cls, directory: str, instance: CompactInstance = None):
+        """Reads a reduction written by save, instance is the reduced one if already open"""
+        if not os.path.exists(os.path.join(directory, 'reduction.npz')):
+            raise ValueError(f"{directory} has no reduction log, convert it again with --preprocess")
+        instance = CompactInstance.load(directory) if instance is None else instance
+        original = CompactInstance.load(os.path.join(directory, 'original'))
+        with np.load(os.path.join(directory, 'reduction.npz')) as data:
+            ids, offsets = data['path_ids'], data['path_offsets']
+            paths = [ids[offsets[k]:offsets[k + 1]] for k in range(len(offsets) - 1)]
+            n_edges = instance.n_edges
+            merges = list(zip(data['merge_leaves'].tolist(), paths[n_edges:], data['merge_anchors'].tolist()))
+            leftover = int(data['leftover'])
+            node_map = data['node_map']
+        leftover_value = instance.meta.get('leftover_value')
+        return cls(original, instance, node_map, paths[:n_edges], merges, instance.meta.get('offset', 0.0),
+                   None if leftover < 0 else leftover, inf if leftover_value is None else leftover_value)
+
+    def value(self, value: float) -> float:
+        """Original value of the best of a reduced solution worth value and the leftover"""
+        return min(value + self.offset, self.leftover_value)
+
+    def lower_bound(self, bound: float) -> float:
+        """Lower bound of the original instance from one of the reduced instance"""
+        return min(bound + self.offset, self.leftover_value)
+
+    def leftover_solution(self) -> SolutionInstance:
+        """The leftover as a solution of the original instance"""
+        nodes = np.zeros(self.original.n_nodes, dtype=bool)
+        nodes[self.leftover] = True
+        return self._merge_leaves(np.zeros(self.original.n_edges, dtype=bool), nodes)
+
+    def expand_result(self, result: dict) -> dict:
+        """
+        A run result (see SimulatedAnnealing.results) with its solutions
+        expanded, the best one replaced by the leftover when that is better
+        """
+        result = dict(result)
+        for key in ("initial", "best", "current"):
+            result[key] = self.expand(result[key])
+        if self.leftover is not None and self.leftover_value < result["best"].value:
+            result["best"] = self.leftover_solution()
+        if "islands" in result:
+            result["islands"] = [self.expand_result(island) for island in result["islands"]]
+        return result
+
+    def expand(self, solution: SolutionInstance) -> SolutionInstance:
+        """The solution of the reduced instance as a solution of the original one"""
+        if self.instance is self.original:
+            # the solution may hold a shared copy of the instance
+            return SolutionInstance(self.original, solution.edges, solution.nodes)
+
+        edges = np.zeros(self.original.n_edges, dtype=bool)
+        for edge in np.flatnonzero(solution.edges).tolist():
+            edges[self.edge_paths[edge]] = True
+
+        nodes = self.original.edge_nodes(edges)
+        nodes[self.node_map[solution.nodes]] = True
+        return self._merge_leaves(edges, nodes)
+
+    def _merge_leaves(self, edges: np.ndarray, nodes: np.ndarray) -> SolutionInstance:
+        # a merged leaf comes back whenever the node it was merged into is taken
+        for leaf, path, anchor in reversed(self.merges):
+            if nodes[anchor]:
+                edges[path] = True
+                nodes[leaf] = True
+        # with the inner nodes of the paths contracted into the leaf edges
+        nodes |= self.original.edge_nodes(edges)
+
+        return SolutionInstance(self.original, edges, nodes)
+
+
+def _flatten(path) -> np.ndarray:
+    """Original edge ids of a path kept as nested (left, right) pairs"""
+    edges, stack = [], [path]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, tuple):
+            stack.extend(item)
+        else:
+            edges.append(item)
+    return np.array(edges, dtype=np.int64)
+
+
+def reduce_instance(instance: CompactInstance,
+                    dominance_tests: bool = True,
+                    max_settled: int = 64) -> Reduction:
+    """
+    Applies the prize collecting Steiner reductions with a worklist of nodes
+    whose degree changed:
+    - leaves with a prize not above their edge cost are removed,
+    - other leaves are merged into their neighbor (which takes prize - cost),
+    - the best of the removed nodes, with its prize at removal (what it and
+      the leaves merged into it are worth alone), is kept as the leftover,
+    - non terminal nodes of degree 2 are contracted into a single edge,
+    - edges with a cheaper alternative path (searched up to max_settled
+      nodes) are removed, once the worklist is empty.
+    """
+    n = instance.n_nodes
+    prizes = instance.prizes.tolist()
+    cost = instance.cost.tolist()
+    path = list(range(instance.n_edges))
+    ends = list(instance.endpoints)
+    edge_alive = [True] * instance.n_edges
+
+    adjacency = [dict() for _ in range(n)]
+    for edge, (n1, n2) in enumerate(ends):
+        adjacency[n1][n2] = edge
+        adjacency[n2][n1] = edge
+
+    alive = [True] * n
+    queued = [True] * n
+    queue = deque(range(n))
+    merges = []
+    offset = 0.0
+    leftover, leftover_prize = None, 0.0
+
+    def push(node):
+        if alive[node] and not queued[node]:
+            queued[node] = True
+            queue.append(node)
+
+    def remove_node(node):
+        nonlocal leftover, leftover_prize
+        if prizes[node] > leftover_prize:
+            leftover, leftover_prize = node, prizes[node]
+        for neighbor, edge in adjacency[node].items():
+            del adjacency[neighbor][node]
+            edge_alive[edge] = False
+        adjacency[node] = {}
+        alive[node] = False
+
+    def drain():
+        nonlocal offset
+        while queue:
+            node = queue.popleft()
+            queued[node] = False
+            if not alive[node]:
+                continue
+
+            degree = len(adjacency[node])
+            if degree == 0 and not prizes[node]:
+                alive[node] = False
+
+            elif degree == 1:
+                (neighbor, edge), = adjacency[node].items()
+                if prizes[node] <= cost[edge]:
+                    # never worth connecting, its prize is always lost
+                    offset += prizes[node]
+                else:
+                    # taken whenever its neighbor is, for cost[edge]
+                    prizes[neighbor] += prizes[node] - cost[edge]
+                    offset += cost[edge]
+                    merges.append((node, path[edge], neighbor))
+                remove_node(node)
+                push(neighbor)
+
+            elif degree == 2 and not prizes[node]:
+                (a, e1), (b, e2) = adjacency[node].items()
+                new_cost = cost[e1] + cost[e2]
+                new_path = (path[e1], path[e2])
+                remove_node(node)
+
+                existing = adjacency[a].get(b)
+                if existing is None:
+                    edge = len(cost)
+                    cost.append(new_cost)
+                    path.append(new_path)
+                    ends.append((a, b))
+                    edge_alive.append(True)
+                    adjacency[a][b] = adjacency[b][a] = edge
+                elif cost[existing] > new_cost:
+                    cost[existing] = new_cost
+                    path[existing] = new_path
+                push(a)
+                push(b)
+
+    def has_cheaper_path(source, target, skip, limit) -> bool:
+        dist = {source: 0.0}
+        settled = set()
+        heap = [(0.0, source)]
+        while heap:
+            d, node = heapq.heappop(heap)
+            if node == target:
+                return True
+            if node in settled:
+                continue
+            settled.add(node)
+            if len(settled) > max_settled:
+                return False
+            for neighbor, edge in adjacency[node].items():
+                new_d = d + cost[edge]
+                if edge != skip and new_d < limit and new_d < dist.get(neighbor, inf):
+                    dist[neighbor] = new_d
+                    heapq.heappush(heap, (new_d, neighbor))
+        return False
+
+    drain()
+    if dominance_tests:
+        for edge in range(len(cost)):
+            if not edge_alive[edge]:
+                continue
+            n1, n2 = ends[edge]
+            if has_cheaper_path(n1, n2, edge, cost[edge]):
+                del adjacency[n1][n2]
+                del adjacency[n2][n1]
+                edge_alive[edge] = False
+                push(n1)
+                push(n2)
+        drain()
+
+    node_map = np.array([node for node in range(n) if alive[node]], dtype=np.int64)
+    position = np.full(n, -1, dtype=np.int64)
+    position[node_map] = np.arange(len(node_map))
+
+    kept = [edge for edge in range(len(cost)) if edge_alive[edge]]
+    u = position[[ends[edge][0] for edge in kept]]
+    v = position[[ends[edge][1] for edge in kept]]
+    reduced_prizes = np.array(prizes)[node_map]
+
+    reduced = CompactInstance(instance.labels[node_map], reduced_prizes, reduced_prizes > 0,
+                              u, v, [cost[edge] for edge in kept])
+
+    return Reduction(instance, reduced, node_map,
+                     [_flatten(path[edge]) for edge in kept],
+                     [(leaf, _flatten(leaf_path), anchor) for leaf, leaf_path, anchor in merges],
+                     offset, leftover, instance.total_prize - leftover_prize if leftover is not None else inf)
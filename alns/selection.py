@@ -0,0 +1,171 @@
+''' Operator selection policies of ALNS. A policy chooses among the arms
+of an operator family (or among destroy x repair pairs, see ALNS), is
+credited after every ALNS iteration with the score of the candidate and
+the CPU seconds its operators took, and closes a segment at the end of
+every temperature iteration, where past evidence decays by the ALNS
+decay. Except the classic roulette, the policies value an operator by
+its score per CPU second, so that CPU goes to the operators that improve
+the most per unit of time. '''
+
+import numpy as np
+
+# shortest operator time taken into account, keeps the rates finite
+MIN_SECONDS = 1e-6
+
+
+class Selection:
+    """
+    weights are what the policy prefers (what the statistics record); the
+    count_operators, score_operators and time_operators are the evidence
+    of the current segment. STATE names what a checkpoint keeps
+    """
+    TIMED = True  # whether the policy needs the operator times
+    STATE = ('weights', 'count_operators', 'score_operators', 'time_operators')
+
+    def __init__(self, n_arms: int) -> None:
+        self.n_arms = n_arms
+        self.weights = np.ones(n_arms) / n_arms
+        self._new_segment()
+
+    def _new_segment(self) -> None:
+        self.count_operators = np.zeros(self.n_arms, dtype=int)
+        self.score_operators = np.zeros(self.n_arms)
+        self.time_operators = np.zeros(self.n_arms)
+
+    def select(self, rnd_state) -> int:
+        raise NotImplementedError
+
+    def update(self, index: int, score: float, seconds: float = 0.0) -> None:
+        self.count_operators[index] += 1
+        self.score_operators[index] += score
+        self.time_operators[index] += seconds
+
+    def end_segment(self, decay: float) -> None:
+        self._new_segment()
+
+    def get_state(self) -> dict:
+        return {name: np.copy(getattr(self, name)) for name in self.STATE}
+
+    def set_state(self, state: dict) -> None:
+        for name in self.STATE:
+            setattr(self, name, np.copy(state[name]))
+
+
+class Roulette(Selection):
+    """The classic ALNS roulette: weights smoothed with the mean score per call of the segment"""
+    TIMED = False
+
+    def select(self, rnd_state) -> int:
+        total = self.weights.sum()
+        return rnd_state.choice(self.n_arms, p=self.weights / total if total > 0 else None)
+
+    def _rewards(self, used: np.ndarray) -> np.ndarray:
+        return self.score_operators[used] / self.count_operators[used]
+
+    def end_segment(self, decay: float) -> None:
+        used = self.count_operators > 0
+        if used.any():
+            self.weights[used] = (1 - decay) * self.weights[used] + decay * self._rewards(used)
+        self._new_segment()
+
+
+class TimeRoulette(Roulette):
+    """
+    Roulette on the score per CPU second, scaled by the mean time of a call
+    of the segment: an operator twice as slow as the average needs twice
+    the score to keep its weight
+    """
+    TIMED = True
+
+    def _rewards(self, used: np.ndarray) -> np.ndarray:
+        seconds = np.maximum(self.time_operators[used], MIN_SECONDS * self.count_operators[used])
+        mean_seconds = seconds.sum() / self.count_operators[used].sum()
+        return self.score_operators[used] / seconds * mean_seconds
+
+
+class Bandit(Selection):
+    """
+    Evidence kept across segments, discounted by the decay at their end:
+    pulls, scores and CPU seconds of every arm. The weights are the score
+    per second of the arms, normalized
+    """
+    STATE = Selection.STATE + ('pulls', 'scores', 'seconds', 'max_score')
+
+    def __init__(self, n_arms: int) -> None:
+        super().__init__(n_arms)
+        self.pulls = np.zeros(n_arms)
+        self.scores = np.zeros(n_arms)
+        self.seconds = np.zeros(n_arms)
+        self.max_score = 0.0
+
+    def update(self, index: int, score: float, seconds: float = 0.0) -> None:
+        super().update(index, score, seconds)
+        self.pulls[index] += 1
+        self.scores[index] += score
+        self.seconds[index] += max(seconds, MIN_SECONDS)
+        self.max_score = max(self.max_score, score)
+
+    def end_segment(self, decay: float) -> None:
+        for evidence in (self.pulls, self.scores, self.seconds):
+            evidence *= 1 - decay
+        rates = self.rates()
+        if rates.sum() > 0:
+            self.weights = rates / rates.sum()
+        self._new_segment()
+
+    def rates(self) -> np.ndarray:
+        """Score per CPU second of every arm, 0 for the arms never pulled"""
+        return np.divide(self.scores, self._seconds(), out=np.zeros(self.n_arms), where=self.pulls > 0)
+
+    def _seconds(self) -> np.ndarray:
+        # the floor keeps the arms discounted down to subnormal numbers finite
+        return np.maximum(self.seconds, MIN_SECONDS * self.pulls)
+
+    def _untried(self, rnd_state):
+        """An arm never pulled, if any: every arm is tried once before the policy applies"""
+        untried = np.flatnonzero(self.pulls == 0)
+        return int(rnd_state.choice(untried)) if len(untried) else None
+
+
+class UCB1(Bandit):
+    """
+    UCB1 on the score per second normalized by the best arm, plus the
+    exploration bonus sqrt(EXPLORATION * ln(pulls) / pulls of the arm)
+    """
+    EXPLORATION = 2.0
+
+    def select(self, rnd_state) -> int:
+        untried = self._untried(rnd_state)
+        if untried is not None:
+            return untried
+        rates = self.rates()
+        best = rates.max()
+        values = rates / best if best > 0 else rates
+        bonus = np.sqrt(self.EXPLORATION * np.log(max(self.pulls.sum(), 1.0)) / self.pulls)
+        return int(np.argmax(values + bonus))
+
+
+class Thompson(Bandit):
+    """
+    Thompson sampling: the share of the best score an arm earns per call
+    has a Beta posterior; the arm with the best sampled share per mean
+    CPU second of a call is chosen
+    """
+
+    def select(self, rnd_state) -> int:
+        untried = self._untried(rnd_state)
+        if untried is not None:
+            return untried
+        successes = self.scores / self.max_score if self.max_score > 0 else np.zeros(self.n_arms)
+        failures = np.maximum(self.pulls - successes, 0)
+        shares = rnd_state.beta(1 + successes, 1 + failures)
+        return int(np.argmax(shares * self.pulls / self._seconds()))
+
+
+SELECTIONS = {
+    'roulette': Roulette,
+    'time-roulette': TimeRoulette,
+    'ucb1': UCB1,
+    'thompson': Thompson,
+}
+DEFAULT_SELECTION = 'roulette'
@@ -0,0 +1,38 @@
+import os
+import shutil
+import tempfile
+
+from alns.compact_instance import CompactInstance
+
+SHM_DIR = '/dev/shm'
+
+
+class SharedInstance:
+    """
+    Exports an instance once to memory-mapped files (kept in /dev/shm when
+    available) so worker processes attach to the same read-only pages
+    instead of unpickling their own copy. The files are removed on close.
+    """
+
+    def __init__(self, instance: CompactInstance) -> None:
+        self.directory = None
+        if instance._source is not None:
+            # already backed by files, nothing to export
+            self.instance = instance
+            return
+
+        self.directory = tempfile.mkdtemp(prefix='alns-',
+                                          dir=SHM_DIR if os.path.isdir(SHM_DIR) else None)
+        instance.save(self.directory)
+        self.instance = CompactInstance.load(self.directory)
+
+    def close(self) -> None:
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory = None
+
+    def __enter__(self) -> CompactInstance:
+        return self.instance
+
+    def __exit__(self, *exc) -> None:
+        self.close()
@@ -0,0 +1,77 @@
+import numpy as np
+
+from collections import OrderedDict
+
+
+class ShortestPathOracle:
+    """
+    Shortest-path trees of a static instance, cached by source.
+
+    Trees are kept as flat distance/predecessor-edge arrays and evicted
+    least recently used first once they take more than max_bytes.
+    """
+
+    def __init__(self, instance, max_bytes: int = 128 * 2**20) -> None:
+        self.instance = instance
+        self.max_bytes = max_bytes
+        self.n_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._trees = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._trees)
+
+    def _cached(self, source: int):
+        tree = self._trees.get(source)
+        if tree is not None:
+            self._trees.move_to_end(source)
+        return tree
+
+    def _store(self, source: int, tree) -> None:
+        self._trees[source] = tree
+        self.n_bytes += tree[0].nbytes + tree[1].nbytes
+        while self.n_bytes > self.max_bytes and len(self._trees) > 1:
+            _, (dist, pred) = self._trees.popitem(last=False)
+            self.n_bytes -= dist.nbytes + pred.nbytes
+            self.evictions += 1
+
+    def tree(self, source: int):
+        """Distances and predecessor edges (-1 at the source) of every node from source"""
+        tree = self._cached(source)
+        if tree is not None:
+            self.hits += 1
+            return tree
+
+        self.misses += 1
+        dist_dict, pred_dict = self.instance.dijkstra(source)
+        nodes = list(dist_dict.keys())
+
+        dist = np.full(self.instance.n_nodes, np.inf)
+        dist[nodes] = list(dist_dict.values())
+        pred = np.full(self.instance.n_nodes, -1, dtype=np.int32)
+        pred[nodes] = [pred_dict[n] for n in nodes]
+
+        tree = (dist, pred)
+        self._store(source, tree)
+        return tree
+
+    def path(self, source: int, target: int) -> list:
+        """Edges of the cheapest path from source to target"""
+        # the instance is undirected: the path always comes from the tree of
+        # the lowest node, so ties don't depend on which trees are cached
+        if target < source:
+            path = self.path(target, source)
+            path.reverse()
+            return path
+
+        _, pred = self.tree(source)
+        return self.instance.path_edges(pred, target)
+
+    def info(self) -> dict:
+        return {'trees': len(self._trees),
+                'bytes': self.n_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions}
@@ -1,13 +1,25 @@
+import os
+import pickle
 import numpy as np
+from time import monotonic
 from typing import Callable
 
 from alns.alns import ALNS
+from alns.batch import CandidatePool
+from alns.operators import MipRepairOperator, RepairOperator
+from alns.profiling import NULL_PROFILER
+from alns.selection import DEFAULT_SELECTION
 from alns.solution_instance import SolutionInstance
 from alns.statistics import Statistics
-from datetime import datetime
+from alns.termination import MaxIterations, Termination
+from datetime import timedelta
 
 
 class SimulatedAnnealing:
+    N_TEMPERATURE_ITERATIONS = 100
+    MAX_NO_IMPROVEMENT = 50
+    CHECKPOINT_VERSION = 4
+
     def __init__(self,
                  initial_solution: SolutionInstance,
                  temperature: float,
@@ -15,61 +27,218 @@ class SimulatedAnnealing:
                  alns_scores: list,
                  alns_decay: float,
                  alns_n_iterations: int,
+                 alns_batch_size: int = 1,
+                 alns_batch_workers: int = 0,
+                 termination: Termination = None,
+                 statistics_log: str = None,
+                 profiler=NULL_PROFILER,
+                 rnd_state: np.random.RandomState = None,
+                 lower_bound: float = None,
+                 mip_repair: dict = None,
+                 selection: str = DEFAULT_SELECTION,
+                 paired: bool = False,
                  ):
+        """
+        rnd_state: the generator every random draw of the run comes from
+        (see utils.random_state), so that a seeded run replays exactly
+        lower_bound: of the instance value (see alns.bounds), kept in the
+        statistics and used by the OptimalityGap termination
+        mip_repair: None, or the settings of MipRepairOperator (solver,
+        time_limit, max_nodes), which then adds mip_repair to the repairs
+        selection: the operator selection policy, a name of
+        alns.selection.SELECTIONS; paired to choose destroy x repair pairs
+        """
         self.temperature = temperature
         self.t_function = t_function
         self.initial_solution = initial_solution
+        self.termination = termination or MaxIterations(self.N_TEMPERATURE_ITERATIONS)
 
-        self.statistics = Statistics()
+        self.lower_bound = lower_bound
+        self.statistics = Statistics(statistics_log)
+        self.statistics.set_lower_bound(lower_bound)
 
         self.alns_scores = alns_scores
         self.alns_decay = alns_decay
         self.alns_n_iterations = alns_n_iterations
 
-        self.alns = ALNS(self.initial_solution, self.statistics)
+        repair_class = RepairOperator if mip_repair is None else MipRepairOperator
+
+        self.candidate_pool = None
+        if alns_batch_size > 1 and alns_batch_workers:
+            self.candidate_pool = CandidatePool(initial_solution.instance, alns_batch_workers,
+                                                repair_class, mip_repair)
+
+        self.alns = ALNS(self.initial_solution, self.statistics,
+                         batch_size=alns_batch_size,
+                         candidate_pool=self.candidate_pool,
+                         profiler=profiler,
+                         rnd_state=rnd_state,
+                         repair_class=repair_class,
+                         repair_settings=mip_repair,
+                         selection=selection,
+                         paired=paired)
+        self.rnd_state = self.alns.rnd_state
+        self.profiler = profiler
+
+        self.scores = np.asarray(self.alns_scores, dtype=np.float16)
+        self.curr_temp = self.t_function(0, self.temperature)
+        self.temp_iter = 0
+        self.best_iter = 0  # temperature iteration of the last new best solution
+        self.elapsed = timedelta(0)
+        self._started = None
 
     def apply_alns(self, temp, scores, count_no_improvement):
         return self.alns.run(scores,
                              temp,
                              count_no_improvement)
 
-    def simulate(self) -> dict:
-        list_temps = list()
-
-        scores = np.asarray(self.alns_scores, dtype=np.float16)
-        curr_temp = self.t_function(0, self.temperature)
-
-        temp_iter = 0
-        start_time = datetime.now()
-        while temp_iter < 100: #curr_temp > 0.001:
-            count_no_improvement = 0
-            for i in range(self.alns_n_iterations):
-                count_no_improvement = self.apply_alns(curr_temp,
-                                                       scores,
-                                                       count_no_improvement)
-                if count_no_improvement >= 50:
-                    self.statistics.add_no_improvement(i, temp_iter, curr_temp)
-                    break
-
-            curr_temp = self.t_function(temp_iter, self.temperature)
-            list_temps.append(curr_temp)
-            temp_iter += 1
-
-            self.statistics.add_destroy_operator_info(self.alns.destroy_operator)
-            self.statistics.add_repair_operator_info(self.alns.repair_operator)
-
-            self.statistics.add_evaluation_info(self.alns)
-
-            self.alns.destroy_operator.update_weights(self.alns_decay)
-            self.alns.repair_operator.update_weights(self.alns_decay)
-
-            # print(self.alns.destroy_operator.weights, self.alns.repair_operator.weights)
-
-        end_time = datetime.now()
-        self.statistics.add_time_duration(end_time-start_time)
+    def finished(self) -> bool:
+        return self.termination.finished(self)
+
+    def start_clock(self) -> None:
+        self._started = monotonic()
+
+    def stop_clock(self) -> None:
+        self.elapsed = timedelta(seconds=self.run_time())
+        self._started = None
+
+    def run_time(self) -> float:
+        """Seconds of annealing so far, including the runs it was resumed from"""
+        running = monotonic() - self._started if self._started is not None else 0.0
+        return self.elapsed.total_seconds() + running
+
+    def best_so_far(self) -> SolutionInstance:
+        """
+        Best solution found so far. Safe to call from another thread while
+        the run goes on: accepted solutions are never modified, only replaced
+        """
+        return self.alns.best
+
+    def schedule_position(self) -> float:
+        """
+        Argument of t_function: the temperature iteration, or the budget used
+        scaled to N_TEMPERATURE_ITERATIONS so the cooling ends with the budget
+        """
+        progress = self.termination.progress(self)
+        if progress is None:
+            return self.temp_iter
+        return progress * self.N_TEMPERATURE_ITERATIONS
+
+    def temperature_iteration(self) -> None:
+        """Runs the ALNS iterations of the current temperature and cools down"""
+        best = self.alns.best
+        temperature = self.curr_temp
+        count_no_improvement = 0
+        for i in range(self.alns_n_iterations):
+            count_no_improvement = self.apply_alns(self.curr_temp,
+                                                   self.scores,
+                                                   count_no_improvement)
+            if count_no_improvement >= self.MAX_NO_IMPROVEMENT:
+                self.statistics.add_no_improvement(i, self.temp_iter, self.curr_temp)
+                break
+            if self.finished():
+                break
+
+        self.curr_temp = self.t_function(self.schedule_position(), self.temperature)
+        self.temp_iter += 1
+        if self.alns.best is not best:
+            self.best_iter = self.temp_iter
+
+        self.statistics.add_temperature_iteration(self.alns, temperature)
+
+        self.alns.update_weights(self.alns_decay)
+
+    def close(self) -> None:
+        if self.candidate_pool is not None:
+            self.candidate_pool.close()
+            self.candidate_pool = self.alns.candidate_pool = None
+
+    def results(self) -> dict:
         return {
             "initial": self.alns.initial_solution,
             "best": self.alns.best,
             "current": self.alns.curr_state,
             "statistics": self.statistics
         }
+
+    def get_state(self) -> dict:
+        """
+        Everything the run depends on between two temperature iterations:
+        solutions (as edge and node lists), the selection policies,
+        temperature, the random generator and the statistics so far
+        """
+        return {
+            'version': self.CHECKPOINT_VERSION,
+            'initial': self.alns.initial_solution.to_state(),
+            'best': self.alns.best.to_state(),
+            'current': self.alns.curr_state.to_state(),
+            'destroy_operator': self.alns.destroy_operator.get_state(),
+            'repair_operator': self.alns.repair_operator.get_state(),
+            'pairs': self.alns.pairs.get_state() if self.alns.pairs is not None else None,
+            'scores': self.scores,
+            'curr_temp': self.curr_temp,
+            'temp_iter': self.temp_iter,
+            'best_iter': self.best_iter,
+            'elapsed': timedelta(seconds=self.run_time()),
+            'random': self.rnd_state.get_state(),
+            'statistics': self.statistics,
+        }
+
+    def set_state(self, state: dict) -> None:
+        if state['version'] != self.CHECKPOINT_VERSION:
+            raise ValueError(f"Unsupported checkpoint version {state['version']}")
+        instance = self.initial_solution.instance
+        self.initial_solution = SolutionInstance.from_state(instance, state['initial'])
+        self.alns.initial_solution = self.alns.original_solution = self.initial_solution
+        self.alns.best = SolutionInstance.from_state(instance, state['best'])
+        self.alns.curr_state = SolutionInstance.from_state(instance, state['current'])
+        self.alns.destroy_operator.set_state(state['destroy_operator'])
+        self.alns.repair_operator.set_state(state['repair_operator'])
+        if self.alns.pairs is not None:
+            self.alns.pairs.set_state(state['pairs'])
+        self.scores = state['scores']
+        self.curr_temp = state['curr_temp']
+        self.temp_iter = state['temp_iter']
+        self.best_iter = state['best_iter']
+        self.elapsed = state['elapsed']
+        # in place, the operators hold the same generator
+        self.rnd_state.set_state(state['random'])
+        self.statistics = self.alns.statistics = state['statistics']
+        self.statistics.resume_log()
+
+    def checkpoint(self, file_name: str) -> None:
+        """Writes the state atomically: a reader sees the previous checkpoint or this one"""
+        # the logged rows leave the checkpoint, which then only keeps the offset of the log
+        self.statistics.flush()
+        tmp_name = f"{file_name}.tmp"
+        with open(tmp_name, 'wb') as checkpoint_file:
+            pickle.dump(self.get_state(), checkpoint_file, protocol=pickle.HIGHEST_PROTOCOL)
+            checkpoint_file.flush()
+            os.fsync(checkpoint_file.fileno())
+        os.replace(tmp_name, file_name)
+
+    def restore(self, file_name: str) -> None:
+        with open(file_name, 'rb') as checkpoint_file:
+            self.set_state(pickle.load(checkpoint_file))
+
+    def simulate(self, checkpoint_file: str = None, checkpoint_interval: int = 10) -> dict:
+        """
+        Runs the remaining temperature iterations. With a checkpoint_file, the
+        state is written there every checkpoint_interval temperature iterations
+        and at the end; restore it on a new instance to continue the run
+        """
+        self.start_clock()
+        while not self.finished():
+            with self.profiler.phase('temperature', self.temp_iter):
+                self.temperature_iteration()
+            if checkpoint_file and self.temp_iter % checkpoint_interval == 0:
+                self.checkpoint(checkpoint_file)
+
+        self.stop_clock()
+        self.statistics.add_time_duration(self.elapsed)
+        self.statistics.add_operator_metrics(self.alns.destroy_operator, self.alns.repair_operator)
+        self.statistics.flush()
+        if checkpoint_file:
+            self.checkpoint(checkpoint_file)
+        self.close()
+        return self.results()
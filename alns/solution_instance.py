@@ -1,60 +1,226 @@
 import networkx as nx
+import numpy as np
 
+from math import isclose
+
+from alns.compact_instance import CompactInstance
+from alns.union_find import Component, UnionFind
 from alns.utils import plot_graph
 
 class SolutionInstance:
-    """Object to represent an instance of the Steiner Problem with its solution and value."""
+    """
+    Object to represent an instance of the Steiner Problem with its solution and value.
+
+    The solution is an edge-membership mask over the compact instance, together
+    with the mask of the visited nodes (a solution may be a lone node).
+
+    The objective is kept as running totals (cost of the taken edges and prize
+    of the visited nodes) updated on every edge insertion or removal, so
+    reading the value never scans the instance. Set CHECK_VALUE to cross-check
+    it against the full evaluation.
+
+    The connected components are a union-find forest, built on the first
+    query and then updated on every edge insertion; removing an edge drops
+    it until the next query.
+    """
+    CHECK_VALUE = False
 
-    def __init__(self, instance: nx.Graph, solution: nx.Graph, value=None, instance_nodes=None) -> None:
+    def __init__(self, instance: CompactInstance, edges=None, nodes=None) -> None:
         self.__instance = instance
-        self.__instance_nodes = instance_nodes
-        self.__solution = solution
-        self.__value = value
-        if self.__instance_nodes is None:
-            self.__instance_nodes = [n for n in instance.nodes]
+        if edges is None:
+            edges = np.zeros(instance.n_edges, dtype=bool)
+        if nodes is None:
+            nodes = instance.edge_nodes(edges)
+        self.__edges = edges
+        self.__nodes = nodes
+        self.__degree = np.bincount(instance.u[edges], minlength=instance.n_nodes) + \
+            np.bincount(instance.v[edges], minlength=instance.n_nodes)
+        self.__n_edges = int(np.count_nonzero(edges))
+        self.__cost_edges = float(instance.cost[edges].sum())
+        self.__prize_nodes = float(instance.prizes[nodes].sum())
+        self.__forest = None
 
     @staticmethod
-    def evaluate(origin_graph: nx.Graph,
-                 solution: nx.Graph, origin_nodes=None) -> int:
-        if not origin_nodes:
-            origin_nodes = [n for n in origin_graph.nodes]
-        solution_n = [n for n in solution.nodes]
-        unvisited_nodes = list(set(origin_nodes).difference(solution_n))
+    def evaluate(instance: CompactInstance, edges, nodes) -> float:
+        cost_edges = instance.cost[edges].sum()
+        cost_unvisited_nodes = instance.prizes[~nodes].sum()
+
+        return float(cost_edges + cost_unvisited_nodes)
+
+    @classmethod
+    def new_solution_from_instance(cls, prev, edges, nodes=None):
+        return cls(prev.instance, edges, nodes)
+
+    @classmethod
+    def from_graph(cls, instance: CompactInstance, solution: nx.Graph):
+        """Wraps a nx solution graph whose nodes are labels of the instance"""
+        nodes = np.zeros(instance.n_nodes, dtype=bool)
+        nodes[[instance.index[n] for n in solution.nodes]] = True
+
+        edges = np.zeros(instance.n_edges, dtype=bool)
+        for n1, n2 in solution.edges:
+            edges[instance.edge_between(instance.index[n1], instance.index[n2])] = True
 
-        cost_edges = sum([e[2]["cost"]
-                          for e in solution.edges(data=True)])
-        cost_unvisited_nodes = sum([origin_graph.nodes[n]['prize']
-                                    for n in unvisited_nodes])
+        return cls(instance, edges, nodes)
 
-        return cost_edges + cost_unvisited_nodes
+    @classmethod
+    def from_edge_list(cls, instance: CompactInstance, edge_list):
+        """Rebuilds a solution sent as the ids of its edges"""
+        edges = np.zeros(instance.n_edges, dtype=bool)
+        edges[edge_list] = True
+        return cls(instance, edges)
+
+    def to_edge_list(self) -> np.ndarray:
+        """Compact form of the solution to send between processes"""
+        return np.flatnonzero(self.__edges).astype(np.int32)
+
+    def to_state(self) -> tuple:
+        """
+        Compact form that restores the solution exactly, running totals
+        included (see from_state)
+        """
+        return (self.to_edge_list(), np.flatnonzero(self.__nodes).astype(np.int32),
+                self.__cost_edges, self.__prize_nodes)
 
     @classmethod
-    def new_solution_from_instance(cls, prev, solution):
-        return cls(prev.instance, solution, None, prev.instance_nodes)
+    def from_state(cls, instance: CompactInstance, state: tuple):
+        edge_list, node_list, cost_edges, prize_nodes = state
+        nodes = np.zeros(instance.n_nodes, dtype=bool)
+        nodes[node_list] = True
+        solution = cls.from_edge_list(instance, edge_list)
+        solution.__nodes = nodes
+        solution.__cost_edges = cost_edges
+        solution.__prize_nodes = prize_nodes
+        solution.__forest = None
+        return solution
 
     def copy(self):
-        return SolutionInstance(self.instance, self.solution.copy(), self.__value, self.instance_nodes)
+        other = SolutionInstance.__new__(SolutionInstance)
+        other.__instance = self.__instance
+        other.__edges = self.__edges.copy()
+        other.__nodes = self.__nodes.copy()
+        other.__degree = self.__degree.copy()
+        other.__n_edges = self.__n_edges
+        other.__cost_edges = self.__cost_edges
+        other.__prize_nodes = self.__prize_nodes
+        other.__forest = self.__forest.copy() if self.__forest is not None else None
+        return other
 
     def plot(self, output='plotgraph.png', terminals=True, save=True, pos=None, title='Plot Graph', show=False):
-        return plot_graph(self.instance, output, terminals, self.solution, save, pos, title, show)
+        return plot_graph(self.instance.to_graph(), output, terminals, self.solution, save, pos, title, show)
+
+    def add_node(self, node: int) -> None:
+        if not self.__nodes[node]:
+            self.__nodes[node] = True
+            self.__prize_nodes += float(self.__instance.prizes[node])
+            if self.__forest is not None:
+                self.__forest.add(node)
+
+    def add_edge(self, edge: int) -> None:
+        if self.__edges[edge]:
+            return
+        self.__edges[edge] = True
+        self.__n_edges += 1
+        self.__cost_edges += float(self.__instance.cost[edge])
+        n1, n2 = self.__instance.endpoints[edge]
+        for node in (n1, n2):
+            self.__degree[node] += 1
+            self.add_node(node)
+        if self.__forest is not None:
+            self.__forest.union(n1, n2)
+
+    def remove_edge(self, edge: int) -> None:
+        """Removes the edge and the nodes it leaves isolated"""
+        if not self.__edges[edge]:
+            return
+        self.__edges[edge] = False
+        self.__n_edges -= 1
+        self.__forest = None
+        self.__cost_edges -= float(self.__instance.cost[edge])
+        for node in self.__instance.endpoints[edge]:
+            self.__degree[node] -= 1
+            if not self.__degree[node]:
+                self.__nodes[node] = False
+                self.__prize_nodes -= float(self.__instance.prizes[node])
+
+    def merge_path(self, path: list) -> None:
+        """Adds the edges of a path to the solution"""
+        for edge in path:
+            self.add_edge(edge)
+
+    def remove_edges(self, edges) -> None:
+        """Removes the edges and the nodes left isolated"""
+        for edge in np.asarray(edges).tolist():
+            self.remove_edge(edge)
+
+    def _forest(self) -> UnionFind:
+        if self.__forest is None:
+            forest = UnionFind()
+            for node in np.flatnonzero(self.__nodes).tolist():
+                forest.add(node)
+            endpoints = self.__instance.endpoints
+            for edge in np.flatnonzero(self.__edges).tolist():
+                forest.union(*endpoints[edge])
+            self.__forest = forest
+        return self.__forest
+
+    def component(self, node: int) -> Component:
+        """Component of the node: a container of its nodes, valid until the solution changes"""
+        return self._forest().component(node)
+
+    def largest_component(self) -> Component:
+        """Largest component of the solution (None when it is empty)"""
+        forest = self._forest()
+        return None if forest.largest is None else forest.component(forest.largest)
+
+    def connected(self, n1: int, n2: int) -> bool:
+        forest = self._forest()
+        return forest.find(n1) == forest.find(n2)
+
+    def components(self, min_size=2) -> list:
+        """Connected components of the solution as node index lists, largest first"""
+        components = [list(members) for members in self._forest().members.values() if len(members) >= min_size]
+        return sorted(components, key=len, reverse=True)
+
+    def subsolution(self, component: list):
+        """New solution keeping only the given connected component"""
+        nodes = np.zeros(self.__instance.n_nodes, dtype=bool)
+        nodes[component] = True
+        edges = self.__edges & nodes[self.__instance.u]
+        return SolutionInstance(self.__instance, edges, nodes)
 
     @property
-    def instance(self):
+    def instance(self) -> CompactInstance:
         return self.__instance
 
     @property
-    def instance_nodes(self):
-        return self.__instance_nodes
+    def edges(self) -> np.ndarray:
+        return self.__edges
+
+    @property
+    def nodes(self) -> np.ndarray:
+        return self.__nodes
+
+    @property
+    def n_edges(self) -> int:
+        return self.__n_edges
 
     @property
-    def value(self) -> int:
-        if self.__value is None:
-            self.__value = self.evaluate(self.__instance, self.__solution, self.__instance_nodes)
-        return self.__value
+    def value(self) -> float:
+        value = self.__cost_edges + self.__instance.total_prize - self.__prize_nodes
+        if self.CHECK_VALUE:
+            full_value = self.evaluate(self.__instance, self.__edges, self.__nodes)
+            if not isclose(value, full_value, rel_tol=1e-9, abs_tol=1e-6):
+                raise RuntimeError(f"Incremental value {value} differs from evaluation {full_value}")
+        return value
 
     @property
     def solution(self) -> nx.Graph:
-        return self.__solution
+        """The solution as a nx graph, for plotting and export"""
+        return self.__instance.to_graph(self.__edges, self.__nodes)
+
+    def __contains__(self, node: int) -> bool:
+        return bool(self.__nodes[node])
 
     def __lt__(self, other) -> bool:
         return self.value < other.value
@@ -1,77 +1,201 @@
+import numpy as np
+import networkx as nx
 import pyomo.environ as pyo
-from pyomo.opt import SolverFactory
+from pyomo.common.log import LoggingIntercept
+from pyomo.opt import SolverFactory, TerminationCondition
 
+from time import time
+
+from alns.compact_instance import CompactInstance
+from alns.solution_instance import SolutionInstance
+
+''' Exact prize collecting Steiner model (rooted single-commodity flow).
+
+Every edge becomes two arcs, and an artificial root has an arc to every
+terminal; the solution is an arborescence hanging from one root arc:
+- every taken node has exactly one incoming arc (tree arc or root arc),
+- the root sends one unit of flow to every taken node through taken arcs,
+  which forbids the cycles disconnected from the root that the degree
+  constraints alone allow.
+Only terminals need a root arc: a tree without a terminal is never better
+than the empty solution. The constraints are built from the CSR incidence
+of the arcs, in time linear in the size of the instance. '''
+
+# name of the time limit option of each solver
+TIME_LIMIT_OPTIONS = {'glpk': 'tmlim', 'cbc': 'sec', 'appsi_highs': 'time_limit', 'gurobi': 'TimeLimit'}
 
-def solve(graph):
-    """
-    min cost_edge + prize_outter_nodes
-    should be connected
-    binary variables to choose the nodes
-    binary variables to choose the edges
-    """
-    nodes = [0 for _ in range(len(graph))]
-    n_prize = {}
-    i = 0
-    for n, n_data in graph.nodes(data=True):
-        nodes[i] = n
-        n_prize[n] = n_data['prize']
-        i += 1
-
-    edges = [i for i in range(len(graph.edges))]
-    n1 = {}
-    n2 = {}
-    e_cost = {}
-    i = 0
-    for node1, node2, e_data in graph.edges(data=True):
-        n1[i] = node1
-        n2[i] = node2
-        e_cost[i] = e_data['cost']
-        i += 1
+
+def _incidence(heads: np.ndarray, n_nodes: int):
+    """CSR lists of the arcs entering each node"""
+    order = np.argsort(heads, kind='stable')
+    indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(heads, minlength=n_nodes), out=indptr[1:])
+    return indptr, order
+
+
+def build_model(instance: CompactInstance) -> pyo.ConcreteModel:
+    n, m = instance.n_nodes, instance.n_edges
+    tails = np.concatenate((instance.u, instance.v))
+    heads = np.concatenate((instance.v, instance.u))
+    arc_cost = np.concatenate((instance.cost, instance.cost)).tolist()
+    prizes = instance.prizes.tolist()
+    terminals = np.flatnonzero(instance.terminals).tolist()
+
+    in_ptr, in_arcs = _incidence(heads, n)
+    out_ptr, out_arcs = _incidence(tails, n)
+    in_arcs, out_arcs = in_arcs.tolist(), out_arcs.tolist()
+    tails, heads = tails.tolist(), heads.tolist()
 
     model = pyo.ConcreteModel()
-    
-    # Define the sets to help creating variables and parameters
-    model.nodes = pyo.Set(initialize=nodes, doc="Nodes")
-    model.edges = pyo.Set(initialize=edges, doc="Edges")
-
-    # Add the data to the problem
-    model.prize = pyo.Param(model.nodes, initialize=n_prize, doc="Nodes prizes if taken (cost if not)")
-    model.cost = pyo.Param(model.edges, initialize=e_cost, doc="Edges costs added if taken")
-    model.n1 = pyo.Param(model.edges, initialize=n1, doc="One side of the edge")
-    model.n2 = pyo.Param(model.edges, initialize=n2, doc="The other side of the edge")
-
-    # Create the variables
-    model.n = pyo.Var(model.nodes, domain=pyo.Binary, doc="Select nodes to the solution tree")
-    model.e = pyo.Var(model.edges, domain=pyo.Binary, doc="Select edges to the solution tree")
-    model.aux = pyo.Var(domain=pyo.NonNegativeIntegers)
-
-    # Add the constraints (rules)
-    def edge_rule(model, i):
-        return 2 * model.e[i] <= model.n[model.n1[i]] + model.n[model.n2[i]]
-    model.edge_rule = pyo.Constraint(model.edges, rule=edge_rule, doc="If one edge is added its nodes should be added")
-
-    model.connective = pyo.Constraint(rule=sum(model.n[i] for i in model.nodes) == sum(model.e[i] for i in model.edges) + 1)
-
-    def node_rule(model, i):
-        return model.n[i] <= model.e[model.n1.sparse_values().index(i)] + model.e[model.n2.sparse_values().index(i)]
-    model.node_rule = pyo.Constraint(model.nodes, rule=node_rule)
-
-    # Define the objective
-    def objective(model):
-        return pyo.sum_product(model.prize, model.n) - pyo.sum_product(model.cost, model.e)
-    model.objective = pyo.Objective(rule=objective, sense=pyo.maximize, doc="Minimize cost")
-
-    # Optimize it
-    opt = SolverFactory('glpk')
-    results = opt.solve(model)
-    # #sends results to stdout
-    results.write()
-    # print("\nDisplaying Solution\n" + '-'*60)
-    # pyomo_postprocess(None, model, results)
+    model.nodes = pyo.RangeSet(0, n - 1)
+    model.arcs = pyo.RangeSet(0, 2 * m - 1)
+    model.edges = pyo.RangeSet(0, m - 1)
+    model.roots = pyo.Set(initialize=terminals, doc="Nodes the artificial root can link")
 
-    return model
+    model.y = pyo.Var(model.nodes, domain=pyo.Binary, doc="Node taken")
+    model.x = pyo.Var(model.arcs, domain=pyo.Binary, doc="Arc taken (edge e is arcs e and e + m)")
+    model.z = pyo.Var(model.roots, domain=pyo.Binary, doc="Root arc taken")
+    model.f = pyo.Var(model.arcs, domain=pyo.NonNegativeReals, doc="Flow on the arc")
+    model.g = pyo.Var(model.roots, domain=pyo.NonNegativeReals, doc="Flow on the root arc")
 
+    model.objective = pyo.Objective(
+        expr=pyo.quicksum(arc_cost[a] * model.x[a] for a in model.arcs) +
+        pyo.quicksum(prizes[i] * (1 - model.y[i]) for i in model.nodes if prizes[i]),
+        sense=pyo.minimize, doc="Cost of the taken edges and prizes of the nodes left out")
 
+    def in_arcs_of(i):
+        return in_arcs[in_ptr[i]:in_ptr[i + 1]]
 
+    def out_arcs_of(i):
+        return out_arcs[out_ptr[i]:out_ptr[i + 1]]
 
+    def parent_rule(model, i):
+        root = model.z[i] if i in model.roots else 0
+        return sum(model.x[a] for a in in_arcs_of(i)) + root == model.y[i]
+    model.parent = pyo.Constraint(model.nodes, rule=parent_rule, doc="A taken node has one incoming arc")
 
+    model.one_root = pyo.Constraint(expr=sum(model.z[i] for i in model.roots) == 1)
+
+    def flow_rule(model, i):
+        root = model.g[i] if i in model.roots else 0
+        return root + sum(model.f[a] for a in in_arcs_of(i)) - sum(model.f[a] for a in out_arcs_of(i)) == model.y[i]
+    model.flow = pyo.Constraint(model.nodes, rule=flow_rule, doc="A taken node consumes one unit of flow")
+
+    model.arc_capacity = pyo.Constraint(model.arcs, rule=lambda model, a: model.f[a] <= (n - 1) * model.x[a])
+    model.root_capacity = pyo.Constraint(model.roots, rule=lambda model, i: model.g[i] <= n * model.z[i])
+
+    # valid inequalities, they tighten the linear relaxation
+    model.one_direction = pyo.Constraint(model.edges, rule=lambda model, e: model.x[e] + model.x[e + m] <= 1)
+    model.taken_tail = pyo.Constraint(model.arcs, rule=lambda model, a: model.x[a] <= model.y[tails[a]])
+
+    model.m = m
+    return model
+
+
+def _warm_start(model, instance: CompactInstance, solution: SolutionInstance) -> bool:
+    """
+    Sets the variables to the tree spanned, from its best terminal, by the
+    component of the solution that holds it. False when it has no terminal
+    """
+    nodes = np.flatnonzero(solution.nodes & instance.terminals)
+    if not len(nodes):
+        return False
+    root = int(nodes[np.argmax(instance.prizes[nodes])])
+
+    adjacency = {}
+    for edge in np.flatnonzero(solution.edges).tolist():
+        n1, n2 = int(instance.u[edge]), int(instance.v[edge])
+        adjacency.setdefault(n1, []).append((n2, edge, edge))
+        adjacency.setdefault(n2, []).append((n1, edge, edge + model.m))
+
+    # arcs in breadth first order from the root, the flow of an arc is the size of its subtree
+    order, parent_arc, seen = [root], {}, {root}
+    for node in order:
+        for neighbor, edge, arc in adjacency.get(node, ()):
+            if neighbor not in seen:
+                # arc e goes u -> v, arc e + m goes v -> u
+                parent_arc[neighbor] = edge if instance.u[edge] == node else edge + model.m
+                seen.add(neighbor)
+                order.append(neighbor)
+    subtree = dict.fromkeys(order, 1)
+    for node in reversed(order[1:]):
+        arc = parent_arc[node]
+        tail = int(instance.u[arc] if arc < model.m else instance.v[arc - model.m])
+        subtree[tail] += subtree[node]
+
+    for var in (model.y, model.x, model.z, model.f, model.g):
+        for index in var:
+            var[index].value = 0
+    for node in order:
+        model.y[node].value = 1
+    for node, arc in parent_arc.items():
+        model.x[arc].value = 1
+        model.f[arc].value = subtree[node]
+    model.z[root].value = 1
+    model.g[root].value = len(order)
+    return True
+
+
+def _cutoff(model, solution: SolutionInstance) -> None:
+    """For the solvers without a MIP start, the start only bounds the objective"""
+    model.cutoff = pyo.Constraint(expr=model.objective.expr <= solution.value + 1e-6 * abs(solution.value))
+
+
+def _solution(model, instance: CompactInstance) -> SolutionInstance:
+    x = np.array([model.x[a].value or 0 for a in model.arcs]) > 0.5
+    edges = x[:model.m] | x[model.m:]
+    nodes = np.array([model.y[i].value or 0 for i in model.nodes]) > 0.5
+    return SolutionInstance(instance, edges, nodes)
+
+
+def solve(instance, initial: SolutionInstance = None, time_limit: float = None,
+          solver: str = 'glpk', tee: bool = False) -> dict:
+    """
+    Solves the instance (a CompactInstance or a networkx graph) with a MIP
+    solver, starting from initial (e.g. the best ALNS solution) and stopping
+    after time_limit seconds. Returns the best solution found, its value, the
+    lower bound proven by the solver and whether the solution is optimal
+    """
+    if isinstance(instance, nx.Graph):
+        instance = CompactInstance.from_graph(instance)
+
+    t0 = time()
+    model = build_model(instance)
+    build_time = time() - t0
+
+    opt = SolverFactory(solver)
+    if time_limit is not None:
+        opt.options[TIME_LIMIT_OPTIONS.get(solver, 'time_limit')] = time_limit
+
+    kwargs = {}
+    if initial is not None:
+        if opt.warm_start_capable() and _warm_start(model, instance, initial):
+            kwargs['warmstart'] = True
+        else:
+            _cutoff(model, initial)
+
+    t0 = time()
+    results = opt.solve(model, tee=tee, load_solutions=False, **kwargs)
+    solve_time = time() - t0
+
+    condition = results.solver.termination_condition
+    solution = None
+    if len(results.solution):
+        # a solution stopped by the time limit is expected, not worth a warning
+        with LoggingIntercept():
+            model.solutions.load_from(results)
+        solution = _solution(model, instance)
+    if initial is not None and (solution is None or initial.value < solution.value):
+        # nothing better than the start was found within the limit
+        solution = initial
+
+    lower_bound = results.problem.lower_bound
+    return {
+        'solution': solution,
+        'value': solution.value if solution is not None else None,
+        'lower_bound': None if lower_bound is None or not np.isfinite(lower_bound) else float(lower_bound),
+        'optimal': condition == TerminationCondition.optimal,
+        'status': str(condition),
+        'build_time': build_time,
+        'solve_time': solve_time,
+    }
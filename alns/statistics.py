@@ -1,91 +1,352 @@
+import os
+import csv
+import numpy as np
+
+from math import log10
+from time import monotonic
+
+import alns.utils as utils
+from alns.bounds import optimality_gap
+
+# one row per ALNS iteration
+ITERATION_COLUMNS = [('temp_iter', np.int32),
+                     ('temperature', np.float64),
+                     ('current', np.float64),
+                     ('best', np.float64),
+                     ('destroy', np.int8),
+                     ('repair', np.int8),
+                     ('outcome', np.int8),  # utils.BEST, BETTER, ACCEPTED or REJECTED
+                     ('elapsed', np.float64)]
+
+
+class Columns:
+    """Named NumPy columns with rows appended one at a time, growing by doubling"""
+
+    def __init__(self, dtype, capacity: int = 1024) -> None:
+        self._data = np.zeros(capacity, dtype=dtype)
+        self._n = 0
+
+    def __len__(self) -> int:
+        return self._n
+
+    def append(self, row: tuple) -> None:
+        if self._n == len(self._data):
+            data = np.zeros(2 * len(self._data), dtype=self._data.dtype)
+            data[:self._n] = self._data
+            self._data = data
+        self._data[self._n] = row
+        self._n += 1
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self._data[name][:self._n]
+
+    @property
+    def names(self) -> tuple:
+        return self._data.dtype.names
+
+    def rows(self) -> np.ndarray:
+        return self._data[:self._n]
+
+    def clear(self) -> None:
+        self._n = 0
+
+    def __getstate__(self):
+        # only the filled rows are pickled
+        return {'_data': self.rows().copy(), '_n': self._n}
+
+    def __setstate__(self, state) -> None:
+        self._data = state['_data']
+        self._n = state['_n']
+        if not len(self._data):
+            self._data = np.zeros(1, dtype=self._data.dtype)
+
+
+class RunningStats:
+    """Count, total, mean, deviation and range of a series in constant memory (Welford)"""
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def add(self, x: float) -> None:
+        self.count += 1
+        self.total += x
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+        self.min = min(self.min, x)
+        self.max = max(self.max, x)
+
+    @property
+    def std(self) -> float:
+        return (self.m2 / self.count) ** 0.5 if self.count else 0.0
+
+
+class TimingStats(RunningStats):
+    """
+    RunningStats that also counts the values in log-spaced bins (from
+    10**MIN_EXP to 10**MAX_EXP), giving percentiles within a bin width
+    (about 12%) in constant memory
+    """
+    BINS_PER_DECADE = 20
+    MIN_EXP = -7
+    MAX_EXP = 3
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.bins = np.zeros((self.MAX_EXP - self.MIN_EXP) * self.BINS_PER_DECADE + 1, dtype=np.int64)
+
+    def add(self, x: float) -> None:
+        super().add(x)
+        position = (log10(x) - self.MIN_EXP) * self.BINS_PER_DECADE if x > 0 else 0
+        self.bins[min(max(int(position), 0), len(self.bins) - 1)] += 1
+
+    def percentile(self, q: float) -> float:
+        """Upper edge of the bin holding the q-th percentile (0 <= q <= 100)"""
+        if not self.count:
+            return 0.0
+        position = int(np.searchsorted(np.cumsum(self.bins), q / 100 * self.count))
+        upper = 10 ** (self.MIN_EXP + (position + 1) / self.BINS_PER_DECADE)
+        return float(min(max(upper, self.min), self.max))
+
+
+class OperatorMetrics:
+    """What one operator costs and what it brings, over its real invocations"""
+
+    def __init__(self) -> None:
+        self.wall = TimingStats()
+        self.cpu = TimingStats()
+        self.delta = RunningStats()  # candidate value - current value, negative is better
+        self.outcomes = np.zeros(4, dtype=np.int64)  # indexed by utils.BEST, BETTER, ACCEPTED, REJECTED
+
+    @property
+    def calls(self) -> int:
+        return self.wall.count
+
+    def add_outcome(self, outcome: int, delta: float) -> None:
+        self.outcomes[outcome] += 1
+        self.delta.add(delta)
+
+
 class Statistics:
-    def __init__(self):
-        self._evaluations_curr_state = list()
-        self._evaluations_best = list()
+    """
+    Run statistics as columns: one row per ALNS iteration (ITERATION_COLUMNS)
+    and one per temperature iteration (values, operator weights and counts).
+
+    With a log_file the ALNS iteration rows are appended to it as CSV every
+    chunk_size rows; unless keep_iterations is set they are then dropped from
+    memory, so a run takes the same memory however long it is. Read the log
+    back with Statistics.read_log.
+    """
+
+    def __init__(self, log_file: str = None, chunk_size: int = 4096, keep_iterations: bool = None):
+        self.log_file = log_file
+        self.chunk_size = chunk_size
+        self.keep_iterations = log_file is None if keep_iterations is None else keep_iterations
 
-        self._destroy_operator_counts = list()
-        self._repair_operator_counts = list()
+        self._iterations = Columns(ITERATION_COLUMNS)
+        self._n_logged = 0    # rows of _iterations already in the log
+        self._log_offset = 0  # size of the log once they were written
+        if log_file is not None:
+            with open(log_file, 'w', newline='') as log:
+                csv.writer(log).writerow(self._iterations.names)
+                self._log_offset = log.tell()
 
-        self._destroy_operator_weights = list()
-        self._repair_operator_weights = list()
+        self._temperatures = None  # created with the operator names
+        self._destroy_names = self._repair_names = ()
 
         self._destroy_best_count = dict()
         self._repair_best_count = dict()
+        self._operator_metrics = {'destroy': {}, 'repair': {}}
 
-        self._temp_info = {'i': list(),
-                           'temp_iter': list(),
-                           'curr_temp': list()}
+        self._no_improvement = Columns([('i', np.int32), ('temp_iter', np.int32), ('curr_temp', np.float64)],
+                                       capacity=64)
 
         self._iter = 0
+        self._n_alns_iterations = 0
 
         self._time_duration = 0
+        self._lower_bound = None
+        self._elapsed = 0.0
+        self._started = monotonic()
+
+    def elapsed(self) -> float:
+        """Seconds since the statistics were created, resumed runs included"""
+        return self._elapsed + monotonic() - self._started
+
+    ### columns ###
+
+    def iterations(self) -> dict:
+        """Columns of the ALNS iterations kept in memory (see read_log for the streamed ones)"""
+        return {name: self._iterations[name] for name in self._iterations.names}
+
+    def temperature_iterations(self) -> dict:
+        """
+        Columns of the temperature iterations: temp_iter, temperature,
+        current, best, elapsed, and destroy_weights, repair_weights,
+        destroy_counts and repair_counts with one column per operator
+        """
+        if self._temperatures is None:
+            return {}
+        return {name: self._temperatures[name] for name in self._temperatures.names}
+
+    @staticmethod
+    def read_log(log_file: str) -> dict:
+        """Columns of an ALNS iterations log"""
+        data = np.genfromtxt(log_file, delimiter=',', names=True, dtype=ITERATION_COLUMNS, ndmin=1)
+        return {name: data[name] for name in data.dtype.names}
+
+    ### recording ###
+
+    def add_iteration(self, temperature: float, current: float, best: float,
+                      destroy: int, repair: int, outcome: int) -> None:
+        self._iterations.append((self._iter, temperature, current, best,
+                                 destroy, repair, outcome, self.elapsed()))
+        self._n_alns_iterations += 1
+        if self.log_file is not None and len(self._iterations) - self._n_logged >= self.chunk_size:
+            self.flush()
+
+    def add_temperature_iteration(self, alns, temperature: float) -> None:
+        destroy, repair = alns.destroy_operator, alns.repair_operator
+        if self._temperatures is None:
+            self._destroy_names = tuple(op.__name__ for op in destroy.operators)
+            self._repair_names = tuple(op.__name__ for op in repair.operators)
+            self._temperatures = Columns([('temp_iter', np.int32),
+                                          ('temperature', np.float64),
+                                          ('current', np.float64),
+                                          ('best', np.float64),
+                                          ('elapsed', np.float64),
+                                          ('destroy_weights', np.float32, (destroy.num_operators,)),
+                                          ('repair_weights', np.float32, (repair.num_operators,)),
+                                          ('destroy_counts', np.int32, (destroy.num_operators,)),
+                                          ('repair_counts', np.int32, (repair.num_operators,))],
+                                         capacity=128)
+
+        self._temperatures.append((self._iter, temperature, alns.curr_state.value, alns.best.value,
+                                   self.elapsed(), destroy.weights, repair.weights,
+                                   destroy.count_operators, repair.count_operators))
+        self._iter += 1
+
+    def add_no_improvement(self, i, temp_iter, curr_temp):
+        self._no_improvement.append((i, temp_iter, curr_temp))
+
+    def set_lower_bound(self, lower_bound: float) -> None:
+        self._lower_bound = lower_bound
+
+    def add_time_duration(self, delta):
+        self._time_duration = delta
+
+    def add_improvement_repair_count_op(self, r_op):
+        self._repair_best_count[r_op.name] = self._repair_best_count.get(r_op.name, 0) + 1
+
+    def add_improvement_destroy_count_op(self, d_op):
+        self._destroy_best_count[d_op.name] = self._destroy_best_count.get(d_op.name, 0) + 1
+
+    def add_operator_metrics(self, destroy_operator, repair_operator) -> None:
+        """OperatorMetrics by operator name of the run (see Operator.INSTRUMENT)"""
+        self._operator_metrics = {'destroy': destroy_operator.metrics, 'repair': repair_operator.metrics}
+
+    def flush(self) -> None:
+        """Appends the ALNS iterations not yet logged to the log file"""
+        if self.log_file is None or self._n_logged == len(self._iterations):
+            return
+        rows = self._iterations.rows()[self._n_logged:]
+        with open(self.log_file, 'a', newline='') as log:
+            log.seek(0, os.SEEK_END)
+            csv.writer(log).writerows(rows.tolist())
+            self._log_offset = log.tell()
+
+        if self.keep_iterations:
+            self._n_logged = len(self._iterations)
+        else:
+            self._iterations.clear()
+            self._n_logged = 0
+
+    def resume_log(self) -> None:
+        """
+        Drops from the log the rows written after these statistics were
+        saved (by a run that was interrupted and is resumed from them)
+        """
+        if self.log_file is not None and os.path.exists(self.log_file):
+            with open(self.log_file, 'r+b') as log:
+                log.truncate(self._log_offset)
+
+    def __getstate__(self):
+        # rows not yet logged travel with the state, _log_offset still
+        # marks the end of the ones written (see resume_log)
+        state = self.__dict__.copy()
+        state['_elapsed'] = self.elapsed()
+        state['_started'] = None
+        return state
+
+    def __setstate__(self, state) -> None:
+        state.setdefault('_lower_bound', None)  # statistics saved before the bounds
+        self.__dict__.update(state)
+        self._started = monotonic()
+
+    ### summaries ###
 
     def n_iterations(self):
         return self._iter
 
+    def n_alns_iterations(self):
+        return self._n_alns_iterations
+
     def temp_info(self):
-        return self._temp_info
+        return {name: self._no_improvement[name] for name in self._no_improvement.names}
 
     def time_duration(self):
         return self._time_duration
 
+    def lower_bound(self):
+        """Lower bound of the instance value given to the run, None without one"""
+        return self._lower_bound
+
+    def gap(self, value: float, offset: float = 0.0):
+        """Relative gap of a value of the run to the lower bound, both taken + offset"""
+        if self._lower_bound is None:
+            return None
+        return optimality_gap(value + offset, self._lower_bound + offset)
+
     def curr_state_evaluations(self):
-        return self._evaluations_curr_state
+        return self.temperature_iterations().get('current', np.zeros(0))
 
     def best_evaluations(self):
-        return self._evaluations_best
+        return self.temperature_iterations().get('best', np.zeros(0))
+
+    def _per_operator(self, column, names) -> dict:
+        if self._temperatures is None:
+            return {}
+        values = self._temperatures[column]
+        return {name: values[:, i] for i, name in enumerate(names)}
 
     def destroy_operator_counts(self):
-        return self._destroy_operator_counts
+        return self._per_operator('destroy_counts', self._destroy_names)
 
     def repair_operator_counts(self):
-        return self._repair_operator_counts
+        return self._per_operator('repair_counts', self._repair_names)
 
     def destroy_operator_weights(self):
-        return self._destroy_operator_weights
+        return self._per_operator('destroy_weights', self._destroy_names)
 
     def repair_operator_weights(self):
-        return self._repair_operator_weights
+        return self._per_operator('repair_weights', self._repair_names)
 
     def destroy_operator_n_improvements(self):
-        return self._repair_best_count
-
-    def repair_operator_n_improvements(self):
         return self._destroy_best_count
 
-    def add_evaluation_info(self, alns):
-        self._evaluations_best.append(alns.best.value)
-        self._evaluations_curr_state.append(alns.curr_state.value)
-        self._iter += 1
-
-    def add_destroy_operator_info(self, op):
-        self._destroy_operator_counts.append({n.__name__: c for n, c in zip(op.operators,
-                                                                            op.count_operators)})
-        self._destroy_operator_weights.append({n.__name__: w for n, w in zip(op.operators,
-                                                                             op.weights)})
-
-    def add_repair_operator_info(self, op):
-        self._repair_operator_counts.append({n.__name__: c for n, c in zip(op.operators,
-                                                                           op.count_operators)})
-        self._repair_operator_weights.append({n.__name__: w for n, w in zip(op.operators,
-                                                                            op.weights)})
-
-    def add_no_improvement(self, i, temp_iter, curr_temp):
-        self._temp_info['i'].append(i)
-        self._temp_info['temp_iter'].append(temp_iter)
-        self._temp_info['curr_temp'].append(curr_temp)
-
-    def add_time_duration(self, delta):
-        self._time_duration = delta
+    def repair_operator_n_improvements(self):
+        return self._repair_best_count
 
-    def add_improvement_repair_count_op(self, r_op):
-        try:
-            self._repair_best_count[r_op.name] += 1
-        except:
-            self._repair_best_count[r_op.name] = 1
+    def operator_metrics(self) -> dict:
+        return self._operator_metrics
 
-    def add_improvement_destroy_count_op(self, d_op):
-        try:
-            self._destroy_best_count[d_op.name] += 1
-        except:
-            self._destroy_best_count[d_op.name] = 1
+    def outcome_counts(self) -> dict:
+        """Number of kept ALNS iterations by outcome"""
+        outcomes = np.bincount(self._iterations['outcome'], minlength=4)
+        return {'best': int(outcomes[utils.BEST]), 'better': int(outcomes[utils.BETTER]),
+                'accepted': int(outcomes[utils.ACCEPTED]), 'rejected': int(outcomes[utils.REJECTED])}
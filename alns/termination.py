@@ -0,0 +1,116 @@
+''' Termination policies of SimulatedAnnealing. A policy is checked
+after every ALNS iteration, so a deadline or a target stops the run
+within one iteration. Policies with a budget also report the fraction
+of it already used, which drives the temperature schedule instead of
+the temperature iteration count. '''
+
+from math import inf
+
+from alns.bounds import optimality_gap
+
+
+class Termination:
+    def finished(self, sa) -> bool:
+        raise NotImplementedError
+
+    def progress(self, sa):
+        """Fraction of the budget used, None when the policy has no budget"""
+        return None
+
+    def __or__(self, other):
+        return AnyOf(self, other)
+
+    def __and__(self, other):
+        return AllOf(self, other)
+
+
+class MaxIterations(Termination):
+    """The original stop: a fixed number of temperature iterations"""
+
+    def __init__(self, n_iterations: int) -> None:
+        self.n_iterations = n_iterations
+
+    def finished(self, sa) -> bool:
+        return sa.temp_iter >= self.n_iterations
+
+
+class Deadline(Termination):
+    """Wall-clock budget in seconds, the cooling is stretched to end with it"""
+
+    def __init__(self, seconds: float) -> None:
+        self.seconds = seconds
+
+    def finished(self, sa) -> bool:
+        return sa.run_time() >= self.seconds
+
+    def progress(self, sa) -> float:
+        return min(sa.run_time() / self.seconds, 1.0)
+
+
+class TargetValue(Termination):
+    """
+    Stops once the best solution is worth target or less, taken back to
+    the original instance as in OptimalityGap: offset added, capped by the
+    value of the solution left behind by the reduction
+    """
+
+    def __init__(self, target: float, offset: float = 0.0, leftover_value: float = inf) -> None:
+        self.target = target
+        self.offset = offset
+        self.leftover_value = leftover_value
+
+    def finished(self, sa) -> bool:
+        return min(sa.alns.best.value + self.offset, self.leftover_value) <= self.target
+
+
+class OptimalityGap(Termination):
+    """
+    Stops once the best solution is within gap (relative) of the lower bound
+    of the run (see SimulatedAnnealing.lower_bound). Both values are taken
+    back to the original instance as Reduction.value does: offset added,
+    capped by the value of the solution left behind by the reduction
+    """
+
+    def __init__(self, gap: float = 0.0, offset: float = 0.0, leftover_value: float = inf) -> None:
+        self.gap = gap
+        self.offset = offset
+        self.leftover_value = leftover_value
+
+    def finished(self, sa) -> bool:
+        if sa.lower_bound is None:
+            return False
+        best = min(sa.alns.best.value + self.offset, self.leftover_value)
+        bound = min(sa.lower_bound + self.offset, self.leftover_value)
+        # the tolerance absorbs the rounding of the offset
+        return optimality_gap(best, bound) <= self.gap + 1e-9
+
+
+class Stagnation(Termination):
+    """Stops after n_iterations temperature iterations without a new best solution"""
+
+    def __init__(self, n_iterations: int) -> None:
+        self.n_iterations = n_iterations
+
+    def finished(self, sa) -> bool:
+        return sa.temp_iter - sa.best_iter >= self.n_iterations
+
+
+class AnyOf(Termination):
+    def __init__(self, *policies) -> None:
+        self.policies = policies
+
+    def finished(self, sa) -> bool:
+        return any(policy.finished(sa) for policy in self.policies)
+
+    def progress(self, sa):
+        progress = [p for p in (policy.progress(sa) for policy in self.policies) if p is not None]
+        return max(progress) if progress else None
+
+
+class AllOf(AnyOf):
+    def finished(self, sa) -> bool:
+        return all(policy.finished(sa) for policy in self.policies)
+
+    def progress(self, sa):
+        progress = [p for p in (policy.progress(sa) for policy in self.policies) if p is not None]
+        return min(progress) if progress else None
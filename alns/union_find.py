@@ -0,0 +1,78 @@
+class UnionFind:
+    """
+    Disjoint sets of nodes (union by size, path halving). Only the nodes
+    added are stored, any other node is a set of its own. Every root keeps
+    the list of its members, merged smaller into larger, and the root of
+    the largest set is kept up to date, so that both are O(α(n)) queries.
+    """
+
+    def __init__(self) -> None:
+        self.parent = {}
+        self.members = {}
+        self.largest = None
+
+    def copy(self):
+        other = UnionFind.__new__(UnionFind)
+        other.parent = self.parent.copy()
+        other.members = {root: members.copy() for root, members in self.members.items()}
+        other.largest = self.largest
+        return other
+
+    def add(self, node: int) -> None:
+        if node not in self.parent:
+            self.parent[node] = node
+            self.members[node] = [node]
+            if self.largest is None:
+                self.largest = node
+
+    def find(self, node: int) -> int:
+        parent = self.parent
+        if node not in parent:
+            return node
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    def union(self, a: int, b: int) -> int:
+        """Merges the sets of a and b, returns the root of the merged set"""
+        self.add(a)
+        self.add(b)
+        a, b = self.find(a), self.find(b)
+        if a == b:
+            return a
+        if len(self.members[a]) < len(self.members[b]):
+            a, b = b, a
+        self.parent[b] = a
+        self.members[a].extend(self.members.pop(b))
+        if self.largest == b or len(self.members[a]) > len(self.members[self.largest]):
+            self.largest = a
+        return a
+
+    def component(self, node: int):
+        """Live view of the set of node"""
+        return Component(self, self.find(node))
+
+
+class Component:
+    """
+    Set of a UnionFind as a container: membership is a find, so it can be
+    given as the targets of a search. Valid until the next union
+    """
+    __slots__ = ('forest', 'root')
+
+    def __init__(self, forest: UnionFind, root: int) -> None:
+        self.forest = forest
+        self.root = root
+
+    def nodes(self) -> list:
+        return self.forest.members.get(self.root, [self.root])
+
+    def __contains__(self, node: int) -> bool:
+        return self.forest.find(node) == self.root
+
+    def __len__(self) -> int:
+        return len(self.nodes())
+
+    def __iter__(self):
+        return iter(self.nodes())
@@ -1,8 +1,12 @@
-import re
+import os
+import hashlib
+import numpy as np
 import networkx as nx
 import matplotlib.pyplot as plt
 
-from typing import Any, Dict
+from array import array
+
+from alns.compact_instance import CompactInstance
 
 BEST = 0
 BETTER = 1
@@ -10,6 +14,16 @@ ACCEPTED = 2
 REJECTED = 3
 
 
+def random_state(seed=None) -> np.random.RandomState:
+    """
+    The random generator of a run, every random draw of the search comes
+    from it. Seeds go through a SeedSequence, so runs with close seeds
+    (seed, seed + 1...) still get independent streams; None seeds from
+    the OS entropy
+    """
+    return np.random.RandomState(np.random.MT19937(seed))
+
+
 def plot_graph(G: nx.Graph,
                output='plotgraph.png',
                terminals=True,
@@ -70,108 +84,141 @@ def plot_evals(statistics):
     plt.legend()
 
 
-def parse_file(file_name: str) -> nx.Graph:
+def _build_instance(ends: array, cost: array, prizes: dict) -> CompactInstance:
     """
-    Parses a file with the following pattern:
+    Builds the compact instance from the streamed edge endpoints
+    (node labels, two per edge) and costs. Nodes are the edge endpoints,
+    in order of appearance, and repeated edges keep their last cost.
+    """
+    ends = np.frombuffer(ends, dtype=np.int64).reshape(-1, 2)
+    cost = np.frombuffer(cost, dtype=np.float64)
+
+    unique, first = np.unique(ends.ravel(), return_index=True)
+    labels = unique[np.argsort(first, kind='stable')]
+    position = np.empty(len(unique), dtype=np.int64)
+    position[np.argsort(first, kind='stable')] = np.arange(len(unique))
+    u = position[np.searchsorted(unique, ends[:, 0])]
+    v = position[np.searchsorted(unique, ends[:, 1])]
+
+    keys = np.minimum(u, v) * len(labels) + np.maximum(u, v)
+    _, first_edge = np.unique(keys, return_index=True)
+    if len(first_edge) < len(keys):
+        # repeated edges keep their first position and their last cost
+        _, last_edge = np.unique(keys[::-1], return_index=True)
+        order = np.argsort(first_edge, kind='stable')
+        first_edge, last_edge = first_edge[order], (len(keys) - 1 - last_edge)[order]
+        u, v, cost = u[first_edge], v[first_edge], cost[last_edge]
+
+    prize = np.array([prizes.get(label, 0) for label in labels.tolist()], dtype=np.float64)
+    return CompactInstance(labels, prize, prize != 0, u, v, cost)
+
+
+def read_dat(file_name: str) -> CompactInstance:
+    """
+    Streams a file with the following pattern:
     *garbage*
+    'node'
+    *line of garbage*
+    int float float float\n  (name, v, h, weight)
+    .
     'link'
     *line of grabage*
-    int int int float\n
-    int int int float\n
+    int int int float\n  (name, n1, n2, weight)
     .
     .
-    .
-    where int is a integer (e.g 10, 152) and 
-    float is a float(e. g. 10.0, 15.2)
+    where the node weight is its prize (0 for non terminals)
+    """
+    ends, cost = array('q'), array('d')
+    prizes = {}
+    section = None
+    with open(file_name) as f:
+        for line in f:
+            fields = line.split()
+            if not fields or fields[0].startswith('#'):
+                continue
+            if len(fields) == 1 and fields[0] in ('node', 'link'):
+                section = fields[0]
+            elif section == 'link':
+                ends.append(int(fields[1]))
+                ends.append(int(fields[2]))
+                cost.append(float(fields[3]))
+            elif section == 'node':
+                prize = float(fields[-1])
+                if prize:
+                    prizes[int(fields[0])] = prize
+
+    return _build_instance(ends, cost, prizes)
+
+
+def read_stp(file_name: str) -> CompactInstance:
     """
+    Streams a benchmark file, reading the edges
+    ('E n1 n2 cost') of the Graph section and the prizes
+    ('TP node prize') of the Terminals section
+    """
+    ends, cost = array('q'), array('d')
+    prizes = {}
+    section = None
     with open(file_name) as f:
-        _text = f.read()
-
-    # useful data starts a bit after here
-    _text = _text.split("link")[-1]
-    # switch white spaces for ';' (except new lines)
-    text = re.sub(r'[^\S\r\n]+', ';', _text)
-
-    # create graph
-    G = nx.Graph()
-    edge = []
-    for line in text.split("\n")[2:]:
-        for t in line.split(";"):
-            if not t or t == "\n" or "#" in t: continue
-            if len(edge) < 3:
-                edge.append(int(t))
-            else:
-                edge.append(float(t))
-                G.add_edge(edge[0], edge[1],
-                           cost=edge[2])
-                edge = []
-
-    return G
+        for line in f:
+            fields = line.split()
+            if not fields:
+                continue
+            if fields[0] == 'SECTION':
+                section = fields[1] if len(fields) > 1 else None
+            elif fields[0] == 'END':
+                section = None
+            elif section == 'Graph' and fields[0] == 'E':
+                ends.append(int(fields[1]))
+                ends.append(int(fields[2]))
+                cost.append(float(fields[3]))
+            elif section == 'Terminals' and fields[0] == 'TP':
+                prizes[int(fields[1])] = float(fields[2])
+
+    return _build_instance(ends, cost, prizes)
+
+
+def _file_key(file_name: str) -> str:
+    """Hash of the file contents and modification time"""
+    digest = hashlib.sha1()
+    with open(file_name, 'rb') as f:
+        for chunk in iter(lambda: f.read(2**20), b''):
+            digest.update(chunk)
+    digest.update(str(os.stat(file_name).st_mtime_ns).encode())
+    return digest.hexdigest()[:16]
+
+
+def read_instance(file_name: str, cache_dir: str = None) -> CompactInstance:
+    """
+    Reads a .stp or .dat instance. With a cache_dir, the parsed
+    arrays are kept there as .npz files keyed by the file hash and
+    modification time, and later reads load them instead of parsing
+    """
+    read = read_stp if file_name.endswith('stp') else read_dat
+    if cache_dir is None:
+        return read(file_name)
+
+    cache_file = os.path.join(cache_dir,
+                              f"{os.path.basename(file_name)}.{_file_key(file_name)}.npz")
+    if os.path.isfile(cache_file):
+        return CompactInstance.load_npz(cache_file)
+
+    instance = read(file_name)
+    os.makedirs(cache_dir, exist_ok=True)
+    instance.save_npz(cache_file)
+    return instance
+
+
+def parse_file(file_name: str) -> nx.Graph:
+    """
+    Parses a .dat file (see read_dat) into a nx graph
+    """
+    return read_dat(file_name).to_graph()
 
 
 def parse_instance(file_name: str) -> nx.Graph:
     """
-    Parses a benchmark file into a
+    Parses a benchmark file (see read_stp) into a
     nx graph
     """
-    with open(file_name) as f:
-        text = f.read()
-
-    def get_sections(text: str) -> Dict[str, Any]:
-        """
-        Returns each section in the file
-        """
-        lines = text.split("\n")
-        sections = {}
-        c_section = {}
-        started = False
-        for line in lines:
-            # start of new section
-            if "SECTION" in line:
-                title = line[len("SECTION")+1:]
-                c_section[title] = []
-                started = True
-            # end of section
-            elif "END" in line:
-                sections.update(c_section)
-                c_section = {}
-                started = False
-            # start parsing
-            elif started:
-                c_section[title].append(line)
-        return sections
-
-    sections = get_sections(text)
-
-    def get_graph(sections: Dict[str, Any]) -> nx.Graph:
-        graph = sections["Graph"][2:]
-
-        G = nx.Graph()
-        for _edge in graph:
-            edge = _edge.split(" ")
-            G.add_edge(int(edge[1]), int(edge[2]), 
-                cost=float(edge[3]))
-        return G
-
-    G = get_graph(sections)
-
-    def set_attrs(G: nx.Graph, sections: Dict[str, Any]) ->\
-            Dict[str, Any]:
-        terminals = [section.split(" ") 
-            for section in sections["Terminals"][1:]]
-        terminal_nodes = {int(terminal[1]):float(terminal[2])
-            for terminal in terminals}
-
-        attrs = {}
-        for node in G.nodes:
-            prize = terminal_nodes.get(node, 0)
-            attrs[node] = {
-                "terminal": bool(prize), 
-                "prize": prize
-            }
-
-        nx.set_node_attributes(G, attrs)
-
-    set_attrs(G, sections)
-    
-    return G
\ No newline at end of file
+    return read_stp(file_name).to_graph()
@@ -1,15 +1,24 @@
 import os
+import re
+import argparse
 from math import log
 import pickle
-from tkinter.tix import MAX
 from matplotlib import pyplot as plt
-from time import sleep, time
-from multiprocessing import Process
+from time import time
+from contextlib import ExitStack
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 from alns import statistics, utils
-import alns.improvement as imp
+from alns.bounds import BOUNDS, lower_bound
+from alns.compact_instance import CompactInstance
+from alns.constructive import DEFAULT_HEURISTIC, HEURISTICS, initial_solution
+from alns.islands import IslandModel
+from alns.profiling import MODES, NULL_PROFILER, PHASES, Profiler
+from alns.reductions import Reduction, reduce_instance
+from alns.selection import DEFAULT_SELECTION, SELECTIONS
+from alns.shared_instance import SharedInstance
 from alns.simmulated_annealing import SimulatedAnnealing
-from alns.solution_instance import SolutionInstance
+from alns.termination import Deadline, MaxIterations, OptimalityGap, Stagnation, TargetValue
 
 
 ''' ALNS for Steiner prize collecting problem
@@ -20,7 +29,13 @@ problem optimization.'''
 
 FILEPATH = 'data/to_run'
 RESULTPATH = 'data/results'
-MAX_PROCESSES = 7
+CACHEPATH = 'data/cache'
+CHECKPOINTPATH = 'data/checkpoints'
+LOGPATH = 'data/logs'
+PROFILEPATH = 'data/profiles'
+CHECKPOINT_INTERVAL = 10
+N_RUNS = 5
+SEED = 0
 
 
 def t_function_1(t: float, t0: float, beta=0.9) -> float:
@@ -35,85 +50,281 @@ def t_function_3(t: float, t0: float, a=1000, b=2000) -> float:
     return a / (log(t + b))
 
 
-def _get_instances():
-    for filename in os.listdir(FILEPATH):
-        print(f"Parsing: {filename}")
-        file = os.path.join(FILEPATH, filename)
-        if not os.path.isfile(file):
-            continue
-        
-        if file.endswith('pickle'):
-            yield pickle.load(open(file, "rb")), filename
+def _read_instance(file):
+    if file.endswith('.csr'):
+        return CompactInstance.load(file)
 
-        elif file.endswith('stp'):
-            yield utils.parse_instance(file), filename
+    if not os.path.isfile(file):
+        return None
 
-        elif file.endswith('dat'):
-            yield utils.parse_file(file), filename
+    if file.endswith('pickle'):
+        return CompactInstance.from_graph(pickle.load(open(file, "rb")))
 
+    elif file.endswith('stp') or file.endswith('dat'):
+        return utils.read_instance(file, CACHEPATH)
 
-def _process(G, filename, **params):
-    results_list = []
-    statistics_list = []
-    timing_list = []
-
-    for i in range(5):
-        print(f"RUN {filename} {i+1}/5")
-        t0 = time()
-        initial_solution = SolutionInstance(G, imp.greedy_initial_solution(G))
-
-        sa = SimulatedAnnealing(initial_solution=initial_solution, **params)
-        result = sa.simulate()
-        
-        elapsed = time() - t0
-
-        results_list.append(result)
-        statistics_list.append(statistics_list)
-        timing_list.append(elapsed)
 
+def _get_instances(profiler=NULL_PROFILER):
+    for filename in os.listdir(FILEPATH):
+        print(f"Parsing: {filename}")
+        with profiler.phase('parse', filename):
+            instance = _read_instance(os.path.join(FILEPATH, filename))
+        if instance is not None:
+            yield instance, filename
+
+
+def _preprocess(G: CompactInstance, filename: str = None, profiler=NULL_PROFILER) -> Reduction:
+    if G.meta.get('preprocessed'):
+        return Reduction.load(os.path.join(FILEPATH, filename), G)
+    with profiler.phase('preprocess', filename):
+        reduction = reduce_instance(G)
+    print(f"Reduced: {G.n_nodes}/{G.n_edges} -> "
+          f"{reduction.instance.n_nodes}/{reduction.instance.n_edges} nodes/edges")
+    return reduction
+
+
+def _checkpoint_file(filename, repetition, seed):
+    return os.path.join(CHECKPOINTPATH, f'{filename}-{repetition}-{seed}.ckpt')
+
+
+def _profiler(name, profile):
+    """Profiler writing to PROFILEPATH/name, profile holds its mode, phases and interval"""
+    if not profile:
+        return NULL_PROFILER
+    return Profiler(os.path.join(PROFILEPATH, name), **profile)
+
+
+def _process(G, filename, repetition, seed, heuristic=DEFAULT_HEURISTIC,
+             checkpoint_interval=CHECKPOINT_INTERVAL, profile=None, **params):
+    """
+    Runs one repetition of the annealing on an instance, resuming it
+    from its checkpoint when a previous run was interrupted
+    """
+    profiler = _profiler(f'{filename}-{repetition}', profile)
+    # every draw of the repetition, initial solution included, comes from it
+    rnd_state = utils.random_state(seed)
+
+    t0 = time()
+    checkpoint_file = _checkpoint_file(filename, repetition, seed) if checkpoint_interval else None
+    resume = checkpoint_file is not None and os.path.exists(checkpoint_file)
+
+    # the ALNS iterations are streamed to the log instead of kept in the results,
+    # a resumed run takes the log back from its checkpoint
+    statistics_log = None if resume else os.path.join(LOGPATH, f'{filename}-{repetition}.csv')
+    with profiler.phase('initial'):
+        initial = initial_solution(G, heuristic, rnd_state)
+    sa = SimulatedAnnealing(initial_solution=initial, statistics_log=statistics_log,
+                            profiler=profiler, rnd_state=rnd_state, **params)
+    if resume:
+        sa.restore(checkpoint_file)
+
+    print(f"RUN {filename} #{repetition+1} (seed {seed})" +
+          (f" from temperature iteration {sa.temp_iter}" if sa.temp_iter else ""))
+    result = sa.simulate(checkpoint_file, checkpoint_interval)
+    profiler.dump()
+
+    elapsed = time() - t0
+
+    return filename, repetition, result, elapsed
+
+
+def _save_results(filename, runs, reduction, bound=None):
+    """
+    Saves the runs of an instance, with the solutions expanded back to
+    the original instance (no longer the shared files removed at the
+    end of the run), and the lower bound of the original instance
+    """
+    repetitions = sorted(runs)
+    runs = [(reduction.expand_result(result), elapsed) for result, elapsed in
+            (runs[i] for i in repetitions)]
     result_dict = {
-        "results": results_list,
-        "statistics": statistics_list,
-        "timing": timing_list
+        "results": [result for result, _ in runs],
+        "statistics": [result["statistics"] for result, _ in runs],
+        "timing": [elapsed for _, elapsed in runs],
+        "lower_bound": None if bound is None else reduction.lower_bound(bound)
     }
 
     result_filename = os.path.join(RESULTPATH, f'results-{filename}.pickle')
     with open(result_filename, 'wb') as result_file:
         pickle.dump(result_dict, result_file)
 
-
-def _wait_processes(processes, limit=MAX_PROCESSES):
-    while len(processes) >= limit:
-        for i, t in enumerate(processes):
-            if not t.is_alive():
-                processes.pop(i)
-        
-        sleep(2)
-
-
-def main():
-    params = {'temperature': 250,
+    # the repetitions are safe in the results file now; only their own
+    # checkpoints go, not those of an instance named filename-<something>
+    checkpoint = re.compile(re.escape(filename) + r'-(\d+)-(-?\d+)\.ckpt')
+    for name in os.listdir(CHECKPOINTPATH) if os.path.isdir(CHECKPOINTPATH) else ():
+        match = checkpoint.fullmatch(name)
+        if match and int(match.group(1)) in repetitions:
+            os.remove(os.path.join(CHECKPOINTPATH, name))
+
+
+def _schedule(instances, n_runs=N_RUNS, seed=SEED):
+    """
+    Work units (instance, filename, repetition, seed), biggest
+    instances first so the long runs don't end up last
+    """
+    tasks = [(G, filename, i, seed + i)
+             for G, filename in instances
+             for i in range(n_runs)]
+    return sorted(tasks, key=lambda task: task[0].n_edges, reverse=True)
+
+
+def _termination(reduction, time_limit=None, target=None, stagnation=None, gap=None):
+    """
+    Stops at the time limit (cooling within it) or after the usual number of
+    temperature iterations, and earlier on reaching the target value of the
+    original instance, after stagnation iterations without improvement or
+    within gap of the lower bound
+    """
+    termination = Deadline(time_limit) if time_limit else \
+        MaxIterations(SimulatedAnnealing.N_TEMPERATURE_ITERATIONS)
+    if target is not None:
+        termination |= TargetValue(target, reduction.offset, reduction.leftover_value)
+    if stagnation:
+        termination |= Stagnation(stagnation)
+    if gap is not None:
+        termination |= OptimalityGap(gap, reduction.offset, reduction.leftover_value)
+    return termination
+
+
+def main(n_workers=None, n_runs=N_RUNS, seed=SEED, n_islands=0, migration_interval=10,
+         batch_size=1, batch_workers=0, heuristic=DEFAULT_HEURISTIC,
+         checkpoint_interval=CHECKPOINT_INTERVAL, time_limit=None, target=None, stagnation=None,
+         profile=None, gap=None, bound='voronoi', lp_solver='glpk', mip_repair=None,
+         selection=DEFAULT_SELECTION, paired=False):
+    """
+    profile: None, or the mode, phases and interval of the profilers (see alns.profiling)
+    bound: the lower bound of each instance (see alns.bounds), lp_solver solves the lp one
+    mip_repair: None, or the settings of the mip_repair operator (see MipRepairOperator)
+    selection: the operator selection policy (see alns.selection), paired over destroy x repair pairs
+    """
+    params = {'heuristic': heuristic,
+            'temperature': 250,
             't_function': t_function_2,
             'alns_scores': [7, 3.5, 1, 0],
             'alns_decay': 0.8,
-            'alns_n_iterations': 500}
-
-    processes = []
-    for G, filename in _get_instances():
-
-        G = imp.remove_leaves(G)
-
-        if len(processes) >= MAX_PROCESSES:
-            _wait_processes(processes)
-
-        processes.append(
-            Process(target=_process, name=filename, args=(G, filename), kwargs=params)
-        )
+            'alns_n_iterations': 500,
+            'alns_batch_size': batch_size,
+            'alns_batch_workers': batch_workers,
+            'mip_repair': mip_repair,
+            'selection': selection,
+            'paired': paired}
+
+    profiler = _profiler('main', profile)
+    reductions = {filename: _preprocess(G, filename, profiler)
+                  for G, filename in _get_instances(profiler)}
+    profiler.dump()
+    terminations = {filename: _termination(reduction, time_limit, target, stagnation, gap)
+                    for filename, reduction in reductions.items()}
+    bounds = {filename: lower_bound(reduction.instance, bound, solver=lp_solver)
+              for filename, reduction in reductions.items()}
+    for filename, reduction in reductions.items():
+        print(f"Lower bound of {filename}: {reduction.lower_bound(bounds[filename])}")
+
+    with ExitStack() as shared:
+        # workers receive the path of the memory-mapped arrays, not a copy of them
+        instances = [(shared.enter_context(SharedInstance(reduction.instance)), filename)
+                     for filename, reduction in reductions.items()]
+
+        if n_islands:
+            _run_islands(instances, reductions, terminations, bounds, n_runs, seed, params,
+                         n_islands, migration_interval)
+        else:
+            _run(instances, reductions, terminations, bounds, n_workers, n_runs, seed, params, checkpoint_interval,
+                 profile)
+
+
+def _run(instances, reductions, terminations, bounds, n_workers, n_runs, seed, params, checkpoint_interval,
+         profile=None):
+    os.makedirs(LOGPATH, exist_ok=True)
+    if checkpoint_interval:
+        os.makedirs(CHECKPOINTPATH, exist_ok=True)
+    finished = {filename: dict() for _, filename in instances}
+    with ProcessPoolExecutor(max_workers=n_workers or os.cpu_count()) as executor:
+        futures = [executor.submit(_process, *task, checkpoint_interval=checkpoint_interval,
+                                   termination=terminations[task[1]], lower_bound=bounds[task[1]],
+                                   profile=profile, **params)
+                   for task in _schedule(instances, n_runs, seed)]
+
+        for future in as_completed(futures):
+            filename, repetition, result, elapsed = future.result()
+            value = reductions[filename].value(result['best'].value)
+            print(f"DONE {filename} {repetition+1}/{n_runs}: {value} in {elapsed:.1f}s")
+
+            finished[filename][repetition] = (result, elapsed)
+            if len(finished[filename]) == n_runs:
+                _save_results(filename, finished.pop(filename), reductions[filename], bounds[filename])
+
+
+def _run_islands(instances, reductions, terminations, bounds, n_runs, seed, params, n_islands, migration_interval):
+    """Each repetition is an island model run using n_islands processes"""
+    finished = {filename: dict() for _, filename in instances}
+    for G, filename, repetition, run_seed in _schedule(instances, n_runs, seed):
+        print(f"RUN {filename} #{repetition+1} (seed {run_seed}) on {n_islands} islands")
+        t0 = time()
+        result = IslandModel(G, n_islands, migration_interval, seed=run_seed,
+                             termination=terminations[filename], lower_bound=bounds[filename], **params).run()
+        elapsed = time() - t0
+        value = reductions[filename].value(result['best'].value)
+        print(f"DONE {filename} {repetition+1}/{n_runs}: {value} in {elapsed:.1f}s")
 
-        processes[-1].start()
+        finished[filename][repetition] = (result, elapsed)
+        if len(finished[filename]) == n_runs:
+            _save_results(filename, finished.pop(filename), reductions[filename], bounds[filename])
 
-    _wait_processes(processes, limit=1)
-        
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="ALNS for Steiner prize collecting problem")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="number of worker processes (defaults to the number of cores)")
+    parser.add_argument('--runs', type=int, default=N_RUNS, help="repetitions per instance")
+    parser.add_argument('--seed', type=int, default=SEED, help="seed of the first repetition")
+    parser.add_argument('--batch-size', type=int, default=1,
+                        help="candidates generated per ALNS iteration")
+    parser.add_argument('--batch-workers', type=int, default=0,
+                        help="worker processes generating the candidates of a batch (0 runs them in-process)")
+    parser.add_argument('--initial', choices=list(HEURISTICS), default=DEFAULT_HEURISTIC,
+                        help="constructive heuristic of the initial solution")
+    parser.add_argument('--checkpoint-interval', type=int, default=CHECKPOINT_INTERVAL,
+                        help=f"temperature iterations between checkpoints in {CHECKPOINTPATH} "
+                             "(0 disables them); interrupted repetitions resume from theirs")
+    parser.add_argument('--time-limit', type=float, default=None,
+                        help="seconds per repetition, the cooling schedule is stretched to end with them")
+    parser.add_argument('--target', type=float, default=None,
+                        help="stop a repetition once its best value reaches this one")
+    parser.add_argument('--stagnation', type=int, default=None,
+                        help="stop a repetition after this many temperature iterations without a new best")
+    parser.add_argument('--gap', type=float, default=None,
+                        help="stop a repetition once its best value is within this relative gap of the lower bound")
+    parser.add_argument('--bound', choices=list(BOUNDS), default='voronoi',
+                        help="lower bound of the instances, lp solves a linear relaxation (needs Pyomo)")
+    parser.add_argument('--lp-solver', default='glpk', help="solver of the lp bound")
+    parser.add_argument('--mip-repair', action='store_true',
+                        help="add a repair operator solving the destroyed region exactly (needs Pyomo)")
+    parser.add_argument('--mip-solver', default='glpk', help="solver of the mip repair")
+    parser.add_argument('--mip-time-limit', type=float, default=1.0, help="seconds per mip repair")
+    parser.add_argument('--mip-max-nodes', type=int, default=60, help="nodes of the mip repair subproblems")
+    parser.add_argument('--selection', choices=list(SELECTIONS), default=DEFAULT_SELECTION,
+                        help="operator selection policy, all but roulette reward the score per CPU second")
+    parser.add_argument('--paired', action='store_true',
+                        help="select destroy x repair pairs instead of each operator on its own")
+    parser.add_argument('--profile', choices=MODES, default=None,
+                        help=f"profile the phases of every repetition into {PROFILEPATH}")
+    parser.add_argument('--profile-phases', nargs='+', choices=PHASES, default=None,
+                        help="phases to profile (all by default), nested phases go into the outermost")
+    parser.add_argument('--profile-interval', type=float, default=0.001,
+                        help="seconds between samples of the sample profiler")
+    parser.add_argument('--islands', type=int, default=0,
+                        help="run each repetition as an island model with this many islands")
+    parser.add_argument('--migration-interval', type=int, default=10,
+                        help="temperature iterations between island migrations")
+    args = parser.parse_args()
+
+    main(args.workers, args.runs, args.seed, args.islands, args.migration_interval,
+         args.batch_size, args.batch_workers, args.initial, args.checkpoint_interval,
+         args.time_limit, args.target, args.stagnation,
+         args.profile and {'mode': args.profile, 'phases': args.profile_phases,
+                           'interval': args.profile_interval},
+         args.gap, args.bound, args.lp_solver,
+         {'solver': args.mip_solver, 'time_limit': args.mip_time_limit,
+          'max_nodes': args.mip_max_nodes} if args.mip_repair else None,
+         args.selection, args.paired)
@@ -0,0 +1,337 @@
+import os
+import sys
+import json
+import pickle
+import argparse
+import resource
+import numpy as np
+from time import perf_counter
+from concurrent.futures import ProcessPoolExecutor
+
+from alns import utils
+from alns.compact_instance import CompactInstance
+from alns.constructive import DEFAULT_HEURISTIC, HEURISTICS, initial_solution
+from alns.operators import DestroyOperator, RepairOperator
+from alns.reductions import reduce_instance
+from alns.simmulated_annealing import SimulatedAnnealing
+from alns.solution_instance import SolutionInstance
+from alns.termination import MaxIterations
+
+''' Benchmark suite: runs a fixed, seeded matrix of instances through
+preprocessing, initial solution and SimulatedAnnealing, then times every
+operator on frozen solution snapshots, and compares both against a stored
+baseline. The baseline holds timings, so it is only meaningful on the
+machine that saved it (--save-baseline). Exits with 1 on a regression. '''
+
+BENCHPATH = 'data/benchmarks'
+CACHEPATH = 'data/cache'
+MATRIX = [
+    'data/real_instances/a0200RandGraph.1.2.stp',
+    'data/real_instances/i101M1.stp',
+    'data/real_instances/steinc1-wmax:10-seed:33000-gw.dat',
+    'data/real_instances/steinc2-wmax:100-seed:33000-gw.dat',
+    'data/toys/toy_generated-1.pickle',
+    'data/toys/toy_generated-6.pickle',
+    'data/toys/toy_generated-12.pickle',
+]
+SEEDS = (0, 1)
+
+
+def t_function(t: float, t0: float, beta=200) -> float:
+    return t0 - beta * t
+
+
+PARAMS = {'temperature': 250,
+          't_function': t_function,
+          'alns_scores': [7, 3.5, 1, 0],
+          'alns_decay': 0.8,
+          'alns_n_iterations': 100}
+N_TEMPERATURE_ITERATIONS = 10
+TARGET_GAP = 0.01     # time to target is the time to get within 1% of the best known value
+TOLERANCE = 0.15      # relative slack of the timings before they count as a regression
+GAP_TOLERANCE = 0.005  # absolute slack of the gap to the best known value
+TIME_SLACK = 0.05     # seconds of the time to target that are clock noise, not a regression
+N_REPEATS = 20        # calls of each operator on each snapshot
+
+
+def _read(file) -> CompactInstance:
+    if file.endswith('pickle'):
+        return CompactInstance.from_graph(pickle.load(open(file, "rb")))
+    return utils.read_instance(file, CACHEPATH)
+
+
+def _peak_rss() -> float:
+    """Peak resident memory of the process in MiB (ru_maxrss is in KiB on Linux)"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+### runs ###
+
+def run_case(file, seed, heuristic=DEFAULT_HEURISTIC, n_temperature_iterations=N_TEMPERATURE_ITERATIONS):
+    """
+    One cell of the matrix, run in a fresh process so that its peak RSS is
+    its own. Values are those of the original instance
+    """
+    t0 = perf_counter()
+    instance = _read(file)
+    t_parse = perf_counter() - t0
+
+    t0 = perf_counter()
+    reduction = reduce_instance(instance)
+    t_preprocess = perf_counter() - t0
+
+    rnd_state = utils.random_state(seed)
+    t0 = perf_counter()
+    initial = initial_solution(reduction.instance, heuristic, rnd_state)
+    t_initial = perf_counter() - t0
+
+    sa = SimulatedAnnealing(initial_solution=initial, termination=MaxIterations(n_temperature_iterations),
+                            rnd_state=rnd_state, **PARAMS)
+    t0 = perf_counter()
+    result = sa.simulate()
+    t_search = perf_counter() - t0
+
+    iterations = result['statistics'].iterations()
+    return {'instance': os.path.basename(file),
+            'seed': seed,
+            'parse': t_parse,
+            'preprocess': t_preprocess,
+            'initial': t_initial,
+            'search': t_search,
+            'iterations': int(len(iterations['best'])),
+            'iterations_per_sec': len(iterations['best']) / t_search,
+            'initial_value': reduction.value(initial.value),
+            'value': reduction.value(result['best'].value),
+            'best_curve': np.minimum(iterations['best'] + reduction.offset, reduction.leftover_value).tolist(),
+            'elapsed_curve': iterations['elapsed'].tolist(),
+            'peak_rss': _peak_rss()}
+
+
+def time_to_target(run, best_known, target_gap=TARGET_GAP):
+    """Seconds of search until the best value was within target_gap of best_known, None if never"""
+    target = best_known + abs(best_known) * target_gap
+    reached = np.flatnonzero(np.asarray(run['best_curve']) <= target)
+    return run['elapsed_curve'][reached[0]] if len(reached) else None
+
+
+def gap(value, best_known) -> float:
+    return (value - best_known) / abs(best_known) if best_known else value - best_known
+
+
+def run_matrix(files, seeds, n_workers=1, **kwargs) -> list:
+    # one task per process: the peak RSS and the caches of a run are not shared with the next
+    with ProcessPoolExecutor(max_workers=n_workers, max_tasks_per_child=1) as executor:
+        futures = [executor.submit(run_case, file, seed, **kwargs) for file in files for seed in seeds]
+        return [future.result() for future in futures]
+
+
+### operators ###
+
+def _snapshot_files(file):
+    name = os.path.join(BENCHPATH, 'snapshots', os.path.basename(file))
+    return f"{name}.npz", f"{name}.pickle"
+
+
+def make_snapshots(file, seed=0, heuristic=DEFAULT_HEURISTIC):
+    """
+    Freezes the reduced instance, its initial solution and the best one after a short
+    run, each with a destroyed copy for the repair operators. Snapshots are only made
+    when missing, so later changes to the reductions or the search do not move them
+    """
+    instance_file, solutions_file = _snapshot_files(file)
+    if os.path.exists(instance_file) and os.path.exists(solutions_file):
+        return
+    os.makedirs(os.path.dirname(instance_file), exist_ok=True)
+
+    instance = reduce_instance(_read(file)).instance
+    rnd_state = utils.random_state(seed)
+    initial = initial_solution(instance, heuristic, rnd_state)
+    sa = SimulatedAnnealing(initial_solution=initial, termination=MaxIterations(2), rnd_state=rnd_state, **PARAMS)
+    best = sa.simulate()['best']
+
+    snapshots = []
+    for name, solution in (('initial', initial), ('searched', best)):
+        destroyed = DestroyOperator.random_removal(solution, utils.random_state(seed))
+        snapshots.append({'name': name, 'solution': solution.to_state(), 'destroyed': destroyed.to_state()})
+
+    instance.save_npz(instance_file)
+    with open(solutions_file, 'wb') as f:
+        pickle.dump(snapshots, f)
+
+
+def benchmark_operators(file, n_repeats=N_REPEATS) -> list:
+    """
+    Median and minimum time of each operator on each snapshot of the instance.
+    A first untimed call warms the shortest path cache, as it is during a run
+    """
+    instance_file, solutions_file = _snapshot_files(file)
+    instance = CompactInstance.load_npz(instance_file)
+    with open(solutions_file, 'rb') as f:
+        snapshots = pickle.load(f)
+
+    rows = []
+    for snapshot in snapshots:
+        solution = SolutionInstance.from_state(instance, snapshot['solution'])
+        destroyed = SolutionInstance.from_state(instance, snapshot['destroyed'])
+        operators = [(op, lambda i: (solution, utils.random_state(i))) for op in DestroyOperator.operators] + \
+                    [(op, lambda i: (destroyed.copy(), solution, utils.random_state(i)))
+                     for op in RepairOperator.operators]
+        for operator, arguments in operators:
+            operator(*arguments(0))
+            times = []
+            for i in range(n_repeats):
+                args = arguments(i)
+                t0 = perf_counter()
+                operator(*args)
+                times.append(perf_counter() - t0)
+            rows.append({'instance': os.path.basename(file),
+                         'snapshot': snapshot['name'],
+                         'operator': operator.__name__,
+                         'median': float(np.median(times)),
+                         'min': float(np.min(times))})
+    return rows
+
+
+### baseline ###
+
+def _load_json(file, default):
+    if not os.path.exists(file):
+        return default
+    with open(file) as f:
+        return json.load(f)
+
+
+def _save_json(file, data) -> None:
+    os.makedirs(os.path.dirname(file), exist_ok=True)
+    with open(file, 'w') as f:
+        json.dump(data, f, indent=1, sort_keys=True)
+
+
+def update_best_known(runs, best_known: dict) -> bool:
+    """Lowers the best known values with those of the runs, True if one changed"""
+    changed = False
+    for run in runs:
+        if run['value'] < best_known.get(run['instance'], np.inf):
+            best_known[run['instance']] = run['value']
+            changed = True
+    return changed
+
+
+def summarize(runs, operators, best_known) -> dict:
+    """The figures compared between benchmarks, keyed by case"""
+    summary = {'runs': {}, 'operators': {}}
+    for run in runs:
+        known = best_known[run['instance']]
+        summary['runs'][f"{run['instance']}#{run['seed']}"] = {
+            'iterations_per_sec': run['iterations_per_sec'],
+            'time_to_target': time_to_target(run, known),
+            'value': run['value'],
+            'gap': gap(run['value'], known),
+            'peak_rss': run['peak_rss'],
+            'preprocess': run['preprocess'],
+            'initial': run['initial'],
+        }
+    for row in operators:
+        summary['operators'][f"{row['instance']}/{row['snapshot']}/{row['operator']}"] = {
+            'median': row['median'], 'min': row['min']}
+    return summary
+
+
+def compare(summary, baseline, best_known, tolerance=TOLERANCE, gap_tolerance=GAP_TOLERANCE) -> list:
+    """
+    Regressions against the baseline, as (case, metric, baseline, current).
+    The baseline gaps are taken again against the current best known values
+    """
+    regressions = []
+
+    def slower(case, metric, base, current, higher_is_worse=True, slack=0.0):
+        if base is None:
+            return
+        if current is None or (current > base * (1 + tolerance) + slack if higher_is_worse
+                               else current < base * (1 - tolerance)):
+            regressions.append((case, metric, base, current))
+
+    for case, current in summary['runs'].items():
+        base = baseline.get('runs', {}).get(case)
+        if base is None:
+            continue
+        slower(case, 'iterations_per_sec', base['iterations_per_sec'], current['iterations_per_sec'],
+               higher_is_worse=False)
+        slower(case, 'time_to_target', base['time_to_target'], current['time_to_target'], slack=TIME_SLACK)
+        slower(case, 'peak_rss', base['peak_rss'], current['peak_rss'])
+        base_gap = gap(base['value'], best_known[case.split('#')[0]])
+        if current['gap'] > base_gap + gap_tolerance:
+            regressions.append((case, 'gap', base_gap, current['gap']))
+
+    for case, current in summary['operators'].items():
+        base = baseline.get('operators', {}).get(case)
+        if base is not None:
+            slower(case, 'median', base['median'], current['median'])
+    return regressions
+
+
+def _print_summary(summary) -> None:
+    print(f"{'case':<44}{'it/s':>10}{'to target':>11}{'gap':>9}{'RSS MiB':>9}")
+    for case, run in summary['runs'].items():
+        to_target = '-' if run['time_to_target'] is None else f"{run['time_to_target']:.2f}"
+        print(f"{case:<44}{run['iterations_per_sec']:>10.1f}{to_target:>11}"
+              f"{run['gap']:>9.2%}{run['peak_rss']:>9.1f}")
+    print(f"\n{'operator':<72}{'median ms':>10}{'min ms':>10}")
+    for case, row in summary['operators'].items():
+        print(f"{case:<72}{row['median'] * 1e3:>10.3f}{row['min'] * 1e3:>10.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark suite with regression tracking")
+    parser.add_argument('files', nargs='*', help="instances (defaults to the fixed matrix)")
+    parser.add_argument('--seeds', nargs='+', type=int, default=list(SEEDS))
+    parser.add_argument('--initial', choices=list(HEURISTICS), default=DEFAULT_HEURISTIC)
+    parser.add_argument('--temperature-iterations', type=int, default=N_TEMPERATURE_ITERATIONS)
+    parser.add_argument('--repeats', type=int, default=N_REPEATS, help="calls of each operator per snapshot")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="runs in parallel (they then compete for the CPU and the timings suffer)")
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    parser.add_argument('--gap-tolerance', type=float, default=GAP_TOLERANCE)
+    parser.add_argument('--no-operators', action='store_true', help="skip the operator micro-benchmarks")
+    parser.add_argument('--save-baseline', action='store_true', help="store the results as the baseline")
+    args = parser.parse_args()
+
+    files = args.files or MATRIX
+    baseline_file = os.path.join(BENCHPATH, 'baseline.json')
+    best_known_file = os.path.join(BENCHPATH, 'best_known.json')
+
+    runs = run_matrix(files, args.seeds, args.workers, heuristic=args.initial,
+                      n_temperature_iterations=args.temperature_iterations)
+    best_known = _load_json(best_known_file, {})
+    if update_best_known(runs, best_known):
+        _save_json(best_known_file, best_known)
+
+    operators = []
+    if not args.no_operators:
+        for file in files:
+            make_snapshots(file, heuristic=args.initial)
+            operators += benchmark_operators(file, args.repeats)
+
+    summary = summarize(runs, operators, best_known)
+    _save_json(os.path.join(BENCHPATH, 'latest.json'), summary)
+    _print_summary(summary)
+
+    if args.save_baseline:
+        _save_json(baseline_file, summary)
+        print(f"\nBaseline saved to {baseline_file}")
+        return
+
+    baseline = _load_json(baseline_file, None)
+    if baseline is None:
+        print(f"\nNo baseline in {baseline_file}, run with --save-baseline")
+        return
+    regressions = compare(summary, baseline, best_known, args.tolerance, args.gap_tolerance)
+    for case, metric, base, current in regressions:
+        print(f"REGRESSION {case} {metric}: {base} -> {current}")
+    if regressions:
+        sys.exit(1)
+    print("\nNo regression")
+
+
+if __name__ == '__main__':
+    main()
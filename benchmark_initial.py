@@ -0,0 +1,42 @@
+import os
+import argparse
+from time import time
+
+from alns import utils
+from alns.constructive import HEURISTICS, initial_solution
+from alns.reductions import reduce_instance
+
+''' Compares the constructive heuristics of the initial
+solution (value and time) on the reduced instances. '''
+
+FILEPATH = 'data/to_run'
+CACHEPATH = 'data/cache'
+SEED = 0
+
+
+def benchmark(instance, heuristics=tuple(HEURISTICS), seed=SEED):
+    rows = []
+    for name in heuristics:
+        t0 = time()
+        solution = initial_solution(instance, name, utils.random_state(seed))
+        rows.append((name, solution.value, time() - t0))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the initial solution heuristics")
+    parser.add_argument('files', nargs='*', help=f"instances (defaults to {FILEPATH})")
+    parser.add_argument('--heuristics', nargs='+', choices=list(HEURISTICS), default=list(HEURISTICS))
+    args = parser.parse_args()
+
+    files = args.files or sorted(os.path.join(FILEPATH, f) for f in os.listdir(FILEPATH)
+                                 if f.endswith(('stp', 'dat')))
+    print(f"{'instance':<30}{'heuristic':<10}{'value':>14}{'time (s)':>10}")
+    for file in files:
+        reduction = reduce_instance(utils.read_instance(file, CACHEPATH))
+        for name, value, elapsed in benchmark(reduction.instance, args.heuristics):
+            print(f"{os.path.basename(file):<30}{name:<10}{reduction.value(value):>14.2f}{elapsed:>10.3f}")
+
+
+if __name__ == '__main__':
+    main()
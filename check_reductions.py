@@ -0,0 +1,88 @@
+import os
+import sys
+import glob
+import pickle
+import argparse
+
+from alns import utils
+from alns.bounds import voronoi_bound, lp_bound
+from alns.compact_instance import CompactInstance
+from alns.reductions import reduce_instance
+
+''' Checks the reductions against exact optima: on every instance, the
+optimum of the reduced instance, taken back to the original one (see
+Reduction.value and expand_result), must be the optimum of the original
+instance, and the lower bounds of the reduced instance, taken back by
+Reduction.lower_bound, must not exceed it. Needs Pyomo and a MIP solver (see alns.solver), so only small
+instances belong here. Exits with 1 on a mismatch. '''
+
+FILES = sorted(glob.glob('data/toys/*.pickle')) + ['data/to_run/C01-A.stp']
+TOLERANCE = 1e-6
+
+
+def _read(file) -> CompactInstance:
+    if file.endswith('pickle'):
+        return CompactInstance.from_graph(pickle.load(open(file, "rb")))
+    return utils.read_instance(file)
+
+
+def _optimum(instance: CompactInstance, solver: str):
+    """Optimal solution, None when the instance has no edge to model"""
+    from alns.solver import solve
+    if not instance.n_edges or not instance.terminals.any():
+        return None
+    result = solve(instance, solver=solver)
+    if not result['optimal']:
+        raise RuntimeError(f"{solver} did not prove the optimum")
+    return result['solution']
+
+
+def _value(instance: CompactInstance, solution) -> float:
+    """Value of the solution, or of the best lone node (or empty) solution without one"""
+    lone = instance.total_prize - (instance.prizes.max() if instance.n_nodes else 0.0)
+    return lone if solution is None else min(solution.value, lone)
+
+
+def check(file, solver) -> list:
+    """Mismatches of the instance as (what, expected, got)"""
+    instance = _read(file)
+    optimum = _value(instance, _optimum(instance, solver))
+
+    reduction = reduce_instance(instance)
+    reduced = _optimum(reduction.instance, solver)
+    errors = []
+    value = reduction.value(_value(reduction.instance, reduced))
+    if abs(value - optimum) > TOLERANCE:
+        errors.append(('reduced optimum + offset', optimum, value))
+    if reduced is not None:
+        best = reduction.expand_result({'initial': reduced, 'best': reduced, 'current': reduced})['best']
+        if abs(best.value - reduction.value(reduced.value)) > TOLERANCE:
+            errors.append(('expanded optimum', reduction.value(reduced.value), best.value))
+        if (instance.edge_nodes(best.edges) & ~best.nodes).any():
+            errors.append(('expanded nodes', 'every edge end', 'missing ends'))
+    bounds = {'voronoi': voronoi_bound(reduction.instance),
+              'lp': lp_bound(reduction.instance, solver) if reduction.instance.n_edges else None}
+    for name, bound in bounds.items():
+        if bound is not None and reduction.lower_bound(bound) > optimum + TOLERANCE:
+            errors.append((f'{name} bound + offset', f'at most {optimum}', reduction.lower_bound(bound)))
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Checks the reductions against MIP optima")
+    parser.add_argument('files', nargs='*', help="instances (defaults to the toys and C01-A)")
+    parser.add_argument('--solver', default='glpk', help="MIP solver of the optima")
+    args = parser.parse_args()
+
+    failed = False
+    for file in args.files or FILES:
+        errors = check(file, args.solver)
+        print(f"{os.path.basename(file):<30}{'FAIL' if errors else 'ok'}")
+        for what, expected, got in errors:
+            print(f"    {what}: expected {expected}, got {got}")
+        failed |= bool(errors)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
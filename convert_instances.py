@@ -0,0 +1,50 @@
+import os
+import pickle
+import argparse
+
+from alns import utils
+from alns.compact_instance import CompactInstance
+from alns.reductions import reduce_instance
+
+''' Converts .stp, .dat and pickled instances into the
+memory-mapped .csr format (see CompactInstance.save),
+which alns_steiner.py and process_results.py open
+without parsing.'''
+
+FILEPATH = 'data/to_run'
+CSRPATH = 'data/csr'
+
+
+def convert(file, out_dir=CSRPATH, preprocess=False):
+    if file.endswith('pickle'):
+        instance = CompactInstance.from_graph(pickle.load(open(file, "rb")))
+    else:
+        instance = utils.read_instance(file)
+
+    name = os.path.splitext(os.path.basename(file))[0]
+    directory = os.path.join(out_dir, f'{name}.csr')
+    if preprocess:
+        # with the original instance and the log to expand the solutions back to it
+        reduce_instance(instance).save(directory, source=os.path.basename(file))
+    else:
+        instance.save(directory, source=os.path.basename(file), preprocessed=False)
+    return directory
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert instances to the .csr format")
+    parser.add_argument('files', nargs='*', help=f"instances to convert (defaults to {FILEPATH})")
+    parser.add_argument('--out', default=CSRPATH, help="output directory")
+    parser.add_argument('--preprocess', action='store_true',
+                        help="store the reduced instance (see alns.reductions)")
+    args = parser.parse_args()
+
+    files = args.files or [os.path.join(FILEPATH, f) for f in os.listdir(FILEPATH)]
+    for file in files:
+        if not file.endswith(('stp', 'dat', 'pickle')):
+            continue
+        print(f"Converting: {file} -> {convert(file, args.out, args.preprocess)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -2,11 +2,13 @@
 import networkx as nx
 import alns.utils as utils
 import alns.improvement as imp
-from alns.solution_instance import SolutionInstance
+from alns.compact_instance import CompactInstance
+from alns.constructive import initial_solution
 from alns.simmulated_annealing import SimulatedAnnealing
 
 
 file_name = "data/real_instances/cc3-5nu.stp"
+heuristic = "sph"  # one of alns.constructive.HEURISTICS
 G = utils.parse_instance(file_name)
 nG = imp.remove_leaves(G)
 print(f"nodes before preprocessing: {len(G)}")
@@ -16,7 +18,8 @@ print(f"nodes after preprocessing: {len(nG)}")
 def t_function_2(t: float, t0: float, beta=200) -> float:
     return t0 - beta * t
 
-initial_solution = imp.greedy_initial_solution(nG)
+instance = CompactInstance.from_graph(nG)
+initial = initial_solution(instance, heuristic)
 
 params = {'temperature': 250,
             't_function': t_function_2,
@@ -24,13 +27,8 @@ params = {'temperature': 250,
             'alns_decay': 0.8,
             'alns_n_iterations': 500}
 
-origin_nodes = [n[0] for n in nG.nodes(data=True)]
-
-initial_solution = SolutionInstance(nG, 
-    initial_solution, instance_nodes=origin_nodes)
-
 sa = SimulatedAnnealing(
-    initial_solution=initial_solution, **params)
+    initial_solution=initial, **params)
 
 result = sa.simulate()
 utils.plot_graph(nG, 
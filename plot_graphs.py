@@ -84,23 +84,22 @@ def main():
 
         results = result_dict["results"]
 
-        d_count_all = pd.DataFrame()
+        d_count_all = list()
         d_best_all = list()
-        r_count_all = pd.DataFrame()
+        r_count_all = list()
         r_best_all = list()
         y_val = list()
         already_plotted_weights = False
         for item in results:
             statistics = item['statistics']
-            y_val.append(statistics.best_evaluations())
+            # one column per operator, one row per temperature iteration
+            y_val.append(statistics.temperature_iterations()['best'])
 
-            d_count = pd.DataFrame(statistics.destroy_operator_counts()).sum()
-            d_count_all = d_count_all.append(d_count, ignore_index=True)
-            d_best_all.append(statistics.repair_operator_n_improvements())
+            d_count_all.append(pd.DataFrame(statistics.destroy_operator_counts()).sum())
+            d_best_all.append(statistics.destroy_operator_n_improvements())
 
-            r_count = pd.DataFrame(statistics.repair_operator_counts()).sum()
-            r_count_all = r_count_all.append(r_count, ignore_index=True)
-            r_best_all.append(statistics.destroy_operator_n_improvements())
+            r_count_all.append(pd.DataFrame(statistics.repair_operator_counts()).sum())
+            r_best_all.append(statistics.repair_operator_n_improvements())
 
             if not already_plotted_weights:
                 plot_operators_weight(statistics.destroy_operator_weights(),
@@ -109,8 +108,8 @@ def main():
                 already_plotted_weights = True
         plot_prize_iteration(y_val, filename, ana_dir)
 
-        plot_operators_usage(d_count_all, pd.DataFrame(d_best_all),
-                             r_count_all, pd.DataFrame(r_best_all),
+        plot_operators_usage(pd.DataFrame(d_count_all), pd.DataFrame(d_best_all),
+                             pd.DataFrame(r_count_all), pd.DataFrame(r_best_all),
                              ana_dir,
                              filename)
 
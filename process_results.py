@@ -7,12 +7,28 @@ import numpy as np
 from matplotlib import pyplot as plt
 
 from alns import utils
+from alns.bounds import optimality_gap
 import alns.improvement as imp
 from alns.solution_instance import SolutionInstance
 
 RESULTPATH = 'data/results'
 ANALYSISPATH = 'data/analysis'
-HEADER = ['Instance', 'Result 1', 'Result 2', 'Result 3', 'Result 4', 'Result 5', 'Avg', 'Std', 'Avg time', 'Std time', 'Avg initial', 'Std initial']
+# columns after the instance and its results (as many as the runs, see header)
+HEADER = ['Avg', 'Std', 'Avg time', 'Std time', 'Avg initial', 'Std initial',
+          'Avg time to best', 'Avg iterations', 'Lower bound', 'Avg gap']
+
+
+def header(n_results: int) -> list:
+    return ['Instance', *(f'Result {i}' for i in range(1, n_results + 1)), *HEADER]
+
+
+def time_to_best(statistics) -> float:
+    """Seconds until the temperature iteration that first reached the final best value"""
+    columns = statistics.temperature_iterations()
+    if not columns:
+        return 0.0
+    best = columns['best']
+    return float(columns['elapsed'][np.argmax(best <= best[-1])])
 
 
 def main(generate_img=False, show=False):
@@ -34,12 +50,8 @@ def main(generate_img=False, show=False):
         graphs = [g["best"] for g in result_dict["results"]]
         for graphs in result_dict["results"]:
             g = graphs["best"]
-            for n in g.solution.nodes(data=True):
-                g.solution.nodes[n[0]]["prize"] = g.instance.nodes[n[0]]["prize"]
-                g.solution.nodes[n[0]]["terminal"] = g.instance.nodes[n[0]]["terminal"]
-                
             G = imp.remove_leaves(g.solution)
-            G = SolutionInstance(g.instance, G)
+            G = SolutionInstance.from_graph(g.instance, G)
             graphs["best"] = G
 
         results = result_dict["results"]
@@ -48,16 +60,22 @@ def main(generate_img=False, show=False):
 
         values = np.array(list(map(lambda x: x["best"].value, results)))
         initial_values = np.array(list(map(lambda x: x["initial"].value, results)))
-        rows.append([
-            dir,
-            *values,
+        times_to_best = [time_to_best(s) for s in statistics]
+        iterations = [s.n_alns_iterations() for s in statistics]
+        bound = result_dict.get("lower_bound")
+        gap = None if bound is None else np.mean([optimality_gap(value, bound) for value in values])
+        rows.append((dir, values.tolist(), [
             np.mean(values),
             np.std(values),
             np.mean(timing),
             np.std(timing),
             np.mean(initial_values),
-            np.std(initial_values)
-        ])
+            np.std(initial_values),
+            np.mean(times_to_best),
+            np.mean(iterations),
+            bound,
+            gap
+        ]))
 
         if not generate_img:
             continue
@@ -77,8 +95,11 @@ def main(generate_img=False, show=False):
     
     with open(os.path.join(ANALYSISPATH, f'result-analysis-{int(time())}.csv'), 'w') as outfile:
         writer = csv.writer(outfile)
-        writer.writerow(HEADER)
-        writer.writerows(rows)
+        # instances with fewer runs (see alns_steiner.py --runs) leave their last results empty
+        n_results = max((len(values) for _, values, _ in rows), default=0)
+        writer.writerow(header(n_results))
+        writer.writerows([instance, *values, *[''] * (n_results - len(values)), *summary]
+                         for instance, values, summary in rows)
 
 
 if __name__ == '__main__':
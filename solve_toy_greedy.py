@@ -1,16 +1,17 @@
 import pickle
 import matplotlib.pyplot as plt
 
+from alns.compact_instance import CompactInstance
 from alns.improvement import greedy_initial_solution
-from alns.utils import plot_graph, evaluate
+from alns.utils import plot_graph
 
 
 def main():
     filename = "data/toys/toy_generated-1.pickle"
     graph = pickle.load(open(filename, "rb"))
-    initial_sol = greedy_initial_solution(graph)
-    evaluation = evaluate(graph, initial_sol)
-    plot_graph(graph, solution=initial_sol)
+    initial_sol = greedy_initial_solution(CompactInstance.from_graph(graph))
+    evaluation = initial_sol.value
+    plot_graph(graph, solution=initial_sol.solution)
     plt.show()
 
 